@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, time as hora_del_dia, timedelta
+from itertools import chain
+import numpy as np
+from sqlalchemy import extract, select
+from . import database, estados_pedido, models
+
+# Analítica de productos sobre las líneas de pedido (más vendidos, productos
+# comprados juntos y mezcla por hora).
+# Las líneas del rango se cargan una vez como arreglos columnares de NumPy y
+# todas las agregaciones son vectorizadas (bincount / unique), sin bucles por
+# fila en Python. Los arreglos se guardan en caché por rango de fechas.
+
+ANALISIS_TTL_SEGUNDOS = 300
+ANALISIS_MAX_RANGOS = 32
+FILAS_POR_LOTE = 50_000
+
+class LineasPedido:
+    # Columnas de las líneas de pedidos no cancelados de un rango
+    def __init__(self, pedido, producto, cantidad, precio, hora):
+        self.pedido = pedido
+        self.cantidad = cantidad
+        self.ingreso = cantidad * precio
+        self.hora = hora
+        # Productos como índices densos 0..P-1 para agrupar con bincount
+        self.productos, self.producto_idx = np.unique(producto, return_inverse=True)
+
+    def __len__(self):
+        return len(self.pedido)
+
+    def top_productos(self, orden="ingresos", limite=10):
+        n = len(self.productos)
+        unidades = np.bincount(self.producto_idx, weights=self.cantidad, minlength=n)
+        ingresos = np.bincount(self.producto_idx, weights=self.ingreso, minlength=n)
+        pedidos = np.bincount(self._pares_pedido_producto()[1], minlength=n)
+
+        criterio = ingresos if orden == "ingresos" else unidades
+        mejores = np.argsort(-criterio, kind="stable")[:limite]
+        return [
+            {
+                "producto_id": int(self.productos[i]),
+                "ingresos": int(ingresos[i]),
+                "unidades": int(unidades[i]),
+                "pedidos": int(pedidos[i]),
+            }
+            for i in mejores
+        ]
+
+    def pares(self, producto_id=None, limite=10):
+        # Pares de productos presentes en un mismo pedido
+        pedido, producto = self._pares_pedido_producto()
+        total_pedidos = len(np.unique(pedido))
+        n = len(self.productos)
+        if total_pedidos == 0:
+            return []
+
+        # Dentro de cada pedido los productos vienen ordenados y sin repetir:
+        # cada elemento se empareja con los que le siguen en su mismo pedido
+        inicios = np.flatnonzero(np.r_[True, pedido[1:] != pedido[:-1]])
+        tamanos = np.diff(np.r_[inicios, len(pedido)])
+        posicion = np.arange(len(pedido)) - np.repeat(inicios, tamanos)
+        siguientes = np.repeat(tamanos, tamanos) - posicion - 1
+
+        izquierda = np.repeat(np.arange(len(pedido)), siguientes)
+        desplazamiento = np.arange(len(izquierda)) - np.repeat(np.cumsum(siguientes) - siguientes, siguientes) + 1
+        derecha = izquierda + desplazamiento
+
+        codigos, veces = np.unique(producto[izquierda] * n + producto[derecha], return_counts=True)
+        a, b = np.divmod(codigos, n)
+        pedidos_con = np.bincount(producto, minlength=n)
+
+        if producto_id is not None:
+            encontrado = np.flatnonzero(self.productos == producto_id)
+            if not len(encontrado):
+                return []
+            objetivo = encontrado[0]
+            incluye = (a == objetivo) | (b == objetivo)
+            a, b, veces = a[incluye], b[incluye], veces[incluye]
+            # El producto consultado siempre va primero
+            a, b = np.where(a == objetivo, a, b), np.where(a == objetivo, b, a)
+
+        mejores = np.argsort(-veces, kind="stable")[:limite]
+        return [
+            {
+                "producto_id": int(self.productos[a[i]]),
+                "acompanante_id": int(self.productos[b[i]]),
+                "pedidos_juntos": int(veces[i]),
+                "soporte": round(veces[i] / total_pedidos, 4),
+                "confianza": round(veces[i] / pedidos_con[a[i]], 4),
+                "lift": round(veces[i] * total_pedidos / (pedidos_con[a[i]] * pedidos_con[b[i]]), 2),
+            }
+            for i in mejores
+        ]
+
+    def mezcla_por_hora(self):
+        # Unidades por (hora, producto) en una matriz 24 x P
+        n = len(self.productos)
+        matriz = np.bincount(
+            self.hora * n + self.producto_idx, weights=self.cantidad, minlength=24 * n
+        ).reshape(24, n)
+        totales = matriz.sum(axis=1)
+        resultado = []
+        for hora in np.flatnonzero(totales):
+            columnas = np.flatnonzero(matriz[hora])
+            columnas = columnas[np.argsort(-matriz[hora, columnas], kind="stable")]
+            resultado.append({
+                "hora": int(hora),
+                "unidades": int(totales[hora]),
+                "productos": [
+                    {
+                        "producto_id": int(self.productos[c]),
+                        "unidades": int(matriz[hora, c]),
+                        "participacion": round(matriz[hora, c] / totales[hora], 4),
+                    }
+                    for c in columnas
+                ],
+            })
+        return resultado
+
+    def _pares_pedido_producto(self):
+        # (pedido, producto_idx) únicos, ordenados por pedido y luego producto
+        n = len(self.productos)
+        codigos = np.unique(self.pedido * n + self.producto_idx)
+        return np.divmod(codigos, n)
+
+
+def cargar_lineas(desde, hasta):
+    consulta = select(
+        models.ItemPedido.pedido_id,
+        models.ItemPedido.producto_id,
+        models.ItemPedido.cantidad,
+        models.ItemPedido.precio_unitario,
+        extract("hour", models.Pedido.fecha_creacion),
+    ).join(models.Pedido, models.Pedido.id == models.ItemPedido.pedido_id).where(
+        models.Pedido.estado != estados_pedido.CANCELADO,
+        models.ItemPedido.producto_id.isnot(None),
+        models.Pedido.fecha_creacion.isnot(None),
+    )
+    if desde:
+        consulta = consulta.where(models.Pedido.fecha_creacion >= datetime.combine(desde, hora_del_dia.min))
+    if hasta:
+        consulta = consulta.where(models.Pedido.fecha_creacion < datetime.combine(hasta + timedelta(days=1), hora_del_dia.min))
+
+    db = database.SessionLocal()
+    try:
+        resultado = db.execute(consulta.execution_options(stream_results=True, yield_per=FILAS_POR_LOTE))
+        # fromiter sobre los valores planos evita convertir fila por fila
+        lotes = [
+            np.fromiter(chain.from_iterable(lote), dtype=np.int64, count=len(lote) * 5).reshape(-1, 5)
+            for lote in resultado.partitions()
+        ]
+    finally:
+        db.close()
+
+    columnas = np.concatenate(lotes) if lotes else np.empty((0, 5), dtype=np.int64)
+    return LineasPedido(*columnas.T)
+
+
+class CacheAnalisis:
+    # LRU acotado con expiración, indexado por rango de fechas
+    def __init__(self, maximo, ttl):
+        self._lock = threading.Lock()
+        self._maximo = maximo
+        self._ttl = ttl
+        self._entradas = OrderedDict()  # (desde, hasta) -> (expira, LineasPedido)
+
+    def obtener(self, desde, hasta):
+        clave = (desde, hasta)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] >= time.monotonic():
+                self._entradas.move_to_end(clave)
+                return entrada[1]
+
+        # Se carga fuera del lock: otros rangos no esperan a esta consulta
+        lineas = cargar_lineas(desde, hasta)
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self._ttl, lineas)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self._maximo:
+                self._entradas.popitem(last=False)
+        return lineas
+
+
+cache = CacheAnalisis(ANALISIS_MAX_RANGOS, ANALISIS_TTL_SEGUNDOS)
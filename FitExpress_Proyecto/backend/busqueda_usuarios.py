@@ -0,0 +1,59 @@
+import sys
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from . import database, esquema, models
+
+# Columnas normalizadas de 'usuarios' (nombre_busqueda, rut_normalizado) que usa
+# la búsqueda por prefijo del panel admin. Los usuarios nuevos las reciben en
+# models.Usuario; los que ya existían antes de agregarlas quedan en NULL y no
+# aparecerían en la búsqueda hasta completarlas (la app lo hace al iniciar).
+#
+# Uso por consola:
+#   python -m backend.busqueda_usuarios completar   -> agrega las columnas si faltan y las rellena
+
+LOTE = 1000
+
+def completar(db: Session):
+    # Rellena por lotes las filas con alguna columna en NULL. Retorna cuántas tocó.
+    # Se puede correr con la app en marcha: escribe los mismos valores que el modelo.
+    total = 0
+    while True:
+        filas = db.query(models.Usuario.id, models.Usuario.nombre, models.Usuario.rut).filter(or_(
+            models.Usuario.nombre_busqueda.is_(None),
+            models.Usuario.rut_normalizado.is_(None),
+        )).order_by(models.Usuario.id).limit(LOTE).all()
+        if not filas:
+            return total
+        db.bulk_update_mappings(models.Usuario, [
+            {
+                "id": f.id,
+                "nombre_busqueda": models.normalizar_texto(f.nombre),
+                "rut_normalizado": models.normalizar_rut(f.rut),
+            }
+            for f in filas
+        ])
+        db.commit()
+        total += len(filas)
+
+def completar_al_iniciar():
+    # Al arrancar la app: si nadie corrió el comando tras agregar las columnas,
+    # los usuarios antiguos vuelven a ser buscables. Sin pendientes es una sola consulta.
+    db = database.SessionLocal()
+    try:
+        completar(db)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    comando = sys.argv[1] if len(sys.argv) > 1 else ""
+    db = database.SessionLocal()
+    try:
+        if comando == "completar":
+            esquema.actualizar()
+            print(f"✅ Búsqueda de usuarios completada: {completar(db)} usuarios")
+        else:
+            print("Uso: python -m backend.busqueda_usuarios completar")
+            sys.exit(2)
+    finally:
+        db.close()
@@ -0,0 +1,484 @@
+import gzip
+import heapq
+import json
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from itertools import chain
+from fastapi import HTTPException
+from . import eventos
+
+# Caché en memoria del catálogo de productos.
+# Cada escritura del admin sobre 'productos' incrementa la versión; mientras la
+# versión no cambie, el catálogo se sirve desde memoria sin consultar la BD.
+# El JSON se codifica una sola vez por versión y se entrega tal cual.
+# Además mantiene un índice ordenado por campo para responder filtros por rango
+# y un índice invertido de nombre/descripción para la búsqueda de texto.
+# Con varios workers, cada escritura avisa a los demás por eventos.py (NOTIFY)
+# en la misma transacción, y ellos descartan su copia: nadie sigue mostrando
+# precios o disponibilidad que ya no rigen en la BD.
+
+# Campos filtrables/ordenables y su ubicación dentro del producto publicado
+CAMPOS_INDEXADOS = {
+    "id": ("id",),
+    "precio": ("precio_base",),
+    "kcal": ("macros", "kcal"),
+    "proteina": ("macros", "p"),
+    "grasas": ("macros", "f"),
+    "carbs": ("macros", "c"),
+}
+
+def fila_producto(p):
+    # Sirve tanto para objetos Producto como para filas con las mismas columnas
+    return {
+        "id": p.id,
+        "nombre": p.nombre,
+        "precio_base": p.precio_base,
+        "imagen_url": p.imagen_url,
+        "tipo": p.tipo,
+        "disponible": p.disponible,
+        "macros": {
+            "kcal": p.kcal,
+            "p": p.proteina,
+            "f": p.grasas,
+            "c": p.carbs
+        }
+    }
+
+def tokenizar(texto):
+    # Minúsculas y sin tildes: "Energía" -> "energia", "Ñuñoa" -> "nunoa"
+    if not texto:
+        return []
+    sin_tildes = "".join(
+        c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c)
+    )
+    return re.findall(r"[a-z0-9]+", sin_tildes.lower())
+
+def _clave(producto, campo):
+    # Clave de orden (es_nulo, valor, id): los productos sin dato quedan al final
+    # (también en orden descendente, ver _clave_orden) y nunca caen dentro de un rango.
+    valor = producto
+    for parte in CAMPOS_INDEXADOS[campo]:
+        valor = valor[parte]
+    if valor is None:
+        return (1, 0, producto["id"])
+    return (0, valor, producto["id"])
+
+def _clave_orden(clave, descendente):
+    # Descendente: valores de mayor a menor y, al final, los productos sin dato
+    if not descendente:
+        return clave
+    return (clave[0], -clave[1], -clave[2])
+
+def _recorrer_indice(claves, ini, fin, descendente, desde=None):
+    # Claves de claves[ini:fin] en el orden pedido, a partir del cursor 'desde'
+    if not descendente:
+        if desde is not None:
+            ini = max(ini, bisect_right(claves, desde))
+        return (claves[i] for i in range(ini, fin))
+
+    nulos = bisect_left(claves, (1,))
+    con_valor, sin_valor = (ini, min(fin, nulos)), (max(ini, nulos), fin)
+    if desde is not None:
+        corte = bisect_left(claves, desde)
+        if desde[0] == 0:
+            con_valor = (con_valor[0], min(con_valor[1], corte))
+        else:
+            con_valor = (0, 0)
+            sin_valor = (sin_valor[0], min(sin_valor[1], corte))
+    return chain.from_iterable(
+        (claves[i] for i in range(b - 1, a - 1, -1)) for a, b in (con_valor, sin_valor)
+    )
+
+def codificar_cursor(clave):
+    return f"{clave[0]}:{clave[1]}:{clave[2]}"
+
+def decodificar_cursor(cursor):
+    try:
+        nulo, valor, pid = cursor.split(":")
+        clave = (int(nulo), float(valor), int(pid))
+    except ValueError:
+        clave = None
+    if clave is None or clave[0] not in (0, 1):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return clave
+
+def acepta_gzip(accept_encoding):
+    # Respeta los q-values: "gzip;q=0" (o "*;q=0" sin mencionar gzip) lo rechaza
+    if not accept_encoding:
+        return False
+    calidades = {}
+    for parte in accept_encoding.lower().split(","):
+        codificacion, _, parametros = parte.partition(";")
+        q = 1.0
+        for parametro in parametros.split(";"):
+            nombre, _, valor = parametro.partition("=")
+            if nombre.strip() == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        calidades[codificacion.strip()] = q
+    if "gzip" in calidades:
+        return calidades["gzip"] > 0
+    if "x-gzip" in calidades:
+        return calidades["x-gzip"] > 0
+    return calidades.get("*", 0) > 0
+
+
+class VersionCatalogo:
+    def __init__(self, productos, headers, headers_gzip):
+        self.productos = productos
+        self.headers = headers
+        # Cada codificación es una representación distinta: su ETag fuerte también
+        self.headers_gzip = headers_gzip
+        self.json = json.dumps(productos, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._gzip = None
+
+    @property
+    def gzip(self):
+        # Se comprime la primera vez que un cliente lo pide
+        if self._gzip is None:
+            self._gzip = gzip.compress(self.json, compresslevel=6)
+        return self._gzip
+
+
+class CatalogoCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Marca de arranque: evita que un ETag de un proceso anterior coincida
+        # con la versión 1 de este proceso y el navegador reciba un 304 falso.
+        self._arranque = int(time.time())
+        self.version = 1
+        self.modificado = datetime.now(timezone.utc).replace(microsecond=0)
+        self._productos = None   # {id: producto publicado}
+        self._indices = {}       # campo -> lista ordenada de claves (es_nulo, valor, id)
+        self._tipos = {}         # tipo -> set de ids
+        self._terminos = {}      # término -> (ids con él en el nombre, todos los ids), listas ordenadas
+        self._vocabulario = []   # términos ordenados, para buscar por prefijo
+        self._tokens = {}        # id -> (términos del nombre, todos los términos)
+        self._actual = None      # VersionCatalogo de la versión vigente
+
+    def _etag(self, version, gzip=False):
+        sufijo = "-gz" if gzip else ""
+        return f'"catalogo-{self._arranque}-{version}{sufijo}"'
+
+    def _nueva_version(self):
+        self.version += 1
+        self.modificado = datetime.now(timezone.utc).replace(microsecond=0)
+        self._actual = None
+
+    def invalidar(self):
+        # Descarta todo; la próxima lectura recarga el catálogo desde la BD
+        with self._lock:
+            self._nueva_version()
+            self._productos = None
+
+    # ----------------------
+    # ÍNDICES
+    # ----------------------
+
+    def _asegurar_cargado(self, cargar):
+        # Se llama con el lock tomado: una sola recarga aunque lleguen muchas peticiones juntas
+        if self._productos is not None:
+            return
+        filas = cargar()
+        productos = {f.id: fila_producto(f) for f in filas}
+        self._tipos = {}
+        for producto in productos.values():
+            self._tipos.setdefault(producto["tipo"], set()).add(producto["id"])
+        self._indices = {
+            campo: sorted(_clave(p, campo) for p in productos.values())
+            for campo in CAMPOS_INDEXADOS
+        }
+        self._terminos = {}
+        self._tokens = {}
+        for f in filas:
+            self._indexar_texto(f, carga_inicial=True)
+        for del_nombre, todos in self._terminos.values():
+            del_nombre.sort()
+            todos.sort()
+        self._vocabulario = sorted(self._terminos)
+        self._productos = productos
+
+    def _indexar_texto(self, p, carga_inicial=False):
+        # En la carga inicial se agrega al final y _asegurar_cargado ordena una sola vez
+        del_nombre = set(tokenizar(p.nombre))
+        todos = del_nombre | set(tokenizar(p.descripcion))
+        self._tokens[p.id] = (del_nombre, todos)
+        agregar = list.append if carga_inicial else insort
+        for termino in todos:
+            listas = self._terminos.get(termino)
+            if listas is None:
+                listas = self._terminos[termino] = ([], [])
+                if not carga_inicial:
+                    insort(self._vocabulario, termino)
+            if termino in del_nombre:
+                agregar(listas[0], p.id)
+            agregar(listas[1], p.id)
+
+    def _quitar_texto(self, pid):
+        _, todos = self._tokens.pop(pid, (None, ()))
+        for termino in todos:
+            listas = self._terminos[termino]
+            for ids in listas:
+                pos = bisect_left(ids, pid)
+                if pos < len(ids) and ids[pos] == pid:
+                    del ids[pos]
+            if not listas[1]:
+                del self._terminos[termino]
+                del self._vocabulario[bisect_left(self._vocabulario, termino)]
+
+    def _quitar_de_indices(self, producto):
+        for campo, claves in self._indices.items():
+            clave = _clave(producto, campo)
+            pos = bisect_left(claves, clave)
+            if pos < len(claves) and claves[pos] == clave:
+                del claves[pos]
+        ids_tipo = self._tipos.get(producto["tipo"])
+        if ids_tipo is not None:
+            ids_tipo.discard(producto["id"])
+
+    def actualizar_producto(self, p):
+        # Actualización incremental tras un create/update del admin
+        with self._lock:
+            self._nueva_version()
+            if self._productos is None:
+                return
+            producto = fila_producto(p)
+            anterior = self._productos.get(producto["id"])
+            if anterior is not None:
+                self._quitar_de_indices(anterior)
+            self._productos[producto["id"]] = producto
+            for campo, claves in self._indices.items():
+                insort(claves, _clave(producto, campo))
+            self._tipos.setdefault(producto["tipo"], set()).add(producto["id"])
+            self._quitar_texto(producto["id"])
+            self._indexar_texto(p)
+
+    def eliminar_producto(self, pid):
+        with self._lock:
+            self._nueva_version()
+            if self._productos is None:
+                return
+            anterior = self._productos.pop(pid, None)
+            if anterior is not None:
+                self._quitar_de_indices(anterior)
+                self._quitar_texto(pid)
+
+    # ----------------------
+    # LECTURAS
+    # ----------------------
+
+    def obtener(self, cargar):
+        with self._lock:
+            if self._actual is None:
+                self._asegurar_cargado(cargar)
+                productos = [self._productos[c[2]] for c in self._indices["id"]]
+                self._actual = VersionCatalogo(
+                    productos,
+                    self._headers(self.version, self.modificado),
+                    self._headers(self.version, self.modificado, gzip=True),
+                )
+            return self._actual
+
+    def filtrar(self, cargar, rangos, tipo=None, disponible=None, orden="id", limite=50, cursor=None):
+        # rangos: {campo: (minimo, maximo)}, cualquiera de los dos puede ser None.
+        # Retorna (productos, siguiente_cursor, headers).
+        descendente = orden.startswith("-")
+        campo_orden = orden.lstrip("-")
+        desde = decodificar_cursor(cursor) if cursor else None
+
+        with self._lock:
+            self._asegurar_cargado(cargar)
+            headers = self._headers(self.version, self.modificado)
+
+            # Tramo [ini, fin) de cada índice que cumple su rango: O(log n)
+            tramos = {}
+            for campo, (minimo, maximo) in rangos.items():
+                claves = self._indices[campo]
+                ini = 0 if minimo is None else bisect_left(claves, (0, minimo))
+                if maximo is None:
+                    fin = bisect_left(claves, (1,))
+                else:
+                    fin = bisect_right(claves, (0, maximo, float("inf")))
+                tramos[campo] = (ini, max(ini, fin))
+
+            def cumple(producto):
+                if tipo is not None and producto["tipo"] != tipo:
+                    return False
+                if disponible is not None and producto["disponible"] != disponible:
+                    return False
+                for campo, (minimo, maximo) in rangos.items():
+                    nulo, valor, _ = _clave(producto, campo)
+                    if nulo:
+                        return False
+                    if minimo is not None and valor < minimo:
+                        return False
+                    if maximo is not None and valor > maximo:
+                        return False
+                return True
+
+            # Se parte del conjunto candidato más chico: el tramo más corto o los ids del tipo
+            candidatos = None
+            if tramos:
+                campo_guia = min(tramos, key=lambda c: tramos[c][1] - tramos[c][0])
+                ini, fin = tramos[campo_guia]
+                if tipo is None or fin - ini <= len(self._tipos.get(tipo, ())):
+                    candidatos = (campo_guia, ini, fin)
+            if candidatos is None and tipo is not None:
+                candidatos = (None, self._tipos.get(tipo, set()))
+
+            claves = self._indices[campo_orden]
+            if candidatos is None:
+                cantidad = len(claves)
+            elif candidatos[0] is None:
+                cantidad = len(candidatos[1])
+            else:
+                cantidad = candidatos[2] - candidatos[1]
+
+            if candidatos is not None and candidatos[0] == campo_orden:
+                # El tramo del propio campo de orden: se recorre desde el cursor
+                # y se corta apenas se completa la página, O(log n + k).
+                recorrido = _recorrer_indice(claves, candidatos[1], candidatos[2], descendente, desde)
+            elif candidatos is None or cantidad * cantidad > (limite + 1) * len(claves):
+                # Candidatos abundantes: recorrer el índice del orden desde el cursor
+                # (en promedio n / k claves por resultado) cuesta menos que revisarlos todos
+                recorrido = _recorrer_indice(claves, 0, len(claves), descendente, desde)
+            else:
+                # Pocos candidatos: solo los limite + 1 primeros pasado el cursor, sin ordenar todo
+                if candidatos[0] is None:
+                    ids = candidatos[1]
+                else:
+                    ids = [c[2] for c in self._indices[candidatos[0]][candidatos[1]:candidatos[2]]]
+                pendientes = (
+                    _clave(self._productos[pid], campo_orden) for pid in ids if cumple(self._productos[pid])
+                )
+                if desde is not None:
+                    corte = _clave_orden(desde, descendente)
+                    pendientes = (c for c in pendientes if _clave_orden(c, descendente) > corte)
+                recorrido = heapq.nsmallest(limite + 1, pendientes, key=lambda c: _clave_orden(c, descendente))
+
+            resultado = []
+            ultima = None
+            for clave in recorrido:
+                producto = self._productos[clave[2]]
+                if not cumple(producto):
+                    continue
+                if len(resultado) == limite:
+                    return resultado, codificar_cursor(ultima), headers
+                resultado.append(producto)
+                ultima = clave
+
+            return resultado, None, headers
+
+    def buscar(self, cargar, consulta, limite=20):
+        # Cada término de la consulta se toma como prefijo y todos deben coincidir.
+        # Primero los productos cuyo nombre contiene todos los términos.
+        # Retorna (productos, headers).
+        terminos = tokenizar(consulta)
+
+        with self._lock:
+            self._asegurar_cargado(cargar)
+            headers = self._headers(self.version, self.modificado)
+            if not terminos:
+                return [], headers
+
+            # Solo se recorre hasta juntar 'limite': no se arman todas las coincidencias
+            prefijos = set(terminos)
+            ids = self._coincidencias(prefijos, 0, limite)
+            if len(ids) < limite:
+                # Ya están todos los del nombre: se completa con los de la descripción
+                ids += self._coincidencias(prefijos, 1, limite - len(ids), excluir=set(ids))
+            return [self._productos[pid] for pid in ids], headers
+
+    def _coincidencias(self, prefijos, campo, limite, excluir=()):
+        # Primeros 'limite' ids (ascendentes) que tienen todos los prefijos en el
+        # campo 0 (nombre) o 1 (nombre y descripción).
+        # Se recorren las listas del prefijo más selectivo y cada candidato se
+        # verifica contra sus propios términos.
+        listas = {}
+        for prefijo in prefijos:
+            ini = bisect_left(self._vocabulario, prefijo)
+            fin = bisect_left(self._vocabulario, prefijo + "\uffff")
+            listas[prefijo] = [self._terminos[t][campo] for t in self._vocabulario[ini:fin]]
+        guia = min(prefijos, key=lambda q: sum(map(len, listas[q])))
+        otros = [q for q in prefijos if q != guia]
+
+        resultado, anterior = [], None
+        for pid in heapq.merge(*listas[guia]):
+            # Un id aparece en la lista de cada término del prefijo que contiene
+            if pid == anterior:
+                continue
+            anterior = pid
+            if pid in excluir:
+                continue
+            terminos = self._tokens[pid][campo]
+            if all(any(t.startswith(q) for t in terminos) for q in otros):
+                resultado.append(pid)
+                if len(resultado) == limite:
+                    break
+        return resultado
+
+    # ----------------------
+    # HTTP
+    # ----------------------
+
+    def no_modificado(self, if_none_match, if_modified_since, gzip=False):
+        # If-None-Match tiene prioridad sobre If-Modified-Since (RFC 9110).
+        # 'gzip' indica qué representación se entregaría ahora.
+        if if_none_match:
+            etag = self._etag(self.version, gzip)
+            etags = [e.strip() for e in if_none_match.split(",")]
+            return "*" in etags or etag in etags or f"W/{etag}" in etags
+
+        if if_modified_since:
+            try:
+                fecha = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if fecha is None:
+                return False
+            if fecha.tzinfo is None:
+                fecha = fecha.replace(tzinfo=timezone.utc)
+            return self.modificado <= fecha
+
+        return False
+
+    def headers(self, gzip=False):
+        with self._lock:
+            return self._headers(self.version, self.modificado, gzip)
+
+    def _headers(self, version, modificado, gzip=False):
+        return {
+            "ETag": self._etag(version, gzip),
+            "Last-Modified": format_datetime(modificado, usegmt=True),
+            # Obliga al navegador a revalidar, pero le permite reutilizar su copia con un 304
+            "Cache-Control": "no-cache",
+        }
+
+
+cache = CatalogoCache()
+
+def invalidar():
+    cache.invalidar()
+
+def avisar_cambio(db, pid):
+    # Llamar antes del commit de una escritura sobre 'productos'
+    eventos.notificar(db, eventos.CANAL_CATALOGO, {"id": pid, "origen": eventos.ORIGEN})
+
+@eventos.despachador.al_recibir(eventos.CANAL_CATALOGO)
+def _cambio_en_otro_worker(aviso):
+    # El worker que escribió ya actualizó su copia; None = pudo perderse un aviso
+    if aviso is None or aviso.get("origen") != eventos.ORIGEN:
+        cache.invalidar()
+
+def actualizar_producto(producto):
+    cache.actualizar_producto(producto)
+
+def eliminar_producto(pid):
+    cache.eliminar_producto(pid)
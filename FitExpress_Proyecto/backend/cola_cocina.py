@@ -0,0 +1,60 @@
+import threading
+from bisect import bisect_left, insort
+from . import estados_pedido
+
+# Cola de cocina en memoria: pedidos activos ordenados por hora prometida y
+# luego por llegada. Se reconstruye desde la BD al iniciar (y si se pierden
+# avisos) y después se mantiene con los avisos de cambios de pedidos
+# (ver eventos.py), así leer los primeros k pedidos no recorre la tabla.
+
+ESTADOS_COCINA = [estados_pedido.RECIBIDO, estados_pedido.EN_PREPARACION, estados_pedido.PAGADO]
+
+# Minutos comprometidos al cliente según el tipo de entrega (prioridad en cocina)
+MINUTOS_PROMESA = {"delivery": 45, "retiro": 20}
+
+def clave_prioridad(pedido):
+    # Pedidos antiguos sin promesa se ordenan por su hora de llegada
+    return (pedido.promesa_entrega or pedido.fecha_creacion, pedido.fecha_creacion, pedido.id)
+
+class ColaCocina:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Serializa reconstrucciones y avisos: una recarga en curso no puede
+        # pisar un cambio aplicado mientras se consultaba la BD
+        self.escritura = threading.Lock()
+        self._pedidos = {}  # id -> (clave, pedido ya serializado)
+        self._orden = []    # claves ordenadas
+        self.cargada = False
+
+    def reconstruir(self, entradas):
+        # entradas: lista de (clave, pedido serializado)
+        with self._lock:
+            self._pedidos = {clave[-1]: (clave, pedido) for clave, pedido in entradas}
+            self._orden = sorted(clave for clave, _ in self._pedidos.values())
+            self.cargada = True
+
+    def actualizar(self, clave, pedido):
+        with self._lock:
+            self._quitar(clave[-1])
+            self._pedidos[clave[-1]] = (clave, pedido)
+            insort(self._orden, clave)
+
+    def retirar(self, pedido_id):
+        with self._lock:
+            self._quitar(pedido_id)
+
+    def primeros(self, limite=None):
+        with self._lock:
+            claves = self._orden if limite is None else self._orden[:limite]
+            return [self._pedidos[clave[-1]][1] for clave in claves]
+
+    def __len__(self):
+        return len(self._pedidos)
+
+    def _quitar(self, pedido_id):
+        actual = self._pedidos.pop(pedido_id, None)
+        if actual is not None:
+            del self._orden[bisect_left(self._orden, actual[0])]
+
+
+cola = ColaCocina()
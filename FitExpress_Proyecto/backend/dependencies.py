@@ -1,8 +1,12 @@
+import threading
+import time
+from collections import OrderedDict
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-from . import database, models
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from . import database, eventos, models
 
 # Configuración JWT
 # Nota: En producción, estos valores deberían cargarse desde variables de entorno
@@ -11,6 +15,106 @@ ALGORITHM = "HS256"
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+# ----------------------
+# CACHÉ DE USUARIOS AUTENTICADOS
+# ----------------------
+
+# Evita el SELECT a 'usuarios' en cada petición autenticada (carrito, pedidos, cocina...)
+PRINCIPAL_TTL_SEGUNDOS = 60
+PRINCIPAL_MAX_ENTRADAS = 2048
+
+# La contraseña no se guarda en memoria; si alguien la pidiera, el ORM la carga
+_COLUMNAS_PRINCIPAL = [
+    attr.key for attr in inspect(models.Usuario).column_attrs if attr.key != "hashed_password"
+]
+
+class CachePrincipales:
+    # LRU acotado con expiración, indexado por token
+    def __init__(self, maximo, ttl):
+        self._lock = threading.Lock()
+        self._maximo = maximo
+        self._ttl = ttl
+        self._entradas = OrderedDict()  # token -> (expira, usuario_id, columnas)
+        self._por_usuario = {}          # usuario_id -> set de tokens
+        # Cambia con cada invalidación: una lectura de la BD que empezó antes
+        # no se guarda, porque pudo traer la fila anterior al cambio
+        self.generacion = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, token):
+        with self._lock:
+            entrada = self._entradas.get(token)
+            if entrada is None or entrada[0] < time.monotonic():
+                if entrada is not None:
+                    self._quitar(token)
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(token)
+            self.aciertos += 1
+            return entrada[2]
+
+    def guardar(self, token, usuario, generacion):
+        columnas = {key: getattr(usuario, key) for key in _COLUMNAS_PRINCIPAL}
+        with self._lock:
+            if generacion != self.generacion:
+                return
+            if token in self._entradas:
+                self._quitar(token)
+            self._entradas[token] = (time.monotonic() + self._ttl, usuario.id, columnas)
+            self._por_usuario.setdefault(usuario.id, set()).add(token)
+            while len(self._entradas) > self._maximo:
+                self._quitar(next(iter(self._entradas)))
+
+    def invalidar_usuario(self, usuario_id):
+        with self._lock:
+            self.generacion += 1
+            for token in list(self._por_usuario.get(usuario_id, ())):
+                self._quitar(token)
+
+    def limpiar(self):
+        with self._lock:
+            self.generacion += 1
+            self._entradas.clear()
+            self._por_usuario.clear()
+
+    def _quitar(self, token):
+        _, usuario_id, _ = self._entradas.pop(token)
+        tokens = self._por_usuario.get(usuario_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._por_usuario[usuario_id]
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / total, 4) if total else 0,
+                "entradas": len(self._entradas),
+                "maximo": self._maximo,
+                "ttl_segundos": self._ttl,
+            }
+
+
+principales = CachePrincipales(PRINCIPAL_MAX_ENTRADAS, PRINCIPAL_TTL_SEGUNDOS)
+
+def invalidar_principal(db: Session, usuario_id: int):
+    # Llamar antes del commit que cambia perfil, contraseña o rol. Al confirmarse,
+    # este worker descarta sus entradas y los demás reciben el aviso (NOTIFY).
+    eventos.notificar(db, eventos.CANAL_PRINCIPALES, {"usuario_id": usuario_id})
+    eventos.al_confirmar(db, lambda: principales.invalidar_usuario(usuario_id))
+
+@eventos.despachador.al_recibir(eventos.CANAL_PRINCIPALES)
+def _cambio_de_usuario(aviso):
+    # None: se reconectó el LISTEN y pudo perderse algún aviso
+    if aviso is None:
+        principales.limpiar()
+    else:
+        principales.invalidar_usuario(aviso["usuario_id"])
+
 def get_user_from_token(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
     # Definir excepción común para errores de credenciales
     credentials_exception = HTTPException(
@@ -19,21 +123,30 @@ def get_user_from_token(token: str = Depends(oauth2_scheme), db: Session = Depen
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    # Usuario ya validado con este token: se adjunta a la sesión sin consultar la BD
+    columnas = principales.obtener(token)
+    if columnas is not None:
+        user = models.Usuario(**columnas)
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
+
     try:
         # Decodificar token
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
-        
+
         if email is None:
             raise credentials_exception
-            
+
     except JWTError:
         raise credentials_exception
-    
+
     # Buscar usuario en BD
+    generacion = principales.generacion
     user = db.query(models.Usuario).filter(models.Usuario.email == email).first()
-    
+
     if user is None:
         raise credentials_exception
-        
-    return user
\ No newline at end of file
+
+    principales.guardar(token, user, generacion)
+    return user
@@ -0,0 +1,112 @@
+import sys
+from datetime import timedelta
+from sqlalchemy import bindparam, delete, func, inspect, select, text, update
+from sqlalchemy.schema import CreateIndex
+from . import database, models
+from .cola_cocina import ESTADOS_COCINA, MINUTOS_PROMESA
+
+# Actualización del esquema de una base existente, sin borrar datos.
+# create_all solo crea las tablas que faltan (no agrega columnas ni índices a
+# tablas ya creadas) e init_db.py reinicia todo con drop_all. Cada paso es
+# idempotente: la app lo corre al iniciar y no hace nada si ya está al día.
+#
+# Uso por consola:
+#   python -m backend.esquema actualizar
+
+# Columnas agregadas a tablas que ya existían: (tabla, columna, definición SQL).
+# La definición lleva el DEFAULT que reciben las filas antiguas.
+COLUMNAS_NUEVAS = [
+    ("usuarios", "nombre_busqueda", "VARCHAR"),
+    ("usuarios", "rut_normalizado", "VARCHAR"),
+    # Control optimista de cambios de estado: los pedidos existentes parten en 1
+    ("pedidos", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("pedidos", "promesa_entrega", "TIMESTAMP"),
+    ("pedidos", "pagado_en", "TIMESTAMP"),
+]
+
+# Los pedidos antiguos no guardan el tipo de entrega: el checkout de retiro
+# deja esta dirección (ver frontend/B18-AsignacionDespacho.html)
+DIRECCION_RETIRO = "Retiro en Tienda"
+
+# Clave del advisory lock de PostgreSQL: un worker actualiza, el resto espera
+_CLAVE_BLOQUEO = 1917
+
+def _agregar_columnas(conexion):
+    existentes = {}
+    for tabla, columna, definicion in COLUMNAS_NUEVAS:
+        if tabla not in existentes:
+            existentes[tabla] = {c["name"] for c in inspect(conexion).get_columns(tabla)}
+        if columna not in existentes[tabla]:
+            conexion.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}"))
+            existentes[tabla].add(columna)
+
+def _fusionar_lineas_estandar(conexion):
+    # uq_carrito_items_estandar no se puede crear si ya hay líneas estándar
+    # repetidas (el antiguo "buscar y luego insertar" las dejaba): se suman en la primera
+    if "uq_carrito_items_estandar" in {i["name"] for i in inspect(conexion).get_indexes("carrito_items")}:
+        return
+    items = models.CarritoItem.__table__
+    estandar = (items.c.personalizacion.is_(None), items.c.precio_guardado.is_(None))
+    repetidas = conexion.execute(
+        select(items.c.carrito_id, items.c.producto_id, func.min(items.c.id), func.sum(items.c.cantidad))
+        .where(*estandar)
+        .group_by(items.c.carrito_id, items.c.producto_id)
+        .having(func.count() > 1)
+    ).all()
+    for carrito_id, producto_id, primera, cantidad in repetidas:
+        conexion.execute(update(items).where(items.c.id == primera).values(cantidad=cantidad))
+        conexion.execute(delete(items).where(
+            *estandar, items.c.carrito_id == carrito_id, items.c.producto_id == producto_id, items.c.id != primera,
+        ))
+
+def _crear_indices(conexion):
+    # Todos los índices declarados en models.py (CREATE INDEX IF NOT EXISTS)
+    for tabla in models.Base.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            conexion.execute(CreateIndex(indice, if_not_exists=True))
+
+def _completar_promesas(conexion):
+    # Sin esto la cola de cocina arranca con promesas en NULL para los activos
+    pedidos = models.Pedido.__table__
+    filas = conexion.execute(
+        select(pedidos.c.id, pedidos.c.fecha_creacion, pedidos.c.direccion_envio).where(
+            pedidos.c.promesa_entrega.is_(None),
+            pedidos.c.fecha_creacion.isnot(None),
+            pedidos.c.estado.in_(ESTADOS_COCINA),
+        )
+    ).all()
+    if not filas:
+        return 0
+    conexion.execute(
+        update(pedidos).where(pedidos.c.id == bindparam("pid")).values(promesa_entrega=bindparam("promesa")),
+        [
+            {
+                "pid": f.id,
+                "promesa": f.fecha_creacion + timedelta(minutes=MINUTOS_PROMESA[
+                    "retiro" if f.direccion_envio == DIRECCION_RETIRO else "delivery"
+                ]),
+            }
+            for f in filas
+        ],
+    )
+    return len(filas)
+
+def actualizar(engine=None):
+    with (engine or database.engine).begin() as conexion:
+        if conexion.dialect.name == "postgresql":
+            conexion.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": _CLAVE_BLOQUEO})
+        models.Base.metadata.create_all(bind=conexion)
+        _agregar_columnas(conexion)
+        _fusionar_lineas_estandar(conexion)
+        _crear_indices(conexion)
+        _completar_promesas(conexion)
+
+
+if __name__ == "__main__":
+    comando = sys.argv[1] if len(sys.argv) > 1 else ""
+    if comando == "actualizar":
+        actualizar()
+        print("✅ Esquema actualizado")
+    else:
+        print("Uso: python -m backend.esquema actualizar")
+        sys.exit(2)
@@ -0,0 +1,112 @@
+from datetime import datetime
+from fastapi import HTTPException, status
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from . import eventos, models, resumen_clientes, rollups
+
+# Máquina de estados de los pedidos.
+# Todo cambio de estado pasa por transicionar(): valida que el paso esté
+# permitido y lo escribe con un UPDATE condicionado a la versión leída
+# (concurrencia optimista). Si otro escritor se adelantó (cocina, pago,
+# cancelación), se responde 409 con el estado actual en vez de pisarlo.
+# No se toman locks de fila, así la cocina puede avanzar pedidos sin esperas.
+#
+# El pago se guarda aparte (pagado_en): la cocina puede empezar un pedido
+# sin pagar (pago contra entrega) y el cliente igual puede pagarlo después.
+# Solo un pedido "Recibido" pasa a "Pagado" al pagarse; en los demás estados
+# activos el pago se registra sin mover el estado de cocina.
+
+RECIBIDO = "Recibido"
+PAGADO = "Pagado"
+EN_PREPARACION = "En preparacion"
+LISTO = "Listo"
+EN_CAMINO = "En camino"
+ENTREGADO = "Entregado"
+CANCELADO = "Cancelado"
+
+TRANSICIONES = {
+    RECIBIDO: {PAGADO, EN_PREPARACION, CANCELADO},
+    PAGADO: {EN_PREPARACION, CANCELADO},
+    EN_PREPARACION: {LISTO},
+    LISTO: {EN_CAMINO, ENTREGADO},
+    EN_CAMINO: {ENTREGADO},
+    ENTREGADO: set(),
+    CANCELADO: set(),
+}
+
+ESTADOS = list(TRANSICIONES)
+ESTADO_INICIAL = RECIBIDO
+
+# Estados en que el pago se registra sin cambiar el estado
+PAGABLE_SIN_CAMBIO = {EN_PREPARACION, LISTO, EN_CAMINO, ENTREGADO}
+
+def _conflicto(mensaje, estado_actual, version_actual):
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail={"mensaje": mensaje, "estado_actual": estado_actual, "version": version_actual},
+    )
+
+def _escribir(db: Session, pedido: models.Pedido, valores):
+    # UPDATE condicionado a la versión leída; incrementa la versión
+    resultado = db.execute(
+        update(models.Pedido)
+        .where(models.Pedido.id == pedido.id, models.Pedido.version == pedido.version)
+        .values(version=models.Pedido.version + 1, **valores)
+    )
+    if resultado.rowcount != 1:
+        # Otro escritor ganó: informar el estado que dejó
+        db.rollback()
+        actual = db.query(models.Pedido.estado, models.Pedido.version).filter(
+            models.Pedido.id == pedido.id
+        ).first()
+        raise _conflicto("El pedido fue modificado por otra operación", actual.estado, actual.version)
+
+    # Reflejar en el objeto lo que ya se escribió, sin volver a marcarlo como modificado
+    for campo, valor in valores.items():
+        set_committed_value(pedido, campo, valor)
+    set_committed_value(pedido, "version", pedido.version + 1)
+
+def al_crear(db: Session, pedido: models.Pedido):
+    # Llamar después del flush del pedido nuevo, antes del commit
+    rollups.registrar_creacion(db, pedido)
+    resumen_clientes.registrar_creacion(db, pedido)
+    eventos.notificar_pedido(db, pedido)
+
+def transicionar(db: Session, pedido: models.Pedido, nuevo_estado: str, version_esperada=None):
+    # No hace commit: el cambio queda en la transacción del endpoint.
+    # version_esperada: la que vio el cliente (opcional); si no, la recién leída.
+    if nuevo_estado not in TRANSICIONES:
+        raise HTTPException(status_code=400, detail=f"Estado no válido. Opciones: {', '.join(ESTADOS)}")
+
+    if version_esperada is not None and version_esperada != pedido.version:
+        raise _conflicto("El pedido cambió desde la última lectura", pedido.estado, pedido.version)
+
+    estado_anterior = pedido.estado
+    if nuevo_estado not in TRANSICIONES.get(estado_anterior, ()):
+        raise _conflicto(
+            f"No se puede pasar de '{estado_anterior}' a '{nuevo_estado}'", estado_anterior, pedido.version
+        )
+
+    valores = {"estado": nuevo_estado}
+    if nuevo_estado == PAGADO and pedido.pagado_en is None:
+        valores["pagado_en"] = datetime.now()
+    _escribir(db, pedido, valores)
+
+    rollups.registrar_transicion(db, pedido, estado_anterior, nuevo_estado)
+    resumen_clientes.registrar_transicion(db, pedido, estado_anterior, nuevo_estado)
+    eventos.notificar_pedido(db, pedido)
+    return estado_anterior
+
+def registrar_pago(db: Session, pedido: models.Pedido):
+    # No hace commit. "Recibido" pasa a "Pagado"; en cocina solo se marca pagado_en
+    if pedido.pagado_en is not None or pedido.estado == PAGADO:
+        raise _conflicto("El pedido ya está pagado", pedido.estado, pedido.version)
+
+    if pedido.estado in PAGABLE_SIN_CAMBIO:
+        _escribir(db, pedido, {"pagado_en": datetime.now()})
+        eventos.notificar_pedido(db, pedido)
+        return pedido.estado
+
+    # Recibido -> Pagado; un pedido cancelado responde 409
+    return transicionar(db, pedido, PAGADO)
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import queue
+import select
+import threading
+import time
+import uuid
+from sqlalchemy import event, text
+from . import database
+
+# Eventos de cambios en pedidos para la pantalla de cocina (SSE).
+# Los endpoints que modifican un pedido llaman a notificar_pedido() dentro de
+# su transacción; el aviso sale solo si la transacción se confirma.
+#  - PostgreSQL: pg_notify + un hilo con LISTEN en cada worker, así todos los
+#    procesos se enteran de los cambios hechos por cualquiera de ellos.
+#  - Otros motores (SQLite local): el aviso se entrega dentro del mismo proceso
+#    al hacer commit.
+# Cada worker tiene un único hilo despachador que procesa los avisos y los
+# reparte a sus suscriptores, de modo que el costo no crece con las pantallas.
+# El mismo mecanismo avisa a los demás workers de cambios que invalidan sus
+# cachés en memoria (catálogo, usuarios autenticados).
+
+logger = logging.getLogger(__name__)
+
+CANAL_PEDIDOS = "pedidos"
+CANAL_CATALOGO = "catalogo"
+CANAL_PRINCIPALES = "principales"
+CANALES = [CANAL_PEDIDOS, CANAL_CATALOGO, CANAL_PRINCIPALES]
+
+# Identifica a este proceso en los avisos que él mismo genera
+ORIGEN = uuid.uuid4().hex
+
+def _es_postgres(bind):
+    return bind.dialect.name == "postgresql"
+
+def notificar(db, canal, aviso):
+    # Llamar antes de db.commit(): el aviso sale solo si la transacción se confirma
+    if _es_postgres(db.get_bind()):
+        db.execute(text("SELECT pg_notify(:canal, :payload)"), {"canal": canal, "payload": json.dumps(aviso)})
+    else:
+        db.info.setdefault("avisos", []).append((canal, aviso))
+
+def notificar_pedido(db, pedido):
+    # Llamar antes de db.commit(), con el estado ya asignado
+    notificar(db, CANAL_PEDIDOS, {"id": pedido.id, "estado": pedido.estado})
+
+def al_confirmar(db, fn):
+    # fn() corre en este mismo hilo apenas se confirme la transacción
+    db.info.setdefault("al_confirmar", []).append(fn)
+
+@event.listens_for(database.SessionLocal, "after_commit")
+def _entregar_avisos_locales(session):
+    for fn in session.info.pop("al_confirmar", []):
+        fn()
+    for canal, aviso in session.info.pop("avisos", []):
+        despachador.encolar(canal, aviso)
+
+@event.listens_for(database.SessionLocal, "after_rollback")
+def _descartar_avisos_locales(session):
+    session.info.pop("al_confirmar", None)
+    session.info.pop("avisos", None)
+
+
+class Despachador:
+    # Hilo que recibe avisos (canal, datos) y llama a los manejadores del canal.
+    # Un aviso None significa "pudo haberse perdido algo" (reconexión del LISTEN)
+    # y se entrega a los manejadores de todos los canales.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cola = queue.Queue()
+        self._manejadores = {}  # canal -> [fn(aviso)]
+        self._iniciado = False
+        self._escuchando = False
+
+    def al_recibir(self, canal):
+        def registrar(fn):
+            self._manejadores.setdefault(canal, []).append(fn)
+            return fn
+        return registrar
+
+    def al_cambiar_pedido(self, fn):
+        # fn(pedido_id, estado); fn(None, None) si pudo perderse algún aviso
+        self.al_recibir(CANAL_PEDIDOS)(
+            lambda aviso: fn(None, None) if aviso is None else fn(aviso["id"], aviso["estado"])
+        )
+        return fn
+
+    def encolar(self, canal, aviso):
+        self._iniciar()
+        self._cola.put((canal, aviso))
+
+    def escuchar(self):
+        # Con PostgreSQL se abre el LISTEN al primer suscriptor del worker
+        self._iniciar()
+        with self._lock:
+            if self._escuchando or not _es_postgres(database.engine):
+                return
+            self._escuchando = True
+        threading.Thread(target=self._escuchar_postgres, name="listen-avisos", daemon=True).start()
+
+    def _iniciar(self):
+        with self._lock:
+            if self._iniciado:
+                return
+            self._iniciado = True
+        threading.Thread(target=self._despachar, name="despachador-pedidos", daemon=True).start()
+
+    def _despachar(self):
+        while True:
+            canal, aviso = self._cola.get()
+            if canal is None:
+                manejadores = [fn for fns in self._manejadores.values() for fn in fns]
+            else:
+                manejadores = self._manejadores.get(canal, [])
+            for fn in manejadores:
+                try:
+                    fn(aviso)
+                except Exception:
+                    logger.exception("Error procesando aviso %s de %s", aviso, canal)
+
+    def _escuchar_postgres(self):
+        primera_vez = True
+        while True:
+            try:
+                # Conexión dedicada, fuera del pool, en modo autocommit
+                conexion = database.engine.raw_connection()
+                conexion.detach()
+                dbapi = getattr(conexion, "driver_connection", None) or conexion.connection
+                try:
+                    dbapi.autocommit = True
+                    for canal in CANALES:
+                        dbapi.cursor().execute(f"LISTEN {canal}")
+                    if not primera_vez:
+                        self._cola.put((None, None))
+                    primera_vez = False
+
+                    while True:
+                        if select.select([dbapi], [], [], 30) == ([], [], []):
+                            continue
+                        dbapi.poll()
+                        while dbapi.notifies:
+                            aviso = dbapi.notifies.pop(0)
+                            self._cola.put((aviso.channel, json.loads(aviso.payload)))
+                finally:
+                    conexion.close()
+            except Exception:
+                logger.exception("Se perdió el LISTEN de avisos, reconectando")
+                time.sleep(1)
+
+
+despachador = Despachador()
+
+
+class Canal:
+    # Suscriptores SSE de un worker: una asyncio.Queue acotada por conexión.
+    # Si un cliente lento llena su cola se le envía (None, None) para que cierre
+    # y reconecte (al reconectar recibe un snapshot completo).
+    MAX_PENDIENTES = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._suscriptores = {}  # asyncio.Queue -> loop
+
+    def suscribir(self, loop):
+        despachador.escuchar()
+        cola = asyncio.Queue(maxsize=self.MAX_PENDIENTES)
+        with self._lock:
+            self._suscriptores[cola] = loop
+        return cola
+
+    def desuscribir(self, cola):
+        with self._lock:
+            self._suscriptores.pop(cola, None)
+
+    def hay_suscriptores(self):
+        with self._lock:
+            return bool(self._suscriptores)
+
+    def difundir(self, evento, datos):
+        # Seguro de llamar desde cualquier hilo
+        with self._lock:
+            suscriptores = list(self._suscriptores.items())
+        for cola, loop in suscriptores:
+            try:
+                loop.call_soon_threadsafe(self._entregar, cola, (evento, datos))
+            except RuntimeError:
+                self.desuscribir(cola)  # loop cerrado
+
+    @staticmethod
+    def _entregar(cola, mensaje):
+        try:
+            cola.put_nowait(mensaje)
+        except asyncio.QueueFull:
+            while not cola.empty():
+                cola.get_nowait()
+            cola.put_nowait((None, None))
+
+
+canal_cocina = Canal()
+
+def formato_sse(evento, datos):
+    return f"event: {evento}\ndata: {json.dumps(datos)}\n\n"
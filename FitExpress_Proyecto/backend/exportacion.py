@@ -0,0 +1,75 @@
+import csv
+import io
+import json
+from datetime import datetime, time, timedelta
+from sqlalchemy import select
+from . import database, models
+
+# Exportación de pedidos y sus líneas para contabilidad (CSV o NDJSON).
+# Las filas se leen con un cursor del lado del servidor en lotes de
+# FILAS_POR_LOTE y se envían en bloques a medida que llegan, así la memoria
+# usada no depende de cuántos pedidos tenga el rango.
+
+FILAS_POR_LOTE = 2000
+
+COLUMNAS = [
+    models.Pedido.id.label("pedido_id"),
+    models.Pedido.fecha_creacion,
+    models.Pedido.usuario_id,
+    models.Pedido.estado,
+    models.Pedido.metodo_pago,
+    models.Pedido.direccion_envio,
+    models.Pedido.total,
+    models.ItemPedido.id.label("item_id"),
+    models.ItemPedido.producto_id,
+    models.ItemPedido.nombre_producto,
+    models.ItemPedido.cantidad,
+    models.ItemPedido.precio_unitario,
+    models.ItemPedido.personalizacion,
+]
+ENCABEZADOS = [c.key for c in COLUMNAS]
+
+def _consulta(desde, hasta):
+    # Una fila por línea de pedido; los pedidos sin líneas igual aparecen
+    consulta = select(*COLUMNAS).outerjoin(
+        models.ItemPedido, models.ItemPedido.pedido_id == models.Pedido.id
+    )
+    if desde:
+        consulta = consulta.where(models.Pedido.fecha_creacion >= datetime.combine(desde, time.min))
+    if hasta:
+        consulta = consulta.where(models.Pedido.fecha_creacion < datetime.combine(hasta + timedelta(days=1), time.min))
+    return consulta.order_by(models.Pedido.fecha_creacion, models.Pedido.id, models.ItemPedido.id)
+
+def _lotes(desde, hasta):
+    # Sesión propia: vive lo que dure la descarga, no lo que dure el endpoint
+    db = database.SessionLocal()
+    try:
+        resultado = db.execute(
+            _consulta(desde, hasta).execution_options(stream_results=True, yield_per=FILAS_POR_LOTE)
+        )
+        for lote in resultado.partitions():
+            yield lote
+    finally:
+        db.close()
+
+def _valor(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+def filas_csv(desde, hasta):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(ENCABEZADOS)
+    for lote in _lotes(desde, hasta):
+        escritor.writerows([_valor(v) for v in fila] for fila in lote)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def filas_ndjson(desde, hasta):
+    for lote in _lotes(desde, hasta):
+        yield "".join(
+            json.dumps(dict(zip(ENCABEZADOS, map(_valor, fila))), ensure_ascii=False) + "\n"
+            for fila in lote
+        )
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from fastapi import HTTPException, status
+
+# Hashing de contraseñas fuera de los workers web.
+# bcrypt es CPU puro: se ejecuta en un pool de procesos acotado para que una
+# ráfaga de logins no deje sin hilos al resto de la API (catálogo, carrito...).
+# Si la cola se llena, se responde 503 en vez de seguir acumulando trabajo.
+# Los hijos se crean con 'spawn': un fork copiaría los hilos y conexiones
+# (pool de SQLAlchemy, LISTEN) del worker en un estado inconsistente.
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_MAX_PENDIENTES = int(os.getenv("HASH_MAX_PENDIENTES", "32"))
+
+# Funciones de nivel de módulo: son las que se envían a los procesos hijos
+def _hashear(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _verificar(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+class PoolHashing:
+    def __init__(self, workers, max_pendientes):
+        self._workers = workers
+        self._max_pendientes = max_pendientes
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pendientes = 0
+
+    def _obtener_pool(self):
+        # Se crea al primer uso, no al importar el módulo
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+    def cerrar(self):
+        # Al apagar la app: espera lo pendiente y termina los procesos hijos
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def ejecutar(self, fn, *args):
+        with self._lock:
+            if self._pendientes >= self._max_pendientes:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Servicio ocupado, intenta nuevamente en unos segundos.",
+                    headers={"Retry-After": "1"},
+                )
+            self._pendientes += 1
+        try:
+            return self._obtener_pool().submit(fn, *args).result()
+        finally:
+            with self._lock:
+                self._pendientes -= 1
+
+
+pool = PoolHashing(HASH_WORKERS, HASH_MAX_PENDIENTES)
+
+def hash_password(password: str) -> str:
+    return pool.ejecutar(_hashear, password, BCRYPT_ROUNDS)
+
+def verificar_password(password: str, hashed: str) -> bool:
+    return pool.ejecutar(_verificar, password, hashed)
+
+def necesita_rehash(hashed: str) -> bool:
+    # Formato bcrypt: $2b$<costo>$<salt+hash>
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,244 @@
+import abc
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from . import database, eventos, models
+
+# Claves de idempotencia para crear y pagar pedidos (header 'Idempotency-Key').
+# Si la conexión del cliente se corta y reintenta, la repetición recibe la
+# respuesta guardada sin volver a tocar carrito ni pedidos.
+# Un duplicado que llega mientras el original sigue en curso espera a que
+# termine en vez de ejecutarse en paralelo.
+# La respuesta se guarda en la misma transacción que el cambio de negocio:
+# o quedan ambos o ninguno.
+
+TTL_SEGUNDOS = 24 * 60 * 60
+ESPERA_MAXIMA = 30         # segundos que un duplicado espera al original
+ARRIENDO_SEGUNDOS = 20     # una reserva en curso más antigua se considera abandonada
+LARGO_MAXIMO_CLAVE = 255
+
+class BackendIdempotencia(abc.ABC):
+    # Interfaz común: permite enchufar un almacenamiento compartido (BD, Redis...)
+    # 'reserva' identifica el intento dueño de la clave.
+    @abc.abstractmethod
+    def reservar(self, clave, huella, reserva):
+        # Retorna None si esta petición debe ejecutarse, o (estado_http, cuerpo) guardados
+        ...
+
+    @abc.abstractmethod
+    def guardar(self, clave, reserva, estado_http, cuerpo, db):
+        # Se llama antes de db.commit(): la respuesta queda con la transacción del endpoint
+        ...
+
+    @abc.abstractmethod
+    def liberar(self, clave, reserva):
+        # El original falló: se borra la reserva para que un reintento se ejecute
+        ...
+
+def _verificar_huella(guardada, huella):
+    if guardada != huella:
+        raise HTTPException(
+            status_code=422,
+            detail="La Idempotency-Key ya se usó con otros datos",
+        )
+
+def _reserva_perdida():
+    # Otro intento tomó la clave tras vencer el arriendo: este no debe confirmar
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="La reserva de la Idempotency-Key expiró; reintenta para obtener el resultado",
+        headers={"Retry-After": "1"},
+    )
+
+def _en_proceso():
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Hay una petición con la misma Idempotency-Key todavía en proceso",
+        headers={"Retry-After": "1"},
+    )
+
+
+class _Entrada:
+    def __init__(self, huella, reserva):
+        self.huella = huella
+        self.reserva = reserva
+        self.expira = time.monotonic() + TTL_SEGUNDOS
+        self.terminada = threading.Event()
+        self.respuesta = None  # (estado_http, cuerpo)
+
+class BackendMemoria(BackendIdempotencia):
+    # Por proceso: con varios workers cada uno lleva su propio registro
+    MAX_CLAVES = 100_000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = {}  # clave -> _Entrada
+
+    def reservar(self, clave, huella, reserva):
+        limite = time.monotonic() + ESPERA_MAXIMA
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                entrada = self._entradas.get(clave)
+                if entrada is None or entrada.expira < ahora:
+                    self._entradas[clave] = _Entrada(huella, reserva)
+                    if len(self._entradas) > self.MAX_CLAVES:
+                        self._purgar(ahora)
+                    return None
+                _verificar_huella(entrada.huella, huella)
+                if entrada.respuesta is not None:
+                    return entrada.respuesta
+
+            # Esperar fuera del lock a que el original termine (o se libere)
+            restante = limite - time.monotonic()
+            if restante <= 0 or not entrada.terminada.wait(restante):
+                raise _en_proceso()
+
+    def guardar(self, clave, reserva, estado_http, cuerpo, db):
+        # En memoria no hay transacción compartida: se publica al confirmar
+        eventos.al_confirmar(db, lambda: self._publicar(clave, reserva, (estado_http, cuerpo)))
+
+    def _publicar(self, clave, reserva, respuesta):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada.reserva == reserva:
+                entrada.respuesta = respuesta
+                entrada.terminada.set()
+
+    def liberar(self, clave, reserva):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada.reserva != reserva:
+                return
+            del self._entradas[clave]
+        entrada.terminada.set()
+
+    def _purgar(self, ahora):
+        vencidas = [clave for clave, e in self._entradas.items() if e.expira < ahora]
+        for clave in vencidas:
+            del self._entradas[clave]
+
+
+class BackendBD(BackendIdempotencia):
+    # Compartido entre workers mediante la tabla 'claves_idempotencia'.
+    # La reserva usa su propia sesión (debe verse desde otros workers antes de
+    # que el endpoint confirme); la respuesta se guarda en la sesión del endpoint.
+    # Si el worker dueño muere, su reserva vence tras ARRIENDO_SEGUNDOS y otro
+    # intento la toma; el dueño anterior ya no podrá confirmar (ver guardar).
+    INTERVALO_SONDEO = 0.1
+
+    def reservar(self, clave, huella, reserva):
+        limite = time.monotonic() + ESPERA_MAXIMA
+        db = database.SessionLocal()
+        try:
+            while True:
+                ahora = time.time()
+                # La PK resuelve la carrera: solo un INSERT gana
+                db.add(models.ClaveIdempotencia(
+                    clave=clave, huella=huella, reserva=reserva, reservada=ahora, expira=ahora + TTL_SEGUNDOS
+                ))
+                try:
+                    db.commit()
+                    return None
+                except IntegrityError:
+                    db.rollback()
+
+                fila = db.query(models.ClaveIdempotencia).filter(
+                    models.ClaveIdempotencia.clave == clave
+                ).first()
+                if fila is None:
+                    continue  # se liberó entre el INSERT y la lectura
+                if fila.expira < ahora:
+                    db.delete(fila)
+                    db.commit()
+                    continue
+                _verificar_huella(fila.huella, huella)
+                if fila.estado_http is not None:
+                    return fila.estado_http, json.loads(fila.cuerpo)
+
+                if fila.reservada is None or fila.reservada < ahora - ARRIENDO_SEGUNDOS:
+                    # Arriendo vencido: tomar la reserva solo si nadie más lo hizo antes
+                    tomadas = db.query(models.ClaveIdempotencia).filter(
+                        models.ClaveIdempotencia.clave == clave,
+                        models.ClaveIdempotencia.reserva == fila.reserva,
+                        models.ClaveIdempotencia.estado_http.is_(None),
+                    ).update({"reserva": reserva, "reservada": ahora}, synchronize_session=False)
+                    db.commit()
+                    if tomadas:
+                        return None
+                    db.expunge_all()
+                    continue
+
+                if time.monotonic() >= limite:
+                    raise _en_proceso()
+                db.expunge_all()
+                time.sleep(self.INTERVALO_SONDEO)
+        finally:
+            db.close()
+
+    def guardar(self, clave, reserva, estado_http, cuerpo, db):
+        # Condicionado a seguir siendo dueño de la reserva: si otro intento la
+        # tomó, se aborta la transacción del endpoint completa
+        guardadas = db.query(models.ClaveIdempotencia).filter(
+            models.ClaveIdempotencia.clave == clave,
+            models.ClaveIdempotencia.reserva == reserva,
+            models.ClaveIdempotencia.estado_http.is_(None),
+        ).update({"estado_http": estado_http, "cuerpo": json.dumps(cuerpo)}, synchronize_session=False)
+        if not guardadas:
+            raise _reserva_perdida()
+
+    def liberar(self, clave, reserva):
+        db = database.SessionLocal()
+        try:
+            db.query(models.ClaveIdempotencia).filter(
+                models.ClaveIdempotencia.clave == clave,
+                models.ClaveIdempotencia.reserva == reserva,
+                models.ClaveIdempotencia.estado_http.is_(None),
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+BACKENDS = {"memoria": BackendMemoria, "bd": BackendBD}
+backend = BACKENDS[os.getenv("IDEMPOTENCIA_BACKEND", "memoria")]()
+
+def ejecutar(idempotency_key, usuario_id, operacion, datos, db, fn):
+    # Ejecuta fn() una sola vez por (usuario, operación, clave) y confirma 'db'.
+    # fn() no debe hacer commit: la respuesta guardada va en la misma transacción.
+    # 'datos' identifica la petición: reusar la clave con otros datos es un error.
+    if idempotency_key is None:
+        resultado = fn()
+        db.commit()
+        return resultado
+    if not idempotency_key or len(idempotency_key) > LARGO_MAXIMO_CLAVE:
+        raise HTTPException(status_code=400, detail="Idempotency-Key inválida")
+
+    clave = f"{usuario_id}:{operacion}:{idempotency_key}"
+    huella = hashlib.sha256(
+        json.dumps(jsonable_encoder(datos), sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+    reserva = uuid.uuid4().hex
+    guardada = backend.reservar(clave, huella, reserva)
+    if guardada is not None:
+        estado_http, cuerpo = guardada
+        return JSONResponse(status_code=estado_http, content=cuerpo, headers={"Idempotent-Replayed": "true"})
+
+    # Solo se guardan respuestas exitosas; si falla, el cliente puede reintentar
+    try:
+        resultado = fn()
+        backend.guardar(clave, reserva, 200, jsonable_encoder(resultado), db)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        backend.liberar(clave, reserva)
+        raise
+    return resultado
@@ -1,5 +1,6 @@
 from backend.database import SessionLocal, engine
 from backend import models
+from backend.hashing import BCRYPT_ROUNDS
 import bcrypt
 
 def init_db():
@@ -56,7 +57,7 @@ def init_db():
         print("➡️  Creando usuarios de prueba...")
 
         # Admin
-        admin_pass = bcrypt.hashpw("042025".encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        admin_pass = bcrypt.hashpw("042025".encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8')
         admin = models.Usuario(
             nombre="Jesus Admin",
             email="jesuszavaleta55@gmail.com",
@@ -71,7 +72,7 @@ def init_db():
         db.add(models.Carrito(usuario_id=admin.id)) # Carrito para admin
         
         # Cliente
-        cliente_pass = bcrypt.hashpw("12345".encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        cliente_pass = bcrypt.hashpw("12345".encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8')
         cliente = models.Usuario(
             nombre="Juan Cliente",
             email="cliente@prueba.com",
@@ -0,0 +1,153 @@
+import abc
+import os
+import threading
+import time
+from fastapi import HTTPException, Request, status
+from sqlalchemy.exc import IntegrityError
+from . import database, models
+
+# Limitador de intentos para login y restablecimiento de contraseña (token bucket).
+# Se revisa ANTES de buscar al usuario o calcular un hash, para que un ataque de
+# fuerza bruta no se convierta en CPU de bcrypt.
+# Cada clave (IP o email) tiene un balde de 'capacidad' fichas que se recarga a
+# 'recarga' fichas por segundo; cada intento consume una ficha.
+
+# (capacidad, recarga por segundo)
+LIMITE_POR_IP = (20, 20 / 60)
+LIMITE_POR_EMAIL = (5, 5 / 60)
+
+# Cantidad de proxies propios delante de la API (nginx, balanceador...).
+# Con 0 se usa la IP de la conexión; con N se toma la IP que anotó el proxy
+# más externo en X-Forwarded-For. Lo que el cliente agregue antes se ignora.
+PROXIES_CONFIABLES = int(os.getenv("PROXIES_CONFIABLES", "0"))
+
+# Un balde sin uso por más de esto ya se recargó entero: equivale a no tenerlo
+INACTIVIDAD_MAXIMA = max(capacidad / recarga for capacidad, recarga in (LIMITE_POR_IP, LIMITE_POR_EMAIL))
+
+class BackendLimitador(abc.ABC):
+    # Interfaz común: permite enchufar un almacenamiento compartido (BD, Redis...)
+    @abc.abstractmethod
+    def consumir(self, clave, capacidad, recarga):
+        # Retorna (permitido, segundos_de_espera)
+        ...
+
+def _recargar(fichas, actualizado, ahora, capacidad, recarga):
+    return min(capacidad, fichas + (ahora - actualizado) * recarga)
+
+def _resultado(fichas, recarga):
+    # Ya recargado: si alcanza para una ficha se descuenta, si no se calcula la espera
+    if fichas >= 1:
+        return True, fichas - 1, 0
+    return False, fichas, (1 - fichas) / recarga
+
+
+class BackendMemoria(BackendLimitador):
+    # Por proceso: con varios workers cada uno lleva su propia cuenta
+    MAX_CLAVES = 100_000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._baldes = {}  # clave -> (fichas, actualizado, capacidad, recarga)
+
+    def consumir(self, clave, capacidad, recarga):
+        ahora = time.monotonic()
+        with self._lock:
+            fichas, actualizado, _, _ = self._baldes.get(clave, (capacidad, ahora, capacidad, recarga))
+            fichas = _recargar(fichas, actualizado, ahora, capacidad, recarga)
+            permitido, fichas, espera = _resultado(fichas, recarga)
+            self._baldes[clave] = (fichas, ahora, capacidad, recarga)
+            if len(self._baldes) > self.MAX_CLAVES:
+                self._purgar(ahora)
+            return permitido, espera
+
+    def _purgar(self, ahora):
+        # Un balde que ya se habría llenado de nuevo equivale a no tenerlo
+        llenos = [
+            clave for clave, (f, t, capacidad, recarga) in self._baldes.items()
+            if f + (ahora - t) * recarga >= capacidad
+        ]
+        for clave in llenos:
+            del self._baldes[clave]
+
+
+class BackendBD(BackendLimitador):
+    # Compartido entre workers mediante la tabla 'limites_intento'.
+    # Usa su propia sesión para no mezclarse con la transacción del endpoint.
+    INTERVALO_PURGA = 60  # segundos entre limpiezas de baldes inactivos
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._proxima_purga = 0
+
+    def consumir(self, clave, capacidad, recarga):
+        db = database.SessionLocal()
+        try:
+            # Segundo intento solo si otro worker creó el mismo balde al mismo tiempo
+            for intento in range(2):
+                ahora = time.time()
+                balde = db.query(models.LimiteIntento).filter(
+                    models.LimiteIntento.clave == clave
+                ).with_for_update().first()
+
+                if balde is None:
+                    balde = models.LimiteIntento(clave=clave, fichas=capacidad, actualizado=ahora)
+                    db.add(balde)
+
+                fichas = _recargar(balde.fichas, balde.actualizado, ahora, capacidad, recarga)
+                permitido, balde.fichas, espera = _resultado(fichas, recarga)
+                balde.actualizado = ahora
+                try:
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+                    if intento:
+                        raise
+                    continue
+                self._purgar_si_corresponde(db, ahora)
+                return permitido, espera
+        finally:
+            db.close()
+
+    def _purgar_si_corresponde(self, db, ahora):
+        # Sin esto la tabla crece con cada IP o email que alguna vez intentó entrar
+        with self._lock:
+            if ahora < self._proxima_purga:
+                return
+            self._proxima_purga = ahora + self.INTERVALO_PURGA
+        db.query(models.LimiteIntento).filter(
+            models.LimiteIntento.actualizado < ahora - INACTIVIDAD_MAXIMA
+        ).delete(synchronize_session=False)
+        db.commit()
+
+
+BACKENDS = {"memoria": BackendMemoria, "bd": BackendBD}
+backend = BACKENDS[os.getenv("LIMITADOR_BACKEND", "memoria")]()
+
+def ip_cliente(request: Request):
+    conexion = request.client.host if request.client else "desconocida"
+    if not PROXIES_CONFIABLES:
+        return conexion
+    reenviadas = [ip.strip() for ip in request.headers.get("x-forwarded-for", "").split(",") if ip.strip()]
+    if not reenviadas:
+        return conexion
+    # Cada proxy agrega al final la IP que vio; la del cliente real la anotó el más externo
+    return reenviadas[-min(PROXIES_CONFIABLES, len(reenviadas))]
+
+def verificar_intento(request: Request, email: str):
+    # Se consumen ambas fichas aunque la primera ya falle: el atacante paga por cada intento
+    limites = [
+        (f"ip:{ip_cliente(request)}", LIMITE_POR_IP),
+        (f"email:{(email or '').strip().lower()}", LIMITE_POR_EMAIL),
+    ]
+    espera = 0
+    for clave, (capacidad, recarga) in limites:
+        permitido, segundos = backend.consumir(clave, capacidad, recarga)
+        if not permitido:
+            espera = max(espera, segundos)
+
+    if espera:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Demasiados intentos. Espera un momento antes de volver a intentarlo.",
+            headers={"Retry-After": str(int(espera) + 1)},
+        )
@@ -1,16 +1,35 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from . import models, database
+from . import models, database, eventos, esquema, hashing, busqueda_usuarios, resumen_clientes, rollups
 from .routers import auth, catalogo, carrito, pedidos, facturacion, admin
 
 # Inicializar tablas en la base de datos
 models.Base.metadata.create_all(bind=database.engine)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Columnas e índices nuevos en una base existente (sin borrar datos)
+    await run_in_threadpool(esquema.actualizar)
+    # Escuchar cambios de pedidos antes de cargar la cola de cocina,
+    # para no perder los que ocurran durante la carga
+    eventos.despachador.escuchar()
+    await run_in_threadpool(admin.reconstruir_cola_cocina)
+    await run_in_threadpool(busqueda_usuarios.completar_al_iniciar)
+    # Agregados que una base con pedidos anteriores todavía no tiene
+    await run_in_threadpool(rollups.completar_al_iniciar)
+    await run_in_threadpool(resumen_clientes.completar_al_iniciar)
+    yield
+    # Sin esto los procesos de hashing quedan vivos tras apagar el worker
+    await run_in_threadpool(hashing.pool.cerrar)
+
 # Configuración de la aplicación
 app = FastAPI(
     title="Fit Express API",
     description="Backend para gestión de e-commerce de comida saludable (Caso 19).",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configuración de seguridad (CORS)
@@ -21,8 +40,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cursores de paginación y marcas de respuesta que el frontend necesita leer
+    expose_headers=["X-Siguiente-Cursor", "X-Query-Count", "Idempotent-Replayed"],
 )
 
+# Cantidad de consultas SQL que costó cada petición (útil para detectar N+1)
+@app.middleware("http")
+async def contar_consultas_sql(request: Request, call_next):
+    with database.contar_consultas() as contador:
+        response = await call_next(request)
+    response.headers["X-Query-Count"] = str(contador[0])
+    return response
+
 # Registro de rutas (Controllers)
 app.include_router(auth.router)
 app.include_router(catalogo.router)
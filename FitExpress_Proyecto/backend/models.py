@@ -1,8 +1,21 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime, Text
-from sqlalchemy.orm import relationship
+import re
+import unicodedata
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, Date, DateTime, Text, Index, func, text
+from sqlalchemy.orm import relationship, validates
 from datetime import datetime
 from .database import Base
 
+def normalizar_texto(texto):
+    # Minúsculas y sin tildes: "Ñuñoa" -> "nunoa"
+    sin_tildes = "".join(
+        c for c in unicodedata.normalize("NFKD", texto or "") if not unicodedata.combining(c)
+    )
+    return sin_tildes.lower().strip()
+
+def normalizar_rut(rut):
+    # Solo dígitos y dígito verificador: "11.111.111-k" -> "11111111K"
+    return re.sub(r"[^0-9K]", "", (rut or "").upper())
+
 class Usuario(Base):
     __tablename__ = "usuarios"
 
@@ -16,11 +29,37 @@ class Usuario(Base):
     comuna = Column(String)
     region = Column(String)
     rol = Column(String, default="cliente")
+    # Copias normalizadas para la búsqueda por prefijo del panel admin
+    nombre_busqueda = Column(String)
+    rut_normalizado = Column(String)
     
     # Relaciones
     carrito = relationship("Carrito", back_populates="usuario", uselist=False)
     pedidos = relationship("Pedido", back_populates="usuario")
 
+    # text_pattern_ops: permite usar el índice en LIKE 'prefijo%' en PostgreSQL
+    __table_args__ = (
+        Index("ix_usuarios_nombre_busqueda", "nombre_busqueda", postgresql_ops={"nombre_busqueda": "text_pattern_ops"}),
+        Index("ix_usuarios_rut_normalizado", "rut_normalizado", postgresql_ops={"rut_normalizado": "text_pattern_ops"}),
+        Index(
+            "ix_usuarios_email_busqueda", func.lower(email).label("email_busqueda"),
+            postgresql_ops={"email_busqueda": "text_pattern_ops"},
+        ),
+        # Filtro por rol recorriendo en orden de id (paginación)
+        Index("ix_usuarios_rol_id", "rol", "id"),
+    )
+
+    # Se mantienen al día en cada asignación (registro, perfil, init_db)
+    @validates("nombre")
+    def _normalizar_nombre(self, key, nombre):
+        self.nombre_busqueda = normalizar_texto(nombre)
+        return nombre
+
+    @validates("rut")
+    def _normalizar_rut(self, key, rut):
+        self.rut_normalizado = normalizar_rut(rut)
+        return rut
+
 class Producto(Base):
     __tablename__ = "productos"
 
@@ -63,6 +102,16 @@ class CarritoItem(Base):
     carrito = relationship("Carrito", back_populates="items")
     producto = relationship("Producto")
 
+    # Una sola línea estándar (sin personalización ni precio propio) por producto y carrito.
+    # Es el índice que usa el INSERT ... ON CONFLICT al agregar productos.
+    __table_args__ = (
+        Index(
+            "uq_carrito_items_estandar", "carrito_id", "producto_id", unique=True,
+            postgresql_where=text("personalizacion IS NULL AND precio_guardado IS NULL"),
+            sqlite_where=text("personalizacion IS NULL AND precio_guardado IS NULL"),
+        ),
+    )
+
 class Pedido(Base):
     __tablename__ = "pedidos"
 
@@ -71,15 +120,38 @@ class Pedido(Base):
     fecha_creacion = Column(DateTime, default=datetime.now)
     total = Column(Integer)
     estado = Column(String, default="Recibido") 
+    # Se incrementa en cada cambio de estado (ver estados_pedido.py)
+    version = Column(Integer, nullable=False, default=1)
     
     # Datos de entrega y pago
     direccion_envio = Column(String)
     metodo_pago = Column(String)
     repartidor = Column(String, nullable=True)
+    promesa_entrega = Column(DateTime, nullable=True)  # hora comprometida al cliente
+    pagado_en = Column(DateTime, nullable=True)  # el pago no depende del avance en cocina
     
     usuario = relationship("Usuario", back_populates="pedidos")
     items = relationship("ItemPedido", back_populates="pedido")
 
+    __table_args__ = (
+        # Historial por usuario paginado por (fecha_creacion, id)
+        Index("ix_pedidos_usuario_fecha", "usuario_id", fecha_creacion.desc(), id.desc()),
+        # Recorridos por rango de fechas (reconstrucción de agregados, exportaciones)
+        # y búsqueda del admin sin filtros, en el orden del cursor
+        Index("ix_pedidos_fecha", "fecha_creacion", "id"),
+        # Búsqueda del admin: un índice por filtro de igualdad, seguido de la
+        # clave del cursor, así cualquier combinación parte de uno de ellos
+        Index("ix_pedidos_estado_fecha", "estado", fecha_creacion.desc(), id.desc()),
+        Index("ix_pedidos_metodo_pago_fecha", "metodo_pago", fecha_creacion.desc(), id.desc()),
+        Index("ix_pedidos_repartidor_fecha", "repartidor", fecha_creacion.desc(), id.desc()),
+        # Solo los pedidos activos: reconstrucción de la cola de cocina al iniciar
+        Index(
+            "ix_pedidos_activos", "promesa_entrega", "fecha_creacion", "id",
+            postgresql_where=text("estado IN ('Recibido', 'En preparacion', 'Pagado')"),
+            sqlite_where=text("estado IN ('Recibido', 'En preparacion', 'Pagado')"),
+        ),
+    )
+
 class ItemPedido(Base):
     __tablename__ = "items_pedido"
 
@@ -93,4 +165,50 @@ class ItemPedido(Base):
     cantidad = Column(Integer)
     personalizacion = Column(Text, nullable=True)
     
-    pedido = relationship("Pedido", back_populates="items")
\ No newline at end of file
+    pedido = relationship("Pedido", back_populates="items")
+
+class LimiteIntento(Base):
+    # Balde del limitador de intentos de login (backend compartido entre workers)
+    __tablename__ = "limites_intento"
+
+    clave = Column(String, primary_key=True)
+    fichas = Column(Float)
+    actualizado = Column(Float)
+
+class ClaveIdempotencia(Base):
+    # Respuesta guardada por Idempotency-Key (backend compartido entre workers).
+    # estado_http en NULL = la petición original sigue en curso
+    __tablename__ = "claves_idempotencia"
+
+    clave = Column(String, primary_key=True)
+    huella = Column(String)
+    estado_http = Column(Integer, nullable=True)
+    cuerpo = Column(Text, nullable=True)
+    expira = Column(Float)
+    reserva = Column(String, nullable=True)     # intento dueño de la clave
+    reservada = Column(Float, nullable=True)    # cuándo se tomó (arriendo)
+
+class VentaPorHora(Base):
+    # Agregado de ventas por (día, hora, método de pago, estado) según la fecha de
+    # creación del pedido. Se mantiene en la misma transacción que los cambios de
+    # pedidos (ver rollups.py) para que los reportes lean pocas filas.
+    __tablename__ = "ventas_por_hora"
+
+    dia = Column(Date, primary_key=True)
+    hora = Column(Integer, primary_key=True)
+    metodo_pago = Column(String, primary_key=True)
+    estado = Column(String, primary_key=True)
+    pedidos = Column(Integer, nullable=False, default=0)
+    monto = Column(Integer, nullable=False, default=0)
+
+class ResumenCliente(Base):
+    # Contadores por cliente: pedidos creados, cancelados, gasto (sin cancelados)
+    # y fecha del último pedido. Se mantienen en la misma transacción que los
+    # cambios de pedidos (ver resumen_clientes.py).
+    __tablename__ = "resumen_clientes"
+
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), primary_key=True)
+    pedidos = Column(Integer, nullable=False, default=0)
+    cancelados = Column(Integer, nullable=False, default=0)
+    gasto_total = Column(Integer, nullable=False, default=0)
+    ultimo_pedido = Column(DateTime, nullable=True)
@@ -0,0 +1,123 @@
+import re
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import func, or_, select, tuple_
+from sqlalchemy.orm import Session, joinedload, selectinload
+from . import models
+
+# Paginación por cursor (keyset) del historial de pedidos (y más abajo, del
+# listado de usuarios del panel admin).
+# El cursor es la clave (fecha_creacion, id) del último pedido entregado; la
+# página siguiente parte justo después usando el índice compuesto
+# (usuario_id, fecha_creacion DESC, id DESC), así el costo no depende de
+# cuántos pedidos tenga el usuario ni de qué tan atrás se esté leyendo.
+
+def codificar_cursor(pedido):
+    return f"{pedido.fecha_creacion.isoformat()}:{pedido.id}"
+
+def decodificar_cursor(cursor: str):
+    try:
+        fecha, _, pid = cursor.rpartition(":")
+        return datetime.fromisoformat(fecha), int(pid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def historial_pedidos(db: Session, usuario_id: int, limite: int, cursor=None):
+    # Retorna (pedidos, siguiente_cursor). Ítems en una sola consulta extra por página.
+    consulta = db.query(models.Pedido).options(
+        joinedload(models.Pedido.usuario),
+        selectinload(models.Pedido.items),
+    ).filter(models.Pedido.usuario_id == usuario_id)
+
+    if cursor:
+        consulta = consulta.filter(
+            tuple_(models.Pedido.fecha_creacion, models.Pedido.id) < decodificar_cursor(cursor)
+        )
+
+    # Se pide uno extra para saber si hay página siguiente
+    pedidos = consulta.order_by(
+        models.Pedido.fecha_creacion.desc(), models.Pedido.id.desc()
+    ).limit(limite + 1).all()
+
+    if len(pedidos) > limite:
+        pedidos = pedidos[:limite]
+        return pedidos, codificar_cursor(pedidos[-1])
+    return pedidos, None
+
+# ----------------------
+# BÚSQUEDA DE PEDIDOS (ADMIN)
+# ----------------------
+# Mismo cursor (fecha_creacion, id) que el historial. Cada filtro de igualdad
+# tiene un índice (filtro, fecha_creacion DESC, id DESC) y el email se resuelve
+# a usuario_id, que usa el índice del historial.
+
+def busqueda_pedidos(db: Session, limite: int, cursor=None, desde=None, hasta=None,
+                     estado=None, metodo_pago=None, email=None, repartidor=None):
+    # Retorna (pedidos, siguiente_cursor). desde/hasta: datetimes, hasta exclusivo.
+    consulta = db.query(models.Pedido).options(
+        joinedload(models.Pedido.usuario),
+        selectinload(models.Pedido.items),
+    )
+    if desde:
+        consulta = consulta.filter(models.Pedido.fecha_creacion >= desde)
+    if hasta:
+        consulta = consulta.filter(models.Pedido.fecha_creacion < hasta)
+    if estado:
+        consulta = consulta.filter(models.Pedido.estado == estado)
+    if metodo_pago:
+        consulta = consulta.filter(models.Pedido.metodo_pago == metodo_pago)
+    if repartidor:
+        consulta = consulta.filter(models.Pedido.repartidor == repartidor)
+    if email:
+        clientes = select(models.Usuario.id).where(
+            func.lower(models.Usuario.email).startswith(email.strip().lower(), autoescape=True)
+        )
+        consulta = consulta.filter(models.Pedido.usuario_id.in_(clientes))
+    if cursor:
+        consulta = consulta.filter(
+            tuple_(models.Pedido.fecha_creacion, models.Pedido.id) < decodificar_cursor(cursor)
+        )
+
+    pedidos = consulta.order_by(
+        models.Pedido.fecha_creacion.desc(), models.Pedido.id.desc()
+    ).limit(limite + 1).all()
+
+    if len(pedidos) > limite:
+        pedidos = pedidos[:limite]
+        return pedidos, codificar_cursor(pedidos[-1])
+    return pedidos, None
+
+# ----------------------
+# LISTADO DE USUARIOS (ADMIN)
+# ----------------------
+# Cursor = id del último usuario entregado. La búsqueda es por prefijo sobre
+# columnas normalizadas con índice propio (nombre, email, RUT).
+
+def _filtro_busqueda(q: str):
+    condiciones = [
+        models.Usuario.nombre_busqueda.startswith(models.normalizar_texto(q), autoescape=True),
+        func.lower(models.Usuario.email).startswith(q.strip().lower(), autoescape=True),
+    ]
+    # Solo se busca por RUT si el texto tiene forma de RUT ("11.111", "12345678-k")
+    if re.fullmatch(r"[\d.\-kK ]*\d[\d.\-kK ]*", q.strip()):
+        condiciones.append(models.Usuario.rut_normalizado.startswith(models.normalizar_rut(q)))
+    return or_(*condiciones)
+
+def listado_usuarios(db: Session, limite: int, cursor=None, q=None, rol=None):
+    # Retorna (usuarios, siguiente_cursor)
+    consulta = db.query(models.Usuario)
+    if q and q.strip():
+        consulta = consulta.filter(_filtro_busqueda(q))
+    if rol:
+        consulta = consulta.filter(models.Usuario.rol == rol)
+    if cursor:
+        try:
+            consulta = consulta.filter(models.Usuario.id > int(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    usuarios = consulta.order_by(models.Usuario.id).limit(limite + 1).all()
+    if len(usuarios) > limite:
+        usuarios = usuarios[:limite]
+        return usuarios, str(usuarios[-1].id)
+    return usuarios, None
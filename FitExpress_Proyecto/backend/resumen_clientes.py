@@ -0,0 +1,156 @@
+import sys
+from sqlalchemy import case, func, insert, text
+from sqlalchemy.orm import Session
+from . import database, estados_pedido, models
+
+# Resumen por cliente (cantidad de pedidos, cancelados, gasto total y último
+# pedido) para no recorrer el historial completo al mirar a un cliente.
+# Las escrituras ocurren en la transacción del endpoint (las llama
+# estados_pedido.py): crear suma el pedido y cancelar lo descuenta del gasto.
+#
+# Uso por consola:
+#   python -m backend.resumen_clientes reconstruir   -> recalcula todo desde 'pedidos'
+#                                                       (la app lo hace sola al iniciar si está vacío)
+#   python -m backend.resumen_clientes verificar     -> compara con los datos crudos
+
+_CAMPOS = ["pedidos", "cancelados", "gasto_total", "ultimo_pedido"]
+
+def _sumar(db: Session, fila):
+    # INSERT ... ON CONFLICT DO UPDATE: la primera compra crea la fila
+    resumen = models.ResumenCliente
+    stmt = database.insert_upsert(db, resumen).values(fila)
+    ultimo = func.coalesce(resumen.ultimo_pedido, stmt.excluded.ultimo_pedido)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["usuario_id"],
+        set_={
+            "pedidos": resumen.pedidos + stmt.excluded.pedidos,
+            "cancelados": resumen.cancelados + stmt.excluded.cancelados,
+            "gasto_total": resumen.gasto_total + stmt.excluded.gasto_total,
+            "ultimo_pedido": case(
+                (stmt.excluded.ultimo_pedido > ultimo, stmt.excluded.ultimo_pedido), else_=ultimo
+            ),
+        },
+    )
+    db.execute(stmt)
+
+def registrar_creacion(db: Session, pedido):
+    if pedido.usuario_id is None:
+        return
+    cancelado = pedido.estado == estados_pedido.CANCELADO
+    _sumar(db, {
+        "usuario_id": pedido.usuario_id,
+        "pedidos": 1,
+        "cancelados": 1 if cancelado else 0,
+        "gasto_total": 0 if cancelado else (pedido.total or 0),
+        "ultimo_pedido": pedido.fecha_creacion,
+    })
+
+def registrar_transicion(db: Session, pedido, estado_anterior, estado_nuevo):
+    # Solo la cancelación cambia el resumen (pagar o avanzar no lo mueven)
+    if pedido.usuario_id is None or estado_nuevo != estados_pedido.CANCELADO:
+        return
+    _sumar(db, {
+        "usuario_id": pedido.usuario_id,
+        "pedidos": 0,
+        "cancelados": 1,
+        "gasto_total": -(pedido.total or 0),
+        "ultimo_pedido": None,
+    })
+
+def obtener(db: Session, usuario_ids):
+    # {usuario_id: ResumenCliente}; los clientes sin pedidos no tienen fila
+    if not usuario_ids:
+        return {}
+    filas = db.query(models.ResumenCliente).filter(models.ResumenCliente.usuario_id.in_(usuario_ids))
+    return {r.usuario_id: r for r in filas}
+
+# ----------------------
+# RECONSTRUCCIÓN Y VERIFICACIÓN
+# ----------------------
+
+def _agregado_crudo():
+    cancelado = models.Pedido.estado == estados_pedido.CANCELADO
+    return [
+        models.Pedido.usuario_id,
+        func.count(models.Pedido.id),
+        func.coalesce(func.sum(case((cancelado, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((cancelado, 0), else_=models.Pedido.total)), 0),
+        func.max(models.Pedido.fecha_creacion),
+    ]
+
+def reconstruir(db: Session):
+    # Recalcula todos los resúmenes con un INSERT ... SELECT agrupado.
+    # En PostgreSQL se bloquean las escrituras a 'pedidos' mientras dura.
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE pedidos IN SHARE MODE"))
+
+    db.query(models.ResumenCliente).delete(synchronize_session=False)
+    db.execute(
+        insert(models.ResumenCliente).from_select(
+            ["usuario_id"] + _CAMPOS,
+            db.query(*_agregado_crudo())
+            .filter(models.Pedido.usuario_id.isnot(None))
+            .group_by(models.Pedido.usuario_id),
+        )
+    )
+    db.commit()
+    return db.query(func.count()).select_from(models.ResumenCliente).scalar()
+
+def reconstruir_si_falta(db: Session):
+    # Los clientes con pedidos anteriores al resumen aparecerían con 0 pedidos.
+    # Un pedido con cliente siempre deja su fila, así que vacío significa "nunca construido".
+    con_cliente = db.query(models.Pedido.id).filter(models.Pedido.usuario_id.isnot(None))
+    if db.query(models.ResumenCliente.usuario_id).first() is not None or con_cliente.first() is None:
+        return 0
+    if db.get_bind().dialect.name == "postgresql":
+        # Otro worker puede estar haciendo lo mismo: se espera y se vuelve a mirar
+        db.execute(text("LOCK TABLE resumen_clientes IN EXCLUSIVE MODE"))
+        if db.query(models.ResumenCliente.usuario_id).first() is not None:
+            db.commit()
+            return 0
+    return reconstruir(db)
+
+def completar_al_iniciar():
+    db = database.SessionLocal()
+    try:
+        reconstruir_si_falta(db)
+    finally:
+        db.close()
+
+def verificar(db: Session):
+    # Retorna las diferencias [(usuario_id, resumen guardado, resumen real)]
+    reales = {
+        uid: (n, int(c), int(g), f)
+        for uid, n, c, g, f in db.query(*_agregado_crudo())
+        .filter(models.Pedido.usuario_id.isnot(None))
+        .group_by(models.Pedido.usuario_id)
+    }
+    guardados = {
+        r.usuario_id: (r.pedidos, r.cancelados, r.gasto_total, r.ultimo_pedido)
+        for r in db.query(models.ResumenCliente)
+    }
+    vacio = (0, 0, 0, None)
+    return [
+        (uid, guardados.get(uid, vacio), reales.get(uid, vacio))
+        for uid in sorted(set(reales) | set(guardados))
+        if guardados.get(uid, vacio) != reales.get(uid, vacio)
+    ]
+
+
+if __name__ == "__main__":
+    comando = sys.argv[1] if len(sys.argv) > 1 else ""
+    db = database.SessionLocal()
+    try:
+        if comando == "reconstruir":
+            print(f"✅ Resumen de clientes reconstruido: {reconstruir(db)} clientes")
+        elif comando == "verificar":
+            diferencias = verificar(db)
+            for uid, guardado, real in diferencias:
+                print(f"❌ usuario {uid}: resumen={guardado} real={real}")
+            print("✅ Resumen consistente" if not diferencias else f"{len(diferencias)} diferencias")
+            sys.exit(1 if diferencias else 0)
+        else:
+            print("Uso: python -m backend.resumen_clientes [reconstruir|verificar]")
+            sys.exit(2)
+    finally:
+        db.close()
@@ -0,0 +1,141 @@
+import sys
+from datetime import datetime
+from sqlalchemy import extract, func, insert, text
+from sqlalchemy.orm import Session
+from . import database, models
+
+# Agregados de ventas por (día, hora, método de pago, estado).
+# El bucket lo decide la fecha de creación del pedido; al cambiar de estado el
+# pedido se mueve de la fila del estado anterior a la del nuevo.
+# Todas las escrituras ocurren en la transacción del endpoint (las llama
+# estados_pedido.py), así el agregado nunca queda desfasado de los pedidos.
+#
+# Uso por consola:
+#   python -m backend.rollups reconstruir   -> recalcula todo desde 'pedidos'
+#                                              (la app lo hace sola al iniciar si está vacío)
+#   python -m backend.rollups verificar     -> compara con los datos crudos
+
+_CLAVE = ["dia", "hora", "metodo_pago", "estado"]
+
+def _bucket(pedido, estado):
+    fecha = pedido.fecha_creacion or datetime.now()
+    return {
+        "dia": fecha.date(),
+        "hora": fecha.hour,
+        "metodo_pago": pedido.metodo_pago or "",
+        "estado": estado,
+    }
+
+def _sumar(db: Session, filas):
+    # Un solo INSERT ... ON CONFLICT DO UPDATE para todas las filas afectadas
+    stmt = database.insert_upsert(db, models.VentaPorHora).values(filas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=_CLAVE,
+        set_={
+            "pedidos": models.VentaPorHora.pedidos + stmt.excluded.pedidos,
+            "monto": models.VentaPorHora.monto + stmt.excluded.monto,
+        },
+    )
+    db.execute(stmt)
+
+def registrar_creacion(db: Session, pedido):
+    _sumar(db, [dict(_bucket(pedido, pedido.estado), pedidos=1, monto=pedido.total or 0)])
+
+def registrar_transicion(db: Session, pedido, estado_anterior, estado_nuevo):
+    monto = pedido.total or 0
+    _sumar(db, [
+        dict(_bucket(pedido, estado_anterior), pedidos=-1, monto=-monto),
+        dict(_bucket(pedido, estado_nuevo), pedidos=1, monto=monto),
+    ])
+
+# ----------------------
+# RECONSTRUCCIÓN Y VERIFICACIÓN
+# ----------------------
+
+def _agregado_crudo():
+    dia = func.date(models.Pedido.fecha_creacion)
+    hora = extract("hour", models.Pedido.fecha_creacion)
+    return [
+        dia, hora,
+        func.coalesce(models.Pedido.metodo_pago, ""),
+        models.Pedido.estado,
+        func.count(models.Pedido.id),
+        func.coalesce(func.sum(models.Pedido.total), 0),
+    ], [dia, hora, func.coalesce(models.Pedido.metodo_pago, ""), models.Pedido.estado]
+
+def reconstruir(db: Session):
+    # Recalcula el agregado completo con un INSERT ... SELECT agrupado.
+    # En PostgreSQL se bloquean las escrituras a 'pedidos' mientras dura, para
+    # que ningún pedido quede contado dos veces o fuera del agregado.
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE pedidos IN SHARE MODE"))
+
+    columnas, grupo = _agregado_crudo()
+    db.query(models.VentaPorHora).delete(synchronize_session=False)
+    db.execute(
+        insert(models.VentaPorHora).from_select(
+            ["dia", "hora", "metodo_pago", "estado", "pedidos", "monto"],
+            db.query(*columnas).filter(models.Pedido.fecha_creacion.isnot(None)).group_by(*grupo),
+        )
+    )
+    db.commit()
+    return db.query(func.count()).select_from(models.VentaPorHora).scalar()
+
+def reconstruir_si_falta(db: Session):
+    # Una base con pedidos anteriores al agregado lo tiene vacío y el reporte
+    # mostraría 0 ventas. Con pedidos, el agregado nunca queda sin filas
+    # (registrar_* no las borra), así que vacío significa "nunca construido".
+    if db.query(models.VentaPorHora.dia).first() is not None or db.query(models.Pedido.id).first() is None:
+        return 0
+    if db.get_bind().dialect.name == "postgresql":
+        # Otro worker puede estar haciendo lo mismo: se espera y se vuelve a mirar
+        db.execute(text("LOCK TABLE ventas_por_hora IN EXCLUSIVE MODE"))
+        if db.query(models.VentaPorHora.dia).first() is not None:
+            db.commit()
+            return 0
+    return reconstruir(db)
+
+def completar_al_iniciar():
+    db = database.SessionLocal()
+    try:
+        reconstruir_si_falta(db)
+    finally:
+        db.close()
+
+def verificar(db: Session):
+    # Retorna las diferencias [(clave, (pedidos, monto) agregado, (pedidos, monto) real)]
+    columnas, grupo = _agregado_crudo()
+    reales = {
+        (str(d), int(h), m, e): (n, int(s))
+        for d, h, m, e, n, s in db.query(*columnas).filter(
+            models.Pedido.fecha_creacion.isnot(None)
+        ).group_by(*grupo)
+    }
+    agregados = {
+        (str(f.dia), f.hora, f.metodo_pago, f.estado): (f.pedidos, f.monto)
+        for f in db.query(models.VentaPorHora).filter(models.VentaPorHora.pedidos != 0)
+    }
+    return [
+        (clave, agregados.get(clave, (0, 0)), reales.get(clave, (0, 0)))
+        for clave in sorted(set(reales) | set(agregados))
+        if agregados.get(clave, (0, 0)) != reales.get(clave, (0, 0))
+    ]
+
+
+if __name__ == "__main__":
+    comando = sys.argv[1] if len(sys.argv) > 1 else ""
+    db = database.SessionLocal()
+    try:
+        if comando == "reconstruir":
+            print(f"✅ Agregado de ventas reconstruido: {reconstruir(db)} filas")
+        elif comando == "verificar":
+            diferencias = verificar(db)
+            for clave, agregado, real in diferencias:
+                print(f"❌ {clave}: agregado={agregado} real={real}")
+            print("✅ Agregado consistente" if not diferencias else f"{len(diferencias)} diferencias")
+            sys.exit(1 if diferencias else 0)
+        else:
+            print("Uso: python -m backend.rollups [reconstruir|verificar]")
+            sys.exit(2)
+    finally:
+        db.close()
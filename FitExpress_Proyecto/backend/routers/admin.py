@@ -1,8 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from .. import models, schemas, database
-from ..dependencies import get_user_from_token
+import asyncio
+from datetime import date, datetime, time, timedelta, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from jose import JWTError, jwt
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload, selectinload
+from typing import List, Optional
+from .. import models, schemas, database, analitica, catalogo_cache, estados_pedido, eventos, exportacion, paginacion, resumen_clientes
+from ..cola_cocina import ESTADOS_COCINA, clave_prioridad, cola
+from ..dependencies import ALGORITHM, SECRET_KEY, get_user_from_token, invalidar_principal, principales
 
 router = APIRouter(prefix="/admin", tags=["Panel Admin"])
 
@@ -29,7 +37,10 @@ def _formatear_pedido(pedido):
         "id": pedido.id,
         "total": pedido.total,
         "estado": pedido.estado,
+        "version": pedido.version,
         "fecha_creacion": pedido.fecha_creacion,
+        "promesa_entrega": pedido.promesa_entrega,
+        "pagado_en": pedido.pagado_en,
         "direccion_envio": pedido.direccion_envio,
         "metodo_pago": pedido.metodo_pago,
         "repartidor": pedido.repartidor,
@@ -45,22 +56,179 @@ def _formatear_pedido(pedido):
 # COCINA Y PEDIDOS
 # ----------------------
 
-@router.get("/pedidos/activos")
-def get_cola_cocina(db: Session = Depends(database.get_db), admin=Depends(solo_admin)):
-    estados_activos = ["Recibido", "En preparacion", "Pagado"]
-    pedidos = db.query(models.Pedido).filter(
-        models.Pedido.estado.in_(estados_activos)
-    ).order_by(models.Pedido.fecha_creacion.asc()).all()
-    
+KEEPALIVE_SEGUNDOS = 15
+
+def _pedidos_con_detalle(db: Session):
+    # Ítems y cliente precargados: sin consultas extra por pedido
+    return db.query(models.Pedido).options(
+        joinedload(models.Pedido.usuario),
+        selectinload(models.Pedido.items),
+    )
+
+def _entrada_cola(pedido):
+    return clave_prioridad(pedido), jsonable_encoder(_formatear_pedido(pedido))
+
+def reconstruir_cola_cocina():
+    # Carga completa desde la BD (índice parcial ix_pedidos_activos).
+    # Se llama al iniciar la app y cuando pudieron perderse avisos.
+    with cola.escritura:
+        db = database.SessionLocal()
+        try:
+            pedidos = _pedidos_con_detalle(db).filter(
+                models.Pedido.estado.in_(ESTADOS_COCINA)
+            ).all()
+            cola.reconstruir([_entrada_cola(p) for p in pedidos])
+        finally:
+            db.close()
+
+def _cola_cocina(limite=None):
+    if not cola.cargada:
+        reconstruir_cola_cocina()
+    return cola.primeros(limite)
+
+@router.get("/pedidos")
+def buscar_pedidos(
+    response: Response,
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    estado: Optional[str] = None,
+    metodo_pago: Optional[str] = None,
+    email: Optional[str] = Query(None, max_length=100),
+    repartidor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: Session = Depends(database.get_db),
+    admin=Depends(solo_admin)
+):
+    # Más recientes primero, paginado con X-Siguiente-Cursor. fecha_hasta es
+    # inclusiva; email busca por prefijo del correo del cliente.
+    if estado and estado not in estados_pedido.ESTADOS:
+        raise HTTPException(status_code=400, detail=f"Estado no válido. Opciones: {', '.join(estados_pedido.ESTADOS)}")
+
+    pedidos, siguiente = paginacion.busqueda_pedidos(
+        db, limit, cursor,
+        desde=datetime.combine(fecha_desde, time.min) if fecha_desde else None,
+        hasta=datetime.combine(fecha_hasta + timedelta(days=1), time.min) if fecha_hasta else None,
+        estado=estado, metodo_pago=metodo_pago, email=email, repartidor=repartidor,
+    )
+    if siguiente:
+        response.headers["X-Siguiente-Cursor"] = siguiente
     return [_formatear_pedido(p) for p in pedidos]
 
+@router.get("/pedidos/activos")
+def get_cola_cocina(limit: Optional[int] = Query(None, ge=1), admin=Depends(solo_admin)):
+    # Se lee de la cola en memoria: no consulta la tabla de pedidos
+    return _cola_cocina(limit)
+
+@eventos.despachador.al_cambiar_pedido
+def _actualizar_cola_cocina(pedido_id, estado):
+    # Corre en el hilo despachador: el pedido se carga una vez por worker,
+    # no una vez por pantalla conectada
+    if pedido_id is None:
+        reconstruir_cola_cocina()
+        eventos.canal_cocina.difundir("resync", {})
+        return
+    with cola.escritura:
+        if estado not in ESTADOS_COCINA:
+            cola.retirar(pedido_id)
+            eventos.canal_cocina.difundir("retirado", {"id": pedido_id, "estado": estado})
+            return
+
+        db = database.SessionLocal()
+        try:
+            pedido = _pedidos_con_detalle(db).filter(models.Pedido.id == pedido_id).first()
+            # Se usa el estado leído ahora: pudo cambiar de nuevo desde el aviso
+            if pedido and pedido.estado in ESTADOS_COCINA:
+                clave, datos = _entrada_cola(pedido)
+                cola.actualizar(clave, datos)
+                eventos.canal_cocina.difundir("pedido", datos)
+            elif pedido:
+                cola.retirar(pedido.id)
+                eventos.canal_cocina.difundir("retirado", {"id": pedido.id, "estado": pedido.estado})
+        finally:
+            db.close()
+
+# EventSource no permite headers, así que la credencial va en la URL (y termina
+# en logs e historial). En vez del token de sesión se usa un ticket que solo
+# sirve para abrir el stream y vence en segundos.
+AUDIENCIA_STREAM = "cocina-stream"
+TICKET_STREAM_SEGUNDOS = 60
+
+@router.post("/pedidos/stream/ticket")
+def crear_ticket_stream(admin=Depends(solo_admin)):
+    expira = datetime.now(timezone.utc) + timedelta(seconds=TICKET_STREAM_SEGUNDOS)
+    ticket = jwt.encode({"sub": admin.email, "aud": AUDIENCIA_STREAM, "exp": expira}, SECRET_KEY, algorithm=ALGORITHM)
+    return {"ticket": ticket, "expira_en": TICKET_STREAM_SEGUNDOS}
+
+def _autenticar_cocina(ticket: str):
+    # El ticket lleva 'aud', por eso get_user_from_token lo rechaza como token de sesión
+    ticket_invalido = HTTPException(status_code=401, detail="Ticket de stream inválido o vencido")
+    try:
+        # require_aud: sin él, un token de sesión (que no trae 'aud') también pasaría
+        email = jwt.decode(
+            ticket, SECRET_KEY, algorithms=[ALGORITHM],
+            audience=AUDIENCIA_STREAM, options={"require_aud": True, "require_exp": True},
+        ).get("sub")
+    except JWTError:
+        raise ticket_invalido
+    db = database.SessionLocal()
+    try:
+        # Se vuelve a mirar el rol: un admin degradado no reabre el stream
+        user = db.query(models.Usuario).filter(models.Usuario.email == email).first()
+        if user is None:
+            raise ticket_invalido
+        solo_admin(user)
+    finally:
+        db.close()
+
+
+@router.get("/pedidos/stream")
+async def stream_cola_cocina(request: Request, ticket: str = Query(...)):
+    # Server-Sent Events: snapshot de la cola al conectar y luego un evento por
+    # cada cambio ("pedido" = nuevo o actualizado, "retirado" = salió de la cola).
+    # 'ticket' sale de POST /admin/pedidos/stream/ticket.
+    await run_in_threadpool(_autenticar_cocina, ticket)
+
+    # Suscribirse antes del snapshot para no perder cambios intermedios
+    mensajes = eventos.canal_cocina.suscribir(asyncio.get_running_loop())
+    try:
+        snapshot = await run_in_threadpool(_cola_cocina)
+    except Exception:
+        eventos.canal_cocina.desuscribir(mensajes)
+        raise
+
+    async def flujo():
+        try:
+            yield eventos.formato_sse("snapshot", snapshot)
+            while True:
+                try:
+                    evento, datos = await asyncio.wait_for(mensajes.get(), KEEPALIVE_SEGUNDOS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if evento is None:
+                    break  # cliente atrasado: que reconecte y reciba un snapshot nuevo
+                yield eventos.formato_sse(evento, datos)
+        finally:
+            eventos.canal_cocina.desuscribir(mensajes)
+
+    return StreamingResponse(
+        flujo(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.put("/pedidos/{id}/estado")
-def update_estado_pedido(id: int, estado: str, db: Session = Depends(database.get_db), admin=Depends(solo_admin)):
+def update_estado_pedido(id: int, estado: str, version: Optional[int] = None, db: Session = Depends(database.get_db), admin=Depends(solo_admin)):
+    # 'version' (opcional) es la que mostraba la pantalla: si el pedido cambió
+    # desde entonces se responde 409 con el estado actual
     pedido = db.query(models.Pedido).filter(models.Pedido.id == id).first()
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
     
-    pedido.estado = estado
+    estados_pedido.transicionar(db, pedido, estado, version_esperada=version)
     db.commit()
     return {"mensaje": "Estado actualizado correctamente"}
 
@@ -68,9 +236,40 @@ def update_estado_pedido(id: int, estado: str, db: Session = Depends(database.ge
 # GESTIÓN DE USUARIOS
 # ----------------------
 
-@router.get("/usuarios", response_model=List[schemas.UsuarioOut])
-def get_usuarios(db: Session = Depends(database.get_db), admin=Depends(solo_admin)):
-    return db.query(models.Usuario).all()
+@router.get("/usuarios", response_model=List[schemas.UsuarioAdminOut])
+def get_usuarios(
+    response: Response,
+    q: Optional[str] = Query(None, max_length=100),
+    rol: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: Session = Depends(database.get_db),
+    admin=Depends(solo_admin)
+):
+    # q: prefijo de nombre, email o RUT. Paginado por id con X-Siguiente-Cursor.
+    usuarios, siguiente = paginacion.listado_usuarios(db, limit, cursor, q, rol)
+    if siguiente:
+        response.headers["X-Siguiente-Cursor"] = siguiente
+
+    resumenes = resumen_clientes.obtener(db, [u.id for u in usuarios])
+    resultado = []
+    for u in usuarios:
+        fila = schemas.UsuarioAdminOut.model_validate(u)
+        resumen = resumenes.get(u.id)
+        if resumen:
+            fila.cantidad_pedidos, fila.valor_total = resumen.pedidos, resumen.gasto_total
+        resultado.append(fila)
+    return resultado
+
+@router.get("/usuarios/{user_id}/resumen", response_model=schemas.ResumenClienteOut)
+def get_resumen_usuario(user_id: int, db: Session = Depends(database.get_db), admin=Depends(solo_admin)):
+    # Una lectura por clave primaria, sin recorrer el historial
+    resumen = db.get(models.ResumenCliente, user_id)
+    if resumen:
+        return resumen
+    if not db.get(models.Usuario, user_id):
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return schemas.ResumenClienteOut(usuario_id=user_id)
 
 @router.put("/usuarios/{user_id}/rol")
 def update_rol_usuario(user_id: int, datos: schemas.CambioRol, db: Session = Depends(database.get_db), admin=Depends(solo_admin)):
@@ -82,17 +281,29 @@ def update_rol_usuario(user_id: int, datos: schemas.CambioRol, db: Session = Dep
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     usuario.rol = datos.nuevo_rol
+    invalidar_principal(db, usuario.id)
     db.commit()
     return {"mensaje": "Rol actualizado"}
 
 @router.get("/usuarios/{user_id}/historial")
-def get_historial_usuario(user_id: int, db: Session = Depends(database.get_db), admin=Depends(solo_admin)):
-    pedidos = db.query(models.Pedido).filter(
-        models.Pedido.usuario_id == user_id
-    ).order_by(models.Pedido.fecha_creacion.desc()).all()
+def get_historial_usuario(
+    user_id: int,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: Session = Depends(database.get_db),
+    admin=Depends(solo_admin)
+):
+    pedidos, siguiente = paginacion.historial_pedidos(db, user_id, limit, cursor)
+    if siguiente:
+        response.headers["X-Siguiente-Cursor"] = siguiente
     
     return [_formatear_pedido(p) for p in pedidos]
 
+@router.get("/cache/principales")
+def get_estadisticas_principales(admin=Depends(solo_admin)):
+    return principales.estadisticas()
+
 # ----------------------
 # GESTIÓN DE PRODUCTOS
 # ----------------------
@@ -105,8 +316,11 @@ def get_productos(db: Session = Depends(database.get_db), admin=Depends(solo_adm
 def create_producto(prod: schemas.ProductoCreate, db: Session = Depends(database.get_db), admin=Depends(solo_admin)):
     nuevo_producto = models.Producto(**prod.dict())
     db.add(nuevo_producto)
+    db.flush()
+    catalogo_cache.avisar_cambio(db, nuevo_producto.id)
     db.commit()
     db.refresh(nuevo_producto)
+    catalogo_cache.actualizar_producto(nuevo_producto)
     return nuevo_producto
 
 @router.put("/productos/{pid}")
@@ -119,8 +333,10 @@ def update_producto(pid: int, datos: schemas.ProductoUpdate, db: Session = Depen
     for key, value in datos.dict(exclude_unset=True).items():
         setattr(producto, key, value)
     
+    catalogo_cache.avisar_cambio(db, pid)
     db.commit()
     db.refresh(producto)
+    catalogo_cache.actualizar_producto(producto)
     return producto
 
 @router.delete("/productos/{pid}")
@@ -130,7 +346,9 @@ def delete_producto(pid: int, db: Session = Depends(database.get_db), admin=Depe
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
     db.delete(producto)
+    catalogo_cache.avisar_cambio(db, pid)
     db.commit()
+    catalogo_cache.eliminar_producto(pid)
     return {"mensaje": "Producto eliminado"}
 
 # ----------------------
@@ -138,15 +356,119 @@ def delete_producto(pid: int, db: Session = Depends(database.get_db), admin=Depe
 # ----------------------
 
 @router.get("/reportes/ventas")
-def get_reporte_ventas(db: Session = Depends(database.get_db), admin=Depends(solo_admin)):
-    pedidos_validos = db.query(models.Pedido).filter(models.Pedido.estado != "Cancelado").all()
-    
-    total_ventas = sum(p.total for p in pedidos_validos)
-    cantidad = len(pedidos_validos)
+def get_reporte_ventas(
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    db: Session = Depends(database.get_db),
+    admin=Depends(solo_admin)
+):
+    # Se lee el agregado por hora (ventas_por_hora), no la tabla de pedidos:
+    # cualquier rango cuesta a lo más 24 filas por día, método y estado.
+    # fecha_hasta es inclusiva; sin fechas se considera todo el historial.
+    venta = models.VentaPorHora
+    monto = func.sum(venta.monto)
+    cantidad_pedidos = func.sum(venta.pedidos)
+    consulta = db.query(
+        venta.dia, venta.metodo_pago, monto.label("monto"), cantidad_pedidos.label("pedidos")
+    ).filter(venta.estado != estados_pedido.CANCELADO)
+
+    if fecha_desde:
+        consulta = consulta.filter(venta.dia >= fecha_desde)
+    if fecha_hasta:
+        consulta = consulta.filter(venta.dia <= fecha_hasta)
+
+    filas = consulta.group_by(venta.dia, venta.metodo_pago).having(
+        cantidad_pedidos > 0
+    ).order_by(venta.dia, venta.metodo_pago).all()
+
+    tabla_datos = [
+        {
+            "fecha": str(f.dia),
+            "canal": f.metodo_pago,
+            "monto": int(f.monto),
+            "pedidos": int(f.pedidos),
+            "ticket_promedio": int(f.monto / f.pedidos)
+        }
+        for f in filas
+    ]
+
+    # Totales sobre las filas ya agrupadas
+    total_ventas = sum(f["monto"] for f in tabla_datos)
+    cantidad = sum(f["pedidos"] for f in tabla_datos)
     ticket_promedio = int(total_ventas / cantidad) if cantidad > 0 else 0
     
     return {
         "total_ventas": total_ventas,
         "cantidad_pedidos": cantidad,
-        "ticket_promedio": ticket_promedio
-    }
\ No newline at end of file
+        "ticket_promedio": ticket_promedio,
+        "tabla_datos": tabla_datos
+    }
+
+# Analítica de productos (ver analitica.py): sin fechas se considera todo el historial
+
+def _agregar_nombres(db: Session, filas, *campos):
+    # Nombres de los productos involucrados en una sola consulta IN
+    ids = {fila[campo] for fila in filas for campo in campos}
+    nombres = dict(db.query(models.Producto.id, models.Producto.nombre).filter(models.Producto.id.in_(ids))) if ids else {}
+    for fila in filas:
+        for campo in campos:
+            fila[campo.replace("_id", "_nombre")] = nombres.get(fila[campo])
+    return filas
+
+@router.get("/reportes/productos/top")
+def get_top_productos(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    orden: str = Query("ingresos", pattern="^(ingresos|unidades)$"),
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(database.get_db),
+    admin=Depends(solo_admin)
+):
+    lineas = analitica.cache.obtener(desde, hasta)
+    return _agregar_nombres(db, lineas.top_productos(orden, limit), "producto_id")
+
+@router.get("/reportes/productos/pares")
+def get_productos_comprados_juntos(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    producto_id: Optional[int] = None,
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(database.get_db),
+    admin=Depends(solo_admin)
+):
+    # Con producto_id: qué se compra junto con ese producto (candidatos a combo)
+    lineas = analitica.cache.obtener(desde, hasta)
+    return _agregar_nombres(db, lineas.pares(producto_id, limit), "producto_id", "acompanante_id")
+
+@router.get("/reportes/productos/por_hora")
+def get_mezcla_por_hora(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    db: Session = Depends(database.get_db),
+    admin=Depends(solo_admin)
+):
+    lineas = analitica.cache.obtener(desde, hasta)
+    horas = lineas.mezcla_por_hora()
+    _agregar_nombres(db, [p for h in horas for p in h["productos"]], "producto_id")
+    return horas
+
+@router.get("/export/pedidos")
+def exportar_pedidos(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    formato: str = Query("csv", pattern="^(csv|ndjson)$"),
+    admin=Depends(solo_admin)
+):
+    # Una fila por línea de pedido, enviada en streaming (memoria constante).
+    # 'hasta' es inclusiva; sin fechas se exporta todo el historial.
+    if formato == "csv":
+        filas, media_type, extension = exportacion.filas_csv(desde, hasta), "text/csv; charset=utf-8", "csv"
+    else:
+        filas, media_type, extension = exportacion.filas_ndjson(desde, hasta), "application/x-ndjson", "ndjson"
+
+    nombre = f"pedidos_{desde or 'inicio'}_{hasta or 'hoy'}.{extension}"
+    return StreamingResponse(
+        filas,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+    )
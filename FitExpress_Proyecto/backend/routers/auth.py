@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
 from jose import jwt
-import bcrypt 
 from backend import models, schemas, database
-from backend.dependencies import SECRET_KEY, ALGORITHM, get_user_from_token
+from backend.hashing import hash_password, verificar_password, necesita_rehash
+from backend.limitador import verificar_intento
+from backend.dependencies import SECRET_KEY, ALGORITHM, get_user_from_token, invalidar_principal
 
 router = APIRouter(prefix="/auth", tags=["Autenticación"])
 
@@ -21,7 +22,7 @@ def registro(user_in: schemas.UsuarioCreate, db: Session = Depends(database.get_
     # Preparar datos del usuario
     user_data = user_in.dict()
     plain_password = user_data.pop("password") 
-    hashed_pw = bcrypt.hashpw(plain_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_pw = hash_password(plain_password)
     
     # Crear instancia
     nuevo_user = models.Usuario(**user_data, hashed_password=hashed_pw)
@@ -38,16 +39,25 @@ def registro(user_in: schemas.UsuarioCreate, db: Session = Depends(database.get_
     return {"mensaje": "Usuario creado exitosamente", "id": nuevo_user.id}
 
 @router.post("/token", response_model=schemas.Token)
-def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+def login(request: Request, form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+    # Primero el limitador: un intento rechazado no cuesta ni consulta ni bcrypt
+    verificar_intento(request, form.username)
+
     user = db.query(models.Usuario).filter(models.Usuario.email == form.username).first()
     
-    if not user or not bcrypt.checkpw(form.password.encode('utf-8'), user.hashed_password.encode('utf-8')):
+    if not user or not verificar_password(form.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Credenciales incorrectas",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Si cambió el costo de bcrypt, aprovechar que tenemos la clave en claro para actualizar el hash
+    if necesita_rehash(user.hashed_password):
+        user.hashed_password = hash_password(form.password)
+        db.commit()
+        db.refresh(user)
+    
     token_data = {"sub": user.email}
     token = jwt.encode(token_data, SECRET_KEY, algorithm=ALGORITHM)
     
@@ -55,17 +65,20 @@ def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(dat
 
 # ---ENDPOINT PARA RESTABLECER CONTRASEÑA ---
 @router.put("/restablecer-password")
-def restablecer_password(datos: schemas.PasswordReset, db: Session = Depends(database.get_db)):
+def restablecer_password(request: Request, datos: schemas.PasswordReset, db: Session = Depends(database.get_db)):
+    verificar_intento(request, datos.email)
+
     # 1. Buscar usuario
     user = db.query(models.Usuario).filter(models.Usuario.email == datos.email).first()
     if not user:
         raise HTTPException(status_code=404, detail="El correo no está registrado")
     
     # 2. Encriptar nueva contraseña
-    hashed_pw = bcrypt.hashpw(datos.new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_pw = hash_password(datos.new_password)
     
     # 3. Guardar en BD
     user.hashed_password = hashed_pw
+    invalidar_principal(db, user.id)
     db.commit()
     
     return {"mensaje": "Contraseña actualizada exitosamente"}
@@ -84,6 +97,7 @@ def actualizar_perfil(
     for key, value in update_data.items():
         setattr(user, key, value)
     
+    invalidar_principal(db, user.id)
     db.commit()
     db.refresh(user)
     return user
\ No newline at end of file
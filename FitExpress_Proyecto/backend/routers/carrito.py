@@ -1,21 +1,34 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import text
+from sqlalchemy.orm import Session, joinedload
+from typing import List
 from .. import models, schemas, database
 from ..dependencies import get_user_from_token
 
 router = APIRouter(prefix="/carrito", tags=["Carrito"])
 
-@router.get("/", response_model=schemas.CarritoOut)
-def get_cart(user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
-    carrito = db.query(models.Carrito).filter(models.Carrito.usuario_id == user.id).first()
-    
-    # Crear carrito si no existe (lazy creation)
-    if not carrito:
-        carrito = models.Carrito(usuario_id=user.id)
-        db.add(carrito)
-        db.commit()
-        return {"items": [], "total": 0}
-    
+def _obtener_carrito(db: Session, usuario_id: int):
+    # Carrito, líneas y productos en una sola consulta (sin cargas perezosas por línea)
+    return db.query(models.Carrito).options(
+        joinedload(models.Carrito.items).joinedload(models.CarritoItem.producto)
+    ).filter(models.Carrito.usuario_id == usuario_id).populate_existing().first()
+
+def _sumar_lineas_estandar(db: Session, carrito_id: int, cantidades: dict):
+    # Inserta o suma cantidad en una sola sentencia atómica:
+    # INSERT ... ON CONFLICT DO UPDATE SET cantidad = cantidad + excluded.cantidad
+    # Dos clics simultáneos no pueden duplicar la línea ni perder un incremento.
+    stmt = database.insert_upsert(db, models.CarritoItem).values([
+        {"carrito_id": carrito_id, "producto_id": producto_id, "cantidad": cantidad}
+        for producto_id, cantidad in cantidades.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["carrito_id", "producto_id"],
+        index_where=text("personalizacion IS NULL AND precio_guardado IS NULL"),
+        set_={"cantidad": models.CarritoItem.cantidad + stmt.excluded.cantidad},
+    )
+    db.execute(stmt)
+
+def _resumen_carrito(carrito):
     formatted_items = []
     total_amount = 0
     
@@ -53,6 +66,19 @@ def get_cart(user: models.Usuario = Depends(get_user_from_token), db: Session =
         
     return {"items": formatted_items, "total": total_amount}
 
+@router.get("/", response_model=schemas.CarritoOut)
+def get_cart(user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
+    carrito = _obtener_carrito(db, user.id)
+    
+    # Crear carrito si no existe (lazy creation)
+    if not carrito:
+        carrito = models.Carrito(usuario_id=user.id)
+        db.add(carrito)
+        db.commit()
+        return {"items": [], "total": 0}
+    
+    return _resumen_carrito(carrito)
+
 @router.post("/items")
 def add_item_to_cart(item_in: schemas.CarritoItemCreate, user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
     carrito = db.query(models.Carrito).filter(models.Carrito.usuario_id == user.id).first()
@@ -65,7 +91,7 @@ def add_item_to_cart(item_in: schemas.CarritoItemCreate, user: models.Usuario =
 
     # Lógica de agrupación:
     # Si el producto tiene personalización o precio custom, se trata como ítem único (nueva fila).
-    # Si es un producto estándar, se busca si ya existe para sumar cantidad.
+    # Si es un producto estándar, se suma a la línea existente (upsert atómico).
     
     is_custom_item = item_in.personalizacion or item_in.precio_custom
 
@@ -79,25 +105,54 @@ def add_item_to_cart(item_in: schemas.CarritoItemCreate, user: models.Usuario =
         )
         db.add(new_item)
     else:
-        existing_item = db.query(models.CarritoItem).filter(
-            models.CarritoItem.carrito_id == carrito.id,
-            models.CarritoItem.producto_id == item_in.producto_id,
-            models.CarritoItem.personalizacion == None
-        ).first()
-
-        if existing_item:
-            existing_item.cantidad += item_in.cantidad
-        else:
-            new_item = models.CarritoItem(
-                carrito_id=carrito.id, 
-                producto_id=item_in.producto_id, 
-                cantidad=item_in.cantidad
-            )
-            db.add(new_item)
+        _sumar_lineas_estandar(db, carrito.id, {item_in.producto_id: item_in.cantidad})
     
     db.commit()
     return {"mensaje": "Producto agregado al carrito"}
 
+@router.post("/items/batch", response_model=schemas.CarritoOut)
+def add_items_batch(items_in: List[schemas.CarritoItemCreate], user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
+    # Agrega varios productos de una vez (combos, personalización) en una sola transacción
+    # y responde con el carrito actualizado, para no tener que pedir GET /carrito/ después.
+    if not items_in:
+        raise HTTPException(status_code=400, detail="No se enviaron productos")
+
+    # Validar todos los productos con una sola consulta IN
+    ids_pedidos = {item.producto_id for item in items_in}
+    ids_existentes = {
+        pid for (pid,) in db.query(models.Producto.id).filter(models.Producto.id.in_(ids_pedidos))
+    }
+    faltantes = ids_pedidos - ids_existentes
+    if faltantes:
+        raise HTTPException(status_code=404, detail=f"Productos no encontrados: {sorted(faltantes)}")
+
+    carrito = db.query(models.Carrito).filter(models.Carrito.usuario_id == user.id).first()
+    if not carrito:
+        carrito = models.Carrito(usuario_id=user.id)
+        db.add(carrito)
+        db.flush()
+
+    # Misma lógica de agrupación que /items: las líneas personalizadas van aparte y
+    # las estándar se agrupan en memoria y se suman con un único upsert multi-fila.
+    estandar = {}
+    for item_in in items_in:
+        if item_in.personalizacion or item_in.precio_custom:
+            db.add(models.CarritoItem(
+                carrito_id=carrito.id,
+                producto_id=item_in.producto_id,
+                cantidad=item_in.cantidad,
+                personalizacion=item_in.personalizacion,
+                precio_guardado=item_in.precio_custom
+            ))
+        else:
+            estandar[item_in.producto_id] = estandar.get(item_in.producto_id, 0) + item_in.cantidad
+
+    if estandar:
+        _sumar_lineas_estandar(db, carrito.id, estandar)
+
+    db.commit()
+    return _resumen_carrito(_obtener_carrito(db, user.id))
+
 @router.delete("/items/{item_id}")
 def remove_item(item_id: int, user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
     item = db.query(models.CarritoItem).join(models.Carrito).filter(
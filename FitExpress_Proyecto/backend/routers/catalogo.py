@@ -1,22 +1,110 @@
-from fastapi import APIRouter, Depends
+import json
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from .. import models, schemas, database
+from ..catalogo_cache import cache, acepta_gzip, CAMPOS_INDEXADOS
 
 router = APIRouter(prefix="/catalogo", tags=["Catálogo"])
 
+# Solo las columnas que se publican (más la descripción, que alimenta la búsqueda);
+# evita hidratar objetos Producto completos
+COLUMNAS_CATALOGO = (
+    models.Producto.id,
+    models.Producto.nombre,
+    models.Producto.descripcion,
+    models.Producto.precio_base,
+    models.Producto.imagen_url,
+    models.Producto.tipo,
+    models.Producto.disponible,
+    models.Producto.kcal,
+    models.Producto.proteina,
+    models.Producto.grasas,
+    models.Producto.carbs,
+)
+
+def _cargar_productos(db: Session):
+    # El caché arma el diccionario 'macros' que espera el Schema a partir de estas filas
+    return db.query(*COLUMNAS_CATALOGO).order_by(models.Producto.id).all()
+
+def _json(datos):
+    return json.dumps(datos, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 @router.get("/productos", response_model=List[schemas.ProductoOut])
-def get_catalog_products(db: Session = Depends(database.get_db)):
-    # Obtener todos los productos, ordenados por ID para consistencia visual
-    productos = db.query(models.Producto).order_by(models.Producto.id).all()
-    
-    # Mapear las columnas individuales de la BD al diccionario 'macros' que espera el Schema
-    for p in productos:
-        p.macros = {
-            "kcal": p.kcal, 
-            "p": p.proteina, 
-            "f": p.grasas, 
-            "c": p.carbs
-        }
-        
-    return productos
\ No newline at end of file
+def get_catalog_products(
+    tipo: Optional[str] = None,
+    disponible: Optional[bool] = None,
+    precio_min: Optional[float] = None,
+    precio_max: Optional[float] = None,
+    kcal_min: Optional[float] = None,
+    kcal_max: Optional[float] = None,
+    proteina_min: Optional[float] = None,
+    proteina_max: Optional[float] = None,
+    grasas_min: Optional[float] = None,
+    grasas_max: Optional[float] = None,
+    carbs_min: Optional[float] = None,
+    carbs_max: Optional[float] = None,
+    orden: str = "id",
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    db: Session = Depends(database.get_db)
+):
+    limites = {
+        "precio": (precio_min, precio_max),
+        "kcal": (kcal_min, kcal_max),
+        "proteina": (proteina_min, proteina_max),
+        "grasas": (grasas_min, grasas_max),
+        "carbs": (carbs_min, carbs_max),
+    }
+    rangos = {campo: r for campo, r in limites.items() if r != (None, None)}
+    hay_filtros = rangos or tipo is not None or disponible is not None or limit or cursor or orden != "id"
+    # Solo el catálogo completo se entrega comprimido
+    usar_gzip = not hay_filtros and acepta_gzip(accept_encoding)
+
+    # El navegador ya tiene la versión vigente: responder 304 sin tocar la BD
+    if cache.no_modificado(if_none_match, if_modified_since, gzip=usar_gzip):
+        headers = cache.headers(gzip=usar_gzip)
+        if not hay_filtros:
+            headers["Vary"] = "Accept-Encoding"
+        return Response(status_code=304, headers=headers)
+
+    if hay_filtros:
+        if orden.lstrip("-") not in CAMPOS_INDEXADOS:
+            raise HTTPException(status_code=400, detail=f"Orden no válido. Opciones: {', '.join(CAMPOS_INDEXADOS)}")
+
+        # Filtros resueltos sobre los índices ordenados en memoria
+        productos, siguiente, headers = cache.filtrar(
+            lambda: _cargar_productos(db), rangos,
+            tipo=tipo, disponible=disponible, orden=orden, limite=limit or 50, cursor=cursor
+        )
+        if siguiente:
+            headers = dict(headers, **{"X-Siguiente-Cursor": siguiente})
+        return Response(content=_json(productos), media_type="application/json", headers=headers)
+
+    # Se entregan los bytes ya codificados de la versión vigente (sin validar con Pydantic)
+    catalogo = cache.obtener(lambda: _cargar_productos(db))
+
+    if usar_gzip:
+        headers = dict(catalogo.headers_gzip, Vary="Accept-Encoding", **{"Content-Encoding": "gzip"})
+        return Response(content=catalogo.gzip, media_type="application/json", headers=headers)
+
+    headers = dict(catalogo.headers, Vary="Accept-Encoding")
+    return Response(content=catalogo.json, media_type="application/json", headers=headers)
+
+@router.get("/buscar", response_model=List[schemas.ProductoOut])
+def buscar_productos(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(database.get_db)
+):
+    # Búsqueda por prefijo sin tildes ("energia" encuentra "Bowl Energía Verde")
+    # resuelta sobre el índice invertido en memoria
+    if cache.no_modificado(if_none_match, None):
+        return Response(status_code=304, headers=cache.headers())
+
+    productos, headers = cache.buscar(lambda: _cargar_productos(db), q, limite=limit)
+    return Response(content=_json(productos), media_type="application/json", headers=headers)
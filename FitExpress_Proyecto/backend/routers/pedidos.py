@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from datetime import datetime, timedelta
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from typing import List
-from .. import models, schemas, database
+from typing import List, Optional
+from .. import models, schemas, database, estados_pedido, idempotencia, paginacion
+from ..cola_cocina import MINUTOS_PROMESA
 from ..dependencies import get_user_from_token
 
 router = APIRouter(prefix="/pedidos", tags=["Pedidos"])
 
+
 # Helper para formatear respuesta y evitar problemas de validación con Pydantic
 def _formatear_pedido_response(pedido, usuario):
     items_fmt = [
@@ -37,62 +41,105 @@ def _formatear_pedido_response(pedido, usuario):
         "total": pedido.total,
         "estado": pedido.estado,
         "fecha_creacion": pedido.fecha_creacion,
+        "pagado_en": pedido.pagado_en,
         "direccion_envio": pedido.direccion_envio,
         "usuario": usuario_dict,
         "items": items_fmt
     }
     
 @router.post("/crear")
-def crear_pedido(datos: schemas.PedidoCreate, user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
-    carrito = db.query(models.Carrito).filter(models.Carrito.usuario_id == user.id).first()
+def crear_pedido(datos: schemas.PedidoCreate, user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db),
+                 idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    # Un reintento con la misma Idempotency-Key recibe el pedido ya creado
+    return idempotencia.ejecutar(
+        idempotency_key, user.id, "crear_pedido", datos, db,
+        lambda: _procesar_checkout(datos, user, db)
+    )
+
+def _procesar_checkout(datos: schemas.PedidoCreate, user: models.Usuario, db: Session):
+    # Todo el checkout ocurre en una sola transacción: si algo falla no queda
+    # un pedido sin ítems ni un carrito vaciado a medias.
+
+    # Líneas del carrito con nombre y precio del producto en una sola consulta
+    lineas = db.query(
+        models.CarritoItem.carrito_id,
+        models.CarritoItem.producto_id,
+        models.CarritoItem.cantidad,
+        models.CarritoItem.personalizacion,
+        models.CarritoItem.precio_guardado,
+        models.Producto.nombre,
+        models.Producto.precio_base,
+    ).join(models.Carrito, models.Carrito.id == models.CarritoItem.carrito_id
+    ).join(models.Producto, models.Producto.id == models.CarritoItem.producto_id
+    ).filter(models.Carrito.usuario_id == user.id).order_by(models.CarritoItem.id).all()
     
-    if not carrito or not carrito.items:
+    if not lineas:
         raise HTTPException(status_code=400, detail="El carrito está vacío")
     
-    # Calcular totales
-    subtotal = 0
-    for item in carrito.items:
-        # Usar precio personalizado si existe, sino el base del producto
-        precio_real = item.precio_guardado if item.precio_guardado is not None else item.producto.precio_base
-        subtotal += precio_real * item.cantidad
+    # Snapshot de precios: usar precio personalizado si existe, sino el base del producto.
+    # Si tiene personalización, usamos ese texto como nombre o detalle.
+    items_pedido = [
+        {
+            "producto_id": l.producto_id,
+            "nombre_producto": l.personalizacion if l.personalizacion else l.nombre,
+            "precio_unitario": l.precio_guardado if l.precio_guardado is not None else l.precio_base,
+            "cantidad": l.cantidad,
+            "personalizacion": l.personalizacion
+        }
+        for l in lineas
+    ]
 
+    # Calcular totales
+    subtotal = sum(i["precio_unitario"] * i["cantidad"] for i in items_pedido)
     costo_envio = 2000 if datos.tipo_entrega == "delivery" else 0
     total_final = subtotal + costo_envio
     
-    # Crear pedido
+    # Crear pedido (flush para obtener el id sin cerrar la transacción)
+    ahora = datetime.now()
     nuevo_pedido = models.Pedido(
         usuario_id=user.id,
         total=total_final,
         direccion_envio=datos.direccion_envio,
         metodo_pago=datos.metodo_pago,
-        estado="Recibido"
+        estado=estados_pedido.ESTADO_INICIAL,
+        fecha_creacion=ahora,
+        promesa_entrega=ahora + timedelta(minutes=MINUTOS_PROMESA.get(datos.tipo_entrega, MINUTOS_PROMESA["retiro"]))
     )
     db.add(nuevo_pedido)
-    db.commit()
-    db.refresh(nuevo_pedido)
+    db.flush()
     
-    # Mover items del carrito al pedido (Snapshot de precios)
-    for item in carrito.items:
-        precio_real = item.precio_guardado if item.precio_guardado is not None else item.producto.precio_base
-        
-        # Si tiene personalización, usamos ese texto como nombre o detalle
-        nombre_final = item.personalizacion if item.personalizacion else item.producto.nombre
-
-        db.add(models.ItemPedido(
-            pedido_id=nuevo_pedido.id,
-            producto_id=item.producto_id,
-            nombre_producto=nombre_final, 
-            precio_unitario=precio_real,
-            cantidad=item.cantidad,
-            personalizacion=item.personalizacion
-        ))
+    # Ítems del pedido en un solo INSERT masivo. render_nulls evita que el ORM
+    # separe en otro INSERT las líneas sin personalización (valores None)
+    for item in items_pedido:
+        item["pedido_id"] = nuevo_pedido.id
+    db.execute(insert(models.ItemPedido).execution_options(render_nulls=True), items_pedido)
     
     # Vaciar carrito
-    db.query(models.CarritoItem).filter(models.CarritoItem.carrito_id == carrito.id).delete()
-    db.commit()
-    
+    carrito_ids = {l.carrito_id for l in lineas}
+    db.query(models.CarritoItem).filter(
+        models.CarritoItem.carrito_id.in_(carrito_ids)
+    ).delete(synchronize_session=False)
+    estados_pedido.al_crear(db, nuevo_pedido)
+    # El commit lo hace idempotencia.ejecutar, junto con la respuesta guardada
     return {"mensaje": "Pedido creado exitosamente", "pedido_id": nuevo_pedido.id}
 
+# Debe declararse antes de /{pedido_id} para que "mis_pedidos" no se tome como id
+@router.get("/mis_pedidos", response_model=List[schemas.PedidoOut])
+def listar_historial(
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user: models.Usuario = Depends(get_user_from_token),
+    db: Session = Depends(database.get_db)
+):
+    # Página de pedidos más recientes primero; la siguiente se pide con el cursor
+    # que viene en el header X-Siguiente-Cursor
+    pedidos, siguiente = paginacion.historial_pedidos(db, user.id, limit, cursor)
+    if siguiente:
+        response.headers["X-Siguiente-Cursor"] = siguiente
+    
+    return [_formatear_pedido_response(p, user) for p in pedidos]
+
 @router.get("/{pedido_id}", response_model=schemas.PedidoOut)
 def ver_pedido(pedido_id: int, user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
     pedido = db.query(models.Pedido).filter(
@@ -105,14 +152,6 @@ def ver_pedido(pedido_id: int, user: models.Usuario = Depends(get_user_from_toke
     
     return _formatear_pedido_response(pedido, user)
 
-@router.get("/mis_pedidos", response_model=List[schemas.PedidoOut])
-def listar_historial(user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
-    pedidos = db.query(models.Pedido).filter(
-        models.Pedido.usuario_id == user.id
-    ).order_by(models.Pedido.fecha_creacion.desc()).all()
-    
-    return [_formatear_pedido_response(p, user) for p in pedidos]
-
 @router.put("/{pedido_id}/cancelar")
 def cancelar_pedido(pedido_id: int, user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
     pedido = db.query(models.Pedido).filter(
@@ -123,16 +162,20 @@ def cancelar_pedido(pedido_id: int, user: models.Usuario = Depends(get_user_from
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
     
-    estados_cancelables = ["Recibido", "Aprobado", "Pendiente", "Pagado"]
-    if pedido.estado not in estados_cancelables:
-        raise HTTPException(status_code=400, detail="No es posible cancelar el pedido en su estado actual")
-        
-    pedido.estado = "Cancelado"
+    # Solo se cancela antes de que la cocina lo tome (ver estados_pedido.TRANSICIONES)
+    estados_pedido.transicionar(db, pedido, estados_pedido.CANCELADO)
     db.commit()
     return {"mensaje": "Pedido cancelado correctamente"}
 
 @router.put("/{pedido_id}/pagar")
-def pagar_pedido(pedido_id: int, user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
+def pagar_pedido(pedido_id: int, user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db),
+                 idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    return idempotencia.ejecutar(
+        idempotency_key, user.id, "pagar_pedido", {"pedido_id": pedido_id}, db,
+        lambda: _registrar_pago(pedido_id, user, db)
+    )
+
+def _registrar_pago(pedido_id: int, user: models.Usuario, db: Session):
     pedido = db.query(models.Pedido).filter(
         models.Pedido.id == pedido_id, 
         models.Pedido.usuario_id == user.id
@@ -141,6 +184,5 @@ def pagar_pedido(pedido_id: int, user: models.Usuario = Depends(get_user_from_to
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido no encontrado")
     
-    pedido.estado = "Pagado"
-    db.commit()
+    estados_pedido.registrar_pago(db, pedido)
     return {"mensaje": "Pago registrado exitosamente"}
\ No newline at end of file
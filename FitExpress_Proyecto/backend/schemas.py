@@ -37,6 +37,20 @@ class UsuarioOut(BaseModel):
     class Config:
         from_attributes = True
 
+class UsuarioAdminOut(UsuarioOut):
+    cantidad_pedidos: int = 0
+    valor_total: int = 0
+
+class ResumenClienteOut(BaseModel):
+    usuario_id: int
+    pedidos: int = 0
+    cancelados: int = 0
+    gasto_total: int = 0
+    ultimo_pedido: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -122,6 +136,7 @@ class PedidoOut(BaseModel):
     total: int
     estado: str
     fecha_creacion: datetime
+    pagado_en: Optional[datetime] = None
     direccion_envio: Optional[str] = "Retiro"
     items: List[ItemPedidoOut]
     usuario: UsuarioOut
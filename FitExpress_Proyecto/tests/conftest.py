@@ -0,0 +1,44 @@
+import os
+import tempfile
+
+# Las pruebas corren sobre un SQLite temporal; se configura antes de importar el backend
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/pruebas.db")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+from backend import database
+from backend.dependencies import ALGORITHM, SECRET_KEY
+from backend.init_db import init_db
+from backend.main import app
+
+ADMIN_EMAIL = "jesuszavaleta55@gmail.com"
+CLIENTE_EMAIL = "cliente@prueba.com"
+
+def encabezados(email):
+    # Mismo token que entrega /auth/token, sin pasar por el limitador de login
+    return {"Authorization": f"Bearer {jwt.encode({'sub': email}, SECRET_KEY, algorithm=ALGORITHM)}"}
+
+@pytest.fixture
+def client():
+    # Base recién sembrada en cada prueba (productos, admin y cliente)
+    init_db()
+    with TestClient(app) as c:
+        yield c
+
+@pytest.fixture
+def db(client):
+    sesion = database.SessionLocal()
+    try:
+        yield sesion
+    finally:
+        sesion.close()
+
+@pytest.fixture
+def admin():
+    return encabezados(ADMIN_EMAIL)
+
+@pytest.fixture
+def cliente():
+    return encabezados(CLIENTE_EMAIL)
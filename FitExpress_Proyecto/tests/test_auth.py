@@ -0,0 +1,55 @@
+import time
+from datetime import datetime, timedelta, timezone
+from fastapi.testclient import TestClient
+from jose import jwt
+from backend import eventos, hashing
+from backend.dependencies import ALGORITHM, SECRET_KEY, principales
+from backend.routers import admin as admin_routers
+from backend.init_db import init_db
+from backend.main import app
+from .conftest import ADMIN_EMAIL
+
+def test_cambio_de_rol_rige_de_inmediato(client, admin, cliente):
+    assert client.get("/admin/usuarios", headers=cliente).status_code == 403
+    assert client.put("/admin/usuarios/2/rol", json={"nuevo_rol": "admin"}, headers=admin).status_code == 200
+    assert client.get("/admin/usuarios", headers=cliente).status_code == 200
+
+    assert client.put("/admin/usuarios/2/rol", json={"nuevo_rol": "cliente"}, headers=admin).status_code == 200
+    assert client.get("/admin/usuarios", headers=cliente).status_code == 403
+
+def test_aviso_de_otro_worker_descarta_al_usuario(client, cliente):
+    client.get("/auth/me", headers=cliente)
+    token = cliente["Authorization"].split()[1]
+    assert principales.obtener(token) is not None
+
+    eventos.despachador.encolar(eventos.CANAL_PRINCIPALES, {"usuario_id": 2})
+    limite = time.monotonic() + 2
+    while principales.obtener(token) is not None and time.monotonic() < limite:
+        time.sleep(0.01)
+    assert principales.obtener(token) is None
+
+def test_pool_de_hashing_usa_spawn_y_se_cierra_al_apagar():
+    init_db()
+    with TestClient(app):
+        assert hashing.verificar_password("clave", hashing.hash_password("clave"))
+        assert hashing.pool._pool._mp_context.get_start_method() == "spawn"
+    assert hashing.pool._pool is None
+
+def test_stream_de_cocina_usa_ticket_corto_y_no_el_token_de_sesion(client, admin, cliente):
+    assert client.post("/admin/pedidos/stream/ticket", headers=cliente).status_code == 403
+    respuesta = client.post("/admin/pedidos/stream/ticket", headers=admin)
+    assert respuesta.status_code == 200
+    ticket = respuesta.json()["ticket"]
+
+    # El ticket abre el stream, pero no sirve como token de sesión
+    admin_routers._autenticar_cocina(ticket)
+    assert client.get("/admin/usuarios", headers={"Authorization": f"Bearer {ticket}"}).status_code == 401
+
+    # Ni el token de sesión ni un ticket vencido abren el stream
+    vencido = jwt.encode(
+        {"sub": ADMIN_EMAIL, "aud": admin_routers.AUDIENCIA_STREAM, "exp": datetime.now(timezone.utc) - timedelta(seconds=1)},
+        SECRET_KEY, algorithm=ALGORITHM,
+    )
+    sesion = admin["Authorization"].split()[1]
+    for invalido in (sesion, vencido):
+        assert client.get("/admin/pedidos/stream", params={"ticket": invalido}).status_code == 401
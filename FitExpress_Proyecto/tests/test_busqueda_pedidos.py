@@ -0,0 +1,98 @@
+import itertools
+import random
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event, insert, text
+from backend import database, models
+
+# Búsqueda de pedidos del admin: resultados y planes de ejecución (EXPLAIN)
+# para todas las combinaciones de filtros que ofrece el panel.
+
+FILTROS = {
+    "fecha_desde": "2026-02-01",
+    "fecha_hasta": "2026-02-10",
+    "estado": "Pagado",
+    "metodo_pago": "webpay",
+    "email": "c1",
+    "repartidor": "Ana",
+    "cursor": "2026-06-01T00:00:00:1",
+}
+COMBINACIONES = [
+    {k: FILTROS[k] for k, usar in zip(FILTROS, mascara) if usar}
+    for mascara in itertools.product([False, True], repeat=len(FILTROS))
+]
+
+@pytest.fixture
+def pedidos(db):
+    db.add_all(models.Usuario(nombre=f"C{i}", email=f"c{i}@x.cl", rut=f"{i}-1") for i in range(200))
+    db.commit()
+    azar = random.Random(1)
+    inicio = datetime(2026, 1, 1)
+    filas = [
+        {
+            "usuario_id": azar.randint(1, 202),
+            "total": 1000,
+            "version": 1,
+            "estado": azar.choice(["Recibido", "Pagado", "En preparacion", "Entregado", "Cancelado"]),
+            "metodo_pago": azar.choice(["webpay", "efectivo", "transferencia"]),
+            "repartidor": azar.choice([None, "Ana", "Pedro", "Luis"]),
+            "fecha_creacion": inicio + timedelta(minutes=azar.randint(0, 60 * 24 * 365)),
+        }
+        for _ in range(5000)
+    ]
+    db.execute(insert(models.Pedido), filas)
+    db.commit()
+    db.execute(text("ANALYZE"))
+    db.commit()
+    return db.query(models.Pedido).all()
+
+def _sql_busqueda(client, admin, filtros):
+    # Captura la consulta principal (la que lleva LIMIT) de GET /admin/pedidos
+    capturadas = []
+    def capturar(conn, cursor, statement, parameters, context, executemany):
+        if "FROM pedidos" in statement and "LIMIT" in statement:
+            capturadas.append((statement, parameters))
+    event.listen(database.engine, "before_cursor_execute", capturar)
+    try:
+        assert client.get("/admin/pedidos", params=filtros, headers=admin).status_code == 200
+    finally:
+        event.remove(database.engine, "before_cursor_execute", capturar)
+    return capturadas[0]
+
+def test_planes_usan_indices_en_todas_las_combinaciones(client, admin, pedidos):
+    for filtros in COMBINACIONES:
+        sql, parametros = _sql_busqueda(client, admin, filtros)
+        with database.engine.connect() as conn:
+            plan = [fila[3] for fila in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, parametros)]
+
+        pedidos_plan = [paso for paso in plan if paso.startswith(("SCAN pedidos", "SEARCH pedidos"))]
+        assert pedidos_plan and all("INDEX" in paso for paso in pedidos_plan), (filtros, plan)
+        if "email" not in filtros:
+            # Sin email se recorre un índice en el orden del cursor: no hay ordenamiento aparte
+            assert not any("TEMP B-TREE" in paso for paso in plan), (filtros, plan)
+
+def test_resultados_y_paginas_coinciden_con_filtro_directo(client, admin, db, pedidos):
+    emails = {u.id: u.email for u in db.query(models.Usuario)}
+    ordenados = sorted(pedidos, key=lambda p: (p.fecha_creacion, p.id), reverse=True)
+
+    for filtros in COMBINACIONES:
+        if "cursor" in filtros:
+            continue
+        esperados = [
+            p.id for p in ordenados
+            if ("fecha_desde" not in filtros or p.fecha_creacion >= datetime(2026, 2, 1))
+            and ("fecha_hasta" not in filtros or p.fecha_creacion < datetime(2026, 2, 11))
+            and ("estado" not in filtros or p.estado == "Pagado")
+            and ("metodo_pago" not in filtros or p.metodo_pago == "webpay")
+            and ("email" not in filtros or emails[p.usuario_id].startswith("c1"))
+            and ("repartidor" not in filtros or p.repartidor == "Ana")
+        ]
+        obtenidos, cursor = [], None
+        while True:
+            params = dict(filtros, limit=200, **({"cursor": cursor} if cursor else {}))
+            respuesta = client.get("/admin/pedidos", params=params, headers=admin)
+            obtenidos += [p["id"] for p in respuesta.json()]
+            cursor = respuesta.headers.get("X-Siguiente-Cursor")
+            if not cursor:
+                break
+        assert obtenidos == esperados, filtros
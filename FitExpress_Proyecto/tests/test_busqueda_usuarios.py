@@ -0,0 +1,15 @@
+from sqlalchemy import text
+from backend import busqueda_usuarios
+
+def _buscar(client, admin, q):
+    return [u["email"] for u in client.get("/admin/usuarios", params={"q": q}, headers=admin).json()]
+
+def test_usuarios_antiguos_se_completan_y_aparecen_en_la_busqueda(client, admin, db):
+    # Como quedaron los usuarios creados antes de agregar las columnas normalizadas
+    db.execute(text("UPDATE usuarios SET nombre_busqueda = NULL, rut_normalizado = NULL"))
+    db.commit()
+    assert _buscar(client, admin, "juan") == []
+
+    assert busqueda_usuarios.completar(db) == 2
+    assert busqueda_usuarios.completar(db) == 0
+    assert _buscar(client, admin, "juan") == ["cliente@prueba.com"]
@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+from backend import models
+
+def _consultas_carrito(client, cliente):
+    respuesta = client.get("/carrito/", headers=cliente)
+    assert respuesta.status_code == 200
+    return int(respuesta.headers["X-Query-Count"]), respuesta.json()
+
+def test_lectura_del_carrito_con_consultas_constantes(client, cliente):
+    client.post("/carrito/items", json={"producto_id": 1, "cantidad": 1}, headers=cliente)
+    _consultas_carrito(client, cliente)  # calienta la caché de usuarios
+    con_una_linea, carrito = _consultas_carrito(client, cliente)
+    assert len(carrito["items"]) == 1
+
+    # Líneas estándar de todos los productos más líneas personalizadas hasta 50
+    lineas = [{"producto_id": pid, "cantidad": 1} for pid in range(2, 15)]
+    lineas += [{"producto_id": 99, "cantidad": 1, "personalizacion": f"Extra {i}"} for i in range(36)]
+    assert client.post("/carrito/items/batch", json=lineas, headers=cliente).status_code == 200
+
+    con_cincuenta, carrito = _consultas_carrito(client, cliente)
+    assert len(carrito["items"]) == 50
+    assert con_cincuenta == con_una_linea
+
+def test_agregados_concurrentes_no_duplican_lineas(client, cliente, db):
+    # Cientos de agregados en paralelo, sueltos y por lote, sobre los mismos productos
+    def agregar(i):
+        if i % 2:
+            return client.post("/carrito/items", json={"producto_id": 1, "cantidad": 1}, headers=cliente)
+        return client.post(
+            "/carrito/items/batch",
+            json=[{"producto_id": 1, "cantidad": 1}, {"producto_id": 2, "cantidad": 2}],
+            headers=cliente,
+        )
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        respuestas = list(pool.map(agregar, range(300)))
+    assert all(r.status_code == 200 for r in respuestas)
+
+    lineas = db.query(models.CarritoItem).join(models.Carrito).filter(models.Carrito.usuario_id == 2).all()
+    cantidades = {linea.producto_id: linea.cantidad for linea in lineas}
+    assert len(lineas) == 2
+    assert cantidades == {1: 300, 2: 300}
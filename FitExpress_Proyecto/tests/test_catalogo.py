@@ -0,0 +1,168 @@
+import random
+import time
+from collections import namedtuple
+import pytest
+from fastapi import HTTPException
+from backend import eventos
+from backend.catalogo_cache import CatalogoCache, _clave, acepta_gzip, cache, tokenizar
+
+Fila = namedtuple("Fila", "id nombre descripcion precio_base imagen_url tipo disponible kcal proteina grasas carbs")
+
+def _filas(cantidad=2000):
+    azar = random.Random(3)
+    talvez = lambda v: None if azar.random() < 0.2 else v
+    return [
+        Fila(
+            i, f"Producto {i}", "", azar.randint(1, 50) * 1000, "", azar.choice(["bowl", "snack", "combo"]),
+            azar.random() < 0.9, talvez(azar.randint(100, 900)), talvez(azar.randint(1, 60)),
+            talvez(azar.randint(1, 40)), talvez(azar.randint(1, 90)),
+        )
+        for i in range(1, cantidad + 1)
+    ]
+
+def _todas_las_paginas(cache, filas, rangos, orden, limite, **filtros):
+    obtenidos, cursor = [], None
+    while True:
+        pagina, cursor, _ = cache.filtrar(lambda: filas, rangos, orden=orden, limite=limite, cursor=cursor, **filtros)
+        obtenidos += [p["id"] for p in pagina]
+        if not cursor:
+            return obtenidos
+
+@pytest.mark.parametrize("orden", ["kcal", "-kcal", "precio", "-proteina", "-id"])
+@pytest.mark.parametrize("rangos,filtros", [
+    ({}, {}),
+    ({}, {"tipo": "snack"}),
+    ({"proteina": (10, 20)}, {}),
+    ({"kcal": (200, None)}, {"disponible": True}),
+    ({"proteina": (50, None), "carbs": (None, 30)}, {"tipo": "combo"}),
+])
+def test_filtros_y_cursor_coinciden_con_fuerza_bruta(orden, rangos, filtros):
+    filas = _filas()
+    cache = CatalogoCache()
+    productos = cache.filtrar(lambda: filas, {}, limite=len(filas))[0]
+
+    campo = orden.lstrip("-")
+    def cumple(p):
+        if any(p[k] != v for k, v in filtros.items()):
+            return False
+        for c, (minimo, maximo) in rangos.items():
+            nulo, valor, _ = _clave(p, c)
+            if nulo or (minimo is not None and valor < minimo) or (maximo is not None and valor > maximo):
+                return False
+        return True
+    def clave(p):
+        nulo, valor, pid = _clave(p, campo)
+        return (nulo, -valor, -pid) if orden.startswith("-") else (nulo, valor, pid)
+    esperados = [p["id"] for p in sorted(filter(cumple, productos), key=clave)]
+
+    assert _todas_las_paginas(cache, filas, rangos, orden, 7, **filtros) == esperados
+
+def test_orden_descendente_deja_los_nulos_al_final(client):
+    productos = client.get("/catalogo/productos", params={"orden": "-kcal", "limit": 50}).json()
+    kcal = [p["macros"]["kcal"] for p in productos]
+    con_dato = [k for k in kcal if k is not None]
+    assert kcal[:len(con_dato)] == sorted(con_dato, reverse=True)
+    assert all(k is None for k in kcal[len(con_dato):])
+
+    primeros = client.get("/catalogo/productos", params={"orden": "-kcal", "limit": 5}).json()
+    assert all(p["macros"]["kcal"] is not None for p in primeros)
+
+def test_cursor_invalido_responde_400(client):
+    for cursor in ["basura", "2:1:1", "0:x:1"]:
+        respuesta = client.get("/catalogo/productos", params={"limit": 5, "cursor": cursor})
+        assert respuesta.status_code == 400
+    with pytest.raises(HTTPException):
+        CatalogoCache().filtrar(lambda: [], {}, cursor="a:b")
+
+def test_acepta_gzip_respeta_los_q_values():
+    assert acepta_gzip("gzip, deflate, br")
+    assert acepta_gzip("br;q=1.0, GZIP;q=0.5")
+    assert acepta_gzip("*")
+    assert not acepta_gzip(None)
+    assert not acepta_gzip("gzip;q=0")
+    assert not acepta_gzip("identity, gzip;q=0.000")
+    assert not acepta_gzip("*;q=0")
+    assert not acepta_gzip("gzip;q=0, *")
+
+def test_etag_distinto_por_codificacion(client):
+    con_gzip = client.get("/catalogo/productos", headers={"Accept-Encoding": "gzip"})
+    sin_gzip = client.get("/catalogo/productos", headers={"Accept-Encoding": "gzip;q=0"})
+    assert con_gzip.headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in sin_gzip.headers
+    assert con_gzip.headers["ETag"] != sin_gzip.headers["ETag"]
+    assert con_gzip.json() == sin_gzip.json()
+
+    # Cada representación revalida con su propio ETag
+    for respuesta, codificacion in [(con_gzip, "gzip"), (sin_gzip, "identity")]:
+        etag = respuesta.headers["ETag"]
+        revalidada = client.get("/catalogo/productos", headers={"Accept-Encoding": codificacion, "If-None-Match": etag})
+        assert revalidada.status_code == 304
+        assert revalidada.headers["ETag"] == etag
+
+    # El ETag de una codificación no sirve para la otra
+    cruzada = client.get("/catalogo/productos", headers={"Accept-Encoding": "identity", "If-None-Match": con_gzip.headers["ETag"]})
+    assert cruzada.status_code == 200
+
+def test_busqueda_sin_tildes_y_por_prefijo(client):
+    nombres = [p["nombre"] for p in client.get("/catalogo/buscar", params={"q": "energia"}).json()]
+    assert nombres[:2] == ["Bowl Energía Verde", "Combo Energía Total"]
+    assert [p["nombre"] for p in client.get("/catalogo/buscar", params={"q": "mediterr"}).json()] == ["Bowl Mediterráneo"]
+
+def test_busqueda_respeta_el_limite_y_el_orden():
+    filas = [Fila(i, f"Bowl {i}", "", 1000, "", "bowl", True, None, None, None, None) for i in range(1, 501)]
+    filas += [Fila(i, f"Barra {i}", "ideal con bowl", 1000, "", "snack", True, None, None, None, None) for i in range(501, 601)]
+    cache = CatalogoCache()
+    productos, _ = cache.buscar(lambda: filas, "bowl", limite=5)
+    # Primero los que lo tienen en el nombre, por id
+    assert [p["id"] for p in productos] == [1, 2, 3, 4, 5]
+    productos, _ = cache.buscar(lambda: filas, "ideal", limite=3)
+    assert [p["id"] for p in productos] == [501, 502, 503]
+
+def _esperar(condicion, segundos=2):
+    limite = time.monotonic() + segundos
+    while not condicion():
+        if time.monotonic() > limite:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_aviso_de_otro_worker_descarta_el_catalogo(client, admin):
+    client.get("/catalogo/productos")
+    version = cache.version
+
+    # El aviso propio no recarga: este worker ya aplicó el cambio
+    respuesta = client.put("/admin/productos/1", json={"precio_base": 1234}, headers=admin)
+    assert respuesta.status_code == 200
+    assert cache.version == version + 1
+    time.sleep(0.1)
+    assert cache.version == version + 1
+    assert client.get("/catalogo/productos").json()[0]["precio_base"] == 1234
+
+    # Un cambio hecho por otro worker llega por el canal del catálogo
+    eventos.despachador.encolar(eventos.CANAL_CATALOGO, {"id": 1, "origen": "otro-worker"})
+    assert _esperar(lambda: cache.version == version + 2)
+
+@pytest.mark.parametrize("consulta", ["bowl", "bo pro", "energia verde", "a", "ideal bar", "nada"])
+def test_busqueda_coincide_con_fuerza_bruta(consulta):
+    azar = random.Random(5)
+    palabras = ["Bowl", "Barra", "Proteína", "Energía", "Verde", "Ideal", "Avena", "Bocado"]
+    filas = [
+        Fila(i, " ".join(azar.sample(palabras, 2)), " ".join(azar.sample(palabras, 3)), 1000, "", "bowl", True, None, None, None, None)
+        for i in azar.sample(range(1, 5000), 800)
+    ]
+    cache = CatalogoCache()
+    # Cambios incrementales sobre el índice ya cargado
+    cache.buscar(lambda: filas, "x")
+    cache.eliminar_producto(filas[0].id)
+    cache.actualizar_producto(filas[1]._replace(nombre="Bowl Avena", descripcion="Ideal"))
+    filas = [filas[1]._replace(nombre="Bowl Avena", descripcion="Ideal")] + filas[2:]
+
+    terminos = tokenizar(consulta)
+    def tiene(texto):
+        propios = tokenizar(texto)
+        return all(any(t.startswith(q) for t in propios) for q in terminos)
+    en_nombre = sorted(f.id for f in filas if tiene(f.nombre))
+    resto = sorted(f.id for f in filas if f.id not in en_nombre and tiene(f"{f.nombre} {f.descripcion}"))
+
+    productos, _ = cache.buscar(lambda: filas, consulta, limite=40)
+    assert [p["id"] for p in productos] == (en_nombre + resto)[:40]
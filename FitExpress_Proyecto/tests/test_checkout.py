@@ -0,0 +1,41 @@
+import pytest
+from backend import models
+
+DATOS = {"direccion_envio": "Av. Siempre Viva 123", "metodo_pago": "webpay", "tipo_entrega": "delivery"}
+
+def _llenar_carrito(client, cliente, cantidad):
+    # Productos estándar y, sobre eso, líneas personalizadas del bowl 99
+    lineas = [{"producto_id": pid, "cantidad": 1} for pid in range(1, min(cantidad, 14) + 1)]
+    lineas += [{"producto_id": 99, "cantidad": 1, "personalizacion": f"Extra {i}"} for i in range(cantidad - len(lineas))]
+    assert client.post("/carrito/items/batch", json=lineas, headers=cliente).status_code == 200
+
+def _checkout(client, cliente):
+    respuesta = client.post("/pedidos/crear", json=DATOS, headers=cliente)
+    assert respuesta.status_code == 200
+    return int(respuesta.headers["X-Query-Count"]), respuesta.json()["pedido_id"]
+
+def test_checkout_con_consultas_constantes(client, cliente, db):
+    client.get("/carrito/", headers=cliente)  # calienta la caché de usuarios
+    consultas = {}
+    for cantidad in (1, 10, 100):
+        _llenar_carrito(client, cliente, cantidad)
+        consultas[cantidad], pedido_id = _checkout(client, cliente)
+
+        db.expire_all()
+        assert db.query(models.ItemPedido).filter(models.ItemPedido.pedido_id == pedido_id).count() == cantidad
+        assert db.query(models.CarritoItem).count() == 0
+    assert consultas[1] == consultas[10] == consultas[100]
+
+def test_checkout_fallido_no_deja_pedido_sin_items(client, cliente, db, monkeypatch):
+    _llenar_carrito(client, cliente, 5)
+
+    def fallar(*args):
+        raise RuntimeError("caída a mitad del checkout")
+    monkeypatch.setattr("backend.estados_pedido.al_crear", fallar)
+    with pytest.raises(RuntimeError):
+        client.post("/pedidos/crear", json=DATOS, headers=cliente)
+
+    db.expire_all()
+    assert db.query(models.Pedido).count() == 0
+    assert db.query(models.ItemPedido).count() == 0
+    assert db.query(models.CarritoItem).count() == 5
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, inspect, select, text
+from backend import esquema, models
+
+# Tablas como estaban antes de agregar columnas e índices (el resto las crea create_all)
+ESQUEMA_ANTIGUO = [
+    """CREATE TABLE usuarios (
+        id INTEGER PRIMARY KEY, nombre VARCHAR, email VARCHAR, hashed_password VARCHAR, rut VARCHAR,
+        telefono VARCHAR, direccion VARCHAR, comuna VARCHAR, region VARCHAR, rol VARCHAR)""",
+    """CREATE TABLE pedidos (
+        id INTEGER PRIMARY KEY, usuario_id INTEGER REFERENCES usuarios(id), fecha_creacion DATETIME,
+        total INTEGER, estado VARCHAR, direccion_envio VARCHAR, metodo_pago VARCHAR, repartidor VARCHAR)""",
+    """CREATE TABLE carrito_items (
+        id INTEGER PRIMARY KEY, carrito_id INTEGER, producto_id INTEGER, cantidad INTEGER,
+        personalizacion TEXT, precio_guardado INTEGER)""",
+]
+CREADO = datetime(2025, 3, 1, 12, 0)
+
+@pytest.fixture
+def antigua(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/antigua.db")
+    with engine.begin() as conexion:
+        for ddl in ESQUEMA_ANTIGUO:
+            conexion.execute(text(ddl))
+        conexion.execute(text("INSERT INTO usuarios (id, nombre, email, rol) VALUES (1, 'Juan', 'juan@prueba.com', 'cliente')"))
+        conexion.execute(
+            text("INSERT INTO pedidos (id, usuario_id, fecha_creacion, total, estado, direccion_envio, metodo_pago) "
+                 "VALUES (:id, 1, :fecha, 1000, :estado, :direccion, 'webpay')"),
+            [
+                {"id": 1, "fecha": CREADO, "estado": "Recibido", "direccion": "Av. Siempre Viva 123"},
+                {"id": 2, "fecha": CREADO, "estado": "En preparacion", "direccion": "Retiro en Tienda"},
+                {"id": 3, "fecha": CREADO, "estado": "Entregado", "direccion": "Av. Siempre Viva 123"},
+            ],
+        )
+    yield engine
+    engine.dispose()
+
+def _columnas(engine, tabla):
+    return {c["name"] for c in inspect(engine).get_columns(tabla)}
+
+def _indices(engine, tabla):
+    return {i["name"] for i in inspect(engine).get_indexes(tabla)}
+
+def test_actualiza_una_base_existente_sin_perder_datos(antigua):
+    esquema.actualizar(antigua)
+    esquema.actualizar(antigua)  # idempotente
+
+    assert {"version", "promesa_entrega", "pagado_en"} <= _columnas(antigua, "pedidos")
+    assert {"nombre_busqueda", "rut_normalizado"} <= _columnas(antigua, "usuarios")
+    assert {"ix_pedidos_activos", "ix_pedidos_fecha", "ix_pedidos_usuario_fecha"} <= _indices(antigua, "pedidos")
+
+    pedidos = models.Pedido.__table__
+    with antigua.connect() as conexion:
+        promesas = dict(conexion.execute(select(pedidos.c.id, pedidos.c.promesa_entrega)).all())
+    # Solo los activos reciben promesa, según el tipo de entrega
+    assert promesas == {1: CREADO + timedelta(minutes=45), 2: CREADO + timedelta(minutes=20), 3: None}
+
+def test_pedidos_existentes_parten_en_version_1(antigua):
+    esquema.actualizar(antigua)
+    pedidos = models.Pedido.__table__
+    with antigua.begin() as conexion:
+        assert set(conexion.execute(select(pedidos.c.version)).scalars()) == {1}
+        # Un INSERT que no la menciona también recibe el DEFAULT
+        conexion.execute(text("INSERT INTO pedidos (id, estado) VALUES (4, 'Recibido')"))
+        assert conexion.execute(select(pedidos.c.version).where(pedidos.c.id == 4)).scalar() == 1
+
+def test_lineas_estandar_repetidas_se_fusionan_antes_del_indice_unico(antigua):
+    with antigua.begin() as conexion:
+        conexion.execute(
+            text("INSERT INTO carrito_items (carrito_id, producto_id, cantidad, personalizacion, precio_guardado) "
+                 "VALUES (1, 1, :cantidad, :personalizacion, NULL)"),
+            [
+                {"cantidad": 2, "personalizacion": None},
+                {"cantidad": 3, "personalizacion": None},
+                {"cantidad": 1, "personalizacion": "Sin cebolla"},
+            ],
+        )
+    esquema.actualizar(antigua)
+
+    assert "uq_carrito_items_estandar" in _indices(antigua, "carrito_items")
+    items = models.CarritoItem.__table__
+    with antigua.connect() as conexion:
+        lineas = conexion.execute(
+            select(items.c.id, items.c.cantidad, items.c.personalizacion).order_by(items.c.id)
+        ).all()
+    assert [tuple(l) for l in lineas] == [(1, 5, None), (3, 1, "Sin cebolla")]
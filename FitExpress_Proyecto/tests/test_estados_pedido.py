@@ -0,0 +1,83 @@
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from backend import estados_pedido, models, resumen_clientes, rollups
+
+def _crear_pedido(client, cliente):
+    client.post("/carrito/items", json={"producto_id": 1, "cantidad": 2}, headers=cliente)
+    respuesta = client.post(
+        "/pedidos/crear",
+        json={"direccion_envio": "Av. Siempre Viva 123", "metodo_pago": "webpay", "tipo_entrega": "delivery"},
+        headers=cliente,
+    )
+    assert respuesta.status_code == 200
+    return respuesta.json()["pedido_id"]
+
+def test_pago_aceptado_con_el_pedido_en_cocina(client, cliente, admin):
+    pedido_id = _crear_pedido(client, cliente)
+    assert client.put(f"/admin/pedidos/{pedido_id}/estado", params={"estado": "En preparacion"}, headers=admin).status_code == 200
+
+    respuesta = client.put(f"/pedidos/{pedido_id}/pagar", headers=cliente)
+    assert respuesta.status_code == 200
+    pedido = client.get(f"/pedidos/{pedido_id}", headers=cliente).json()
+    assert pedido["estado"] == "En preparacion"
+    assert pedido["pagado_en"] is not None
+
+    # Un segundo pago se rechaza con el estado actual
+    respuesta = client.put(f"/pedidos/{pedido_id}/pagar", headers=cliente)
+    assert respuesta.status_code == 409
+    assert respuesta.json()["detail"]["mensaje"] == "El pedido ya está pagado"
+
+def test_pago_de_pedido_cancelado_responde_409(client, cliente):
+    pedido_id = _crear_pedido(client, cliente)
+    assert client.put(f"/pedidos/{pedido_id}/cancelar", headers=cliente).status_code == 200
+    assert client.put(f"/pedidos/{pedido_id}/pagar", headers=cliente).status_code == 409
+
+def test_transiciones_concurrentes_quedan_consistentes(client, cliente, admin, db):
+    pedidos = [_crear_pedido(client, cliente) for _ in range(10)]
+    azar = random.Random(7)
+    operaciones = [(azar.choice(pedidos), azar.choice(["cocina", "pagar", "cancelar"])) for _ in range(400)]
+
+    def ejecutar(operacion):
+        pedido_id, tipo = operacion
+        if tipo == "pagar":
+            respuesta = client.put(f"/pedidos/{pedido_id}/pagar", headers=cliente)
+        elif tipo == "cancelar":
+            respuesta = client.put(f"/pedidos/{pedido_id}/cancelar", headers=cliente)
+        else:
+            estado = azar.choice(estados_pedido.ESTADOS)
+            respuesta = client.put(f"/admin/pedidos/{pedido_id}/estado", params={"estado": estado}, headers=admin)
+        return pedido_id, respuesta.status_code
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        resultados = list(pool.map(ejecutar, operaciones))
+
+    # Solo éxitos o conflictos: nunca errores por carreras
+    assert {codigo for _, codigo in resultados} <= {200, 409}
+
+    # Cada escritura aceptada incrementó la versión exactamente una vez
+    exitos = Counter(pedido_id for pedido_id, codigo in resultados if codigo == 200)
+    for pedido in db.query(models.Pedido).filter(models.Pedido.id.in_(pedidos)):
+        assert pedido.version == 1 + exitos[pedido.id]
+        assert pedido.estado in estados_pedido.ESTADOS
+        if pedido.estado == estados_pedido.PAGADO:
+            assert pedido.pagado_en is not None
+
+    # Los agregados mantenidos en la misma transacción siguen cuadrando
+    assert rollups.verificar(db) == []
+    assert resumen_clientes.verificar(db) == []
+
+def test_cola_de_cocina_se_actualiza_con_los_avisos(client, cliente, admin):
+    pedido_id = _crear_pedido(client, cliente)
+    activos = lambda: [p["id"] for p in client.get("/admin/pedidos/activos", headers=admin).json()]
+    limite = time.monotonic() + 2
+    while pedido_id not in activos() and time.monotonic() < limite:
+        time.sleep(0.01)
+    assert pedido_id in activos()
+
+    assert client.put(f"/pedidos/{pedido_id}/cancelar", headers=cliente).status_code == 200
+    limite = time.monotonic() + 2
+    while pedido_id in activos() and time.monotonic() < limite:
+        time.sleep(0.01)
+    assert pedido_id not in activos()
@@ -0,0 +1,70 @@
+import csv
+import io
+import json
+import tracemalloc
+from datetime import date, datetime, timedelta
+from sqlalchemy import insert
+from backend import exportacion, models
+
+INICIO = datetime(2025, 3, 1, 10, 0)
+
+def _sembrar(db, pedidos, lineas_por_pedido=2):
+    # Un pedido cada hora desde INICIO; el último de cada 10 queda sin líneas
+    db.execute(insert(models.Pedido), [
+        {"id": i, "usuario_id": 2, "fecha_creacion": INICIO + timedelta(hours=i), "total": 1000 * i,
+         "estado": "Entregado", "metodo_pago": "webpay", "direccion_envio": f"Calle {i}, Santiago"}
+        for i in range(1, pedidos + 1)
+    ])
+    db.execute(insert(models.ItemPedido), [
+        {"pedido_id": i, "producto_id": 1, "nombre_producto": "Bowl Quinoa Power", "cantidad": n,
+         "precio_unitario": 7990, "personalizacion": None}
+        for i in range(1, pedidos + 1) if i % 10 for n in range(1, lineas_por_pedido + 1)
+    ])
+    db.commit()
+
+def test_csv_y_ndjson_respetan_el_rango(client, admin, db):
+    _sembrar(db, 100)
+    params = {"desde": "2025-03-02", "hasta": "2025-03-03"}
+    # Pedidos 14 a 61: creados entre el 2 y el 3 de marzo inclusive
+    esperados = [i for i in range(1, 101) if date(2025, 3, 2) <= (INICIO + timedelta(hours=i)).date() <= date(2025, 3, 3)]
+
+    respuesta = client.get("/admin/export/pedidos", params=dict(params, formato="csv"), headers=admin)
+    assert respuesta.status_code == 200
+    assert respuesta.headers["content-disposition"] == 'attachment; filename="pedidos_2025-03-02_2025-03-03.csv"'
+    filas = list(csv.DictReader(io.StringIO(respuesta.text)))
+    assert [int(f["pedido_id"]) for f in filas] == [i for i in esperados for _ in range(2 if i % 10 else 1)]
+    assert filas[0]["direccion_envio"] == f"Calle {esperados[0]}, Santiago"
+    assert all(f["item_id"] == "" for f in filas if int(f["pedido_id"]) % 10 == 0)
+
+    respuesta = client.get("/admin/export/pedidos", params=dict(params, formato="ndjson"), headers=admin)
+    registros = [json.loads(linea) for linea in respuesta.text.splitlines()]
+    assert [(r["pedido_id"], r["item_id"]) for r in registros] == [(int(f["pedido_id"]), int(f["item_id"]) if f["item_id"] else None) for f in filas]
+
+def test_exportacion_solo_admin(client, cliente):
+    assert client.get("/admin/export/pedidos", headers=cliente).status_code == 403
+
+def _pico_exportando():
+    # Pico de memoria de Python mientras se consume la descarga completa
+    tracemalloc.start()
+    try:
+        bytes_enviados = sum(len(bloque) for bloque in exportacion.filas_csv(None, None))
+        return tracemalloc.get_traced_memory()[1], bytes_enviados
+    finally:
+        tracemalloc.stop()
+
+def test_memoria_no_crece_con_el_rango(db, monkeypatch):
+    monkeypatch.setattr(exportacion, "FILAS_POR_LOTE", 500)
+    _sembrar(db, 1000)
+    pico_chico, bytes_chico = _pico_exportando()
+
+    db.execute(insert(models.Pedido), [
+        {"id": i, "usuario_id": 2, "fecha_creacion": INICIO + timedelta(hours=i), "total": 1,
+         "estado": "Entregado", "metodo_pago": "webpay", "direccion_envio": "x"}
+        for i in range(1001, 20001)
+    ])
+    db.commit()
+    pico_grande, bytes_grande = _pico_exportando()
+
+    # Varias veces más datos enviados, pero el pico lo fija el tamaño del lote
+    assert bytes_grande > 5 * bytes_chico
+    assert pico_grande < 2 * pico_chico
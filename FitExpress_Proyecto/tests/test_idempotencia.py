@@ -0,0 +1,83 @@
+import hashlib
+import json
+import time
+import pytest
+from fastapi import HTTPException
+from backend import database, idempotencia, models
+from .conftest import CLIENTE_EMAIL
+
+DATOS = {"direccion_envio": "Av. Siempre Viva 123", "metodo_pago": "webpay", "tipo_entrega": "delivery"}
+HUELLA = hashlib.sha256(json.dumps(DATOS, sort_keys=True).encode("utf-8")).hexdigest()
+
+@pytest.fixture
+def backend_bd(monkeypatch):
+    monkeypatch.setattr(idempotencia, "backend", idempotencia.BackendBD())
+    return idempotencia.backend
+
+def _checkout(client, cliente, clave):
+    client.post("/carrito/items", json={"producto_id": 1, "cantidad": 1}, headers=cliente)
+    return client.post("/pedidos/crear", json=DATOS, headers=dict(cliente, **{"Idempotency-Key": clave}))
+
+def _cantidad_pedidos(db):
+    db.expire_all()
+    return db.query(models.Pedido).count()
+
+def test_reintento_recibe_la_respuesta_guardada(client, cliente, db, backend_bd):
+    primera = _checkout(client, cliente, "k-1")
+    segunda = _checkout(client, cliente, "k-1")
+    assert primera.status_code == segunda.status_code == 200
+    assert segunda.headers["Idempotent-Replayed"] == "true"
+    assert segunda.json() == primera.json()
+    assert _cantidad_pedidos(db) == 1
+
+def test_reserva_abandonada_se_toma_tras_el_arriendo(client, cliente, db, backend_bd):
+    usuario = db.query(models.Usuario).filter(models.Usuario.email == CLIENTE_EMAIL).one()
+    # Un worker murió con la petición en curso: la fila quedó sin respuesta
+    db.add(models.ClaveIdempotencia(
+        clave=f"{usuario.id}:crear_pedido:k-2", huella=HUELLA, reserva="muerto",
+        reservada=time.time() - idempotencia.ARRIENDO_SEGUNDOS - 1, expira=time.time() + 60,
+    ))
+    db.commit()
+
+    inicio = time.monotonic()
+    respuesta = _checkout(client, cliente, "k-2")
+    assert respuesta.status_code == 200
+    assert time.monotonic() - inicio < idempotencia.ESPERA_MAXIMA
+    assert _cantidad_pedidos(db) == 1
+
+def test_sin_reserva_no_se_confirma_el_cambio(client, db, backend_bd):
+    usuario = db.query(models.Usuario).filter(models.Usuario.email == CLIENTE_EMAIL).one()
+    sesion = database.SessionLocal()
+
+    def cambiar_nombre():
+        # Mientras tanto otro intento tomó la reserva vencida
+        otra = database.SessionLocal()
+        otra.query(models.ClaveIdempotencia).update({"reserva": "otro"})
+        otra.commit()
+        otra.close()
+        sesion.query(models.Usuario).filter(models.Usuario.id == usuario.id).update({"nombre": "Cambiado"})
+        return {"ok": True}
+
+    try:
+        with pytest.raises(HTTPException) as error:
+            idempotencia.ejecutar("k-3", usuario.id, "prueba", {}, sesion, cambiar_nombre)
+    finally:
+        sesion.close()
+    assert error.value.status_code == 409
+
+    # Ni el cambio de negocio ni la respuesta quedaron guardados
+    db.expire_all()
+    assert db.get(models.Usuario, usuario.id).nombre != "Cambiado"
+    fila = db.query(models.ClaveIdempotencia).one()
+    assert fila.reserva == "otro" and fila.estado_http is None
+
+def test_backend_incompleto_falla_al_instanciar():
+    class SinLiberar(idempotencia.BackendIdempotencia):
+        def reservar(self, clave, huella, reserva):
+            return None
+
+        def guardar(self, clave, reserva, estado_http, cuerpo, db):
+            pass
+
+    with pytest.raises(TypeError):
+        SinLiberar()
@@ -0,0 +1,58 @@
+import time
+import pytest
+from backend import limitador, models
+from backend.routers import auth
+from .conftest import CLIENTE_EMAIL
+
+@pytest.fixture
+def hashes(monkeypatch):
+    # Cuenta las verificaciones de bcrypt que llegan a ejecutarse
+    llamadas = []
+    monkeypatch.setattr(limitador, "backend", limitador.BackendMemoria())
+    monkeypatch.setattr(auth, "verificar_password", lambda password, hashed: llamadas.append(password) or False)
+    return llamadas
+
+def _login(client, email, ip=None):
+    headers = {"X-Forwarded-For": ip} if ip else {}
+    return client.post("/auth/token", data={"username": email, "password": "incorrecta"}, headers=headers)
+
+def test_429_antes_de_calcular_el_hash(client, hashes):
+    capacidad, _ = limitador.LIMITE_POR_EMAIL
+    respuestas = [_login(client, CLIENTE_EMAIL).status_code for _ in range(capacidad + 3)]
+    assert respuestas == [401] * capacidad + [429] * 3
+    assert len(hashes) == capacidad
+
+def test_x_forwarded_for_solo_con_proxies_confiables(client, hashes, monkeypatch):
+    capacidad, _ = limitador.LIMITE_POR_IP
+    emails = [f"nadie{i}@prueba.com" for i in range(capacidad + 1)]
+
+    # Sin proxies configurados el header se ignora: todos comparten la IP de la conexión
+    assert _login(client, emails[0], ip="1.1.1.1").status_code == 401
+    for email in emails[1:capacidad]:
+        _login(client, email, ip="2.2.2.2")
+    assert _login(client, emails[capacidad], ip="3.3.3.3").status_code == 429
+
+    # Detrás de un proxy cuenta la IP que éste anotó, no la que inventó el cliente
+    monkeypatch.setattr(limitador, "backend", limitador.BackendMemoria())
+    monkeypatch.setattr(limitador, "PROXIES_CONFIABLES", 1)
+    for email in emails[:capacidad]:
+        assert _login(client, email, ip=f"falsa-{email}, 9.9.9.9").status_code == 401
+    assert _login(client, emails[capacidad], ip="otra-falsa, 9.9.9.9").status_code == 429
+    assert _login(client, emails[capacidad], ip="8.8.8.8").status_code == 401
+
+def test_bd_purga_baldes_inactivos(client, db):
+    viejo = time.time() - limitador.INACTIVIDAD_MAXIMA - 1
+    db.add(models.LimiteIntento(clave="ip:abandonada", fichas=0, actualizado=viejo))
+    db.commit()
+
+    backend = limitador.BackendBD()
+    assert backend.consumir("ip:nueva", 5, 1) == (True, 0)
+    db.expire_all()
+    assert [b.clave for b in db.query(models.LimiteIntento)] == ["ip:nueva"]
+
+def test_backend_incompleto_falla_al_instanciar():
+    class SinConsumir(limitador.BackendLimitador):
+        pass
+
+    with pytest.raises(TypeError):
+        SinConsumir()
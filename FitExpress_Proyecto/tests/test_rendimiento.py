@@ -0,0 +1,387 @@
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List
+import bcrypt
+import httpx
+import pytest
+from fastapi import Depends, FastAPI, Request
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from backend import catalogo_cache, database, models, schemas
+from backend.catalogo_cache import CatalogoCache
+from backend.dependencies import get_user_from_token
+from backend.init_db import init_db
+from .conftest import ADMIN_EMAIL, CLIENTE_EMAIL, encabezados
+from .test_checkout import DATOS as DATOS_CHECKOUT, _llenar_carrito
+
+# Mediciones de rendimiento. No corren con la suite normal: tardan y sus números
+# dependen de la máquina. Los resultados se imprimen (usar -s para verlos).
+#
+# Uso:
+#   RENDIMIENTO=1 python -m pytest -q -s tests/test_rendimiento.py
+
+pytestmark = pytest.mark.skipif(not os.getenv("RENDIMIENTO"), reason="medición opt-in: RENDIMIENTO=1")
+
+def _por_segundo(fn, segundos=2.0, minimo=3):
+    # Repite fn durante 'segundos' (al menos 'minimo' veces) y retorna llamadas por segundo
+    fn()
+    veces, inicio = 0, time.perf_counter()
+    while veces < minimo or time.perf_counter() - inicio < segundos:
+        fn()
+        veces += 1
+    return veces / (time.perf_counter() - inicio)
+
+def _percentiles(duraciones):
+    # (p50, p99) en milisegundos
+    cortes = statistics.quantiles(duraciones, n=100)
+    return cortes[49] * 1000, cortes[98] * 1000
+
+def _completar_catalogo(db, cantidad):
+    # Agrega productos sintéticos hasta llegar a 'cantidad' (la semilla trae 15)
+    faltan = cantidad - db.query(models.Producto).count()
+    if faltan <= 0:
+        return
+    db.execute(insert(models.Producto), [
+        {
+            "id": 1000 + i, "nombre": f"Producto sintético {i}", "precio_base": 1000 + i % 50 * 100,
+            "imagen_url": f"https://img.test/{i}.jpg", "descripcion": f"Descripción del producto {i}",
+            "tipo": ("bowl", "snack", "combo")[i % 3], "kcal": 100 + i % 800, "proteina": i % 60,
+            "grasas": i % 40, "carbs": i % 90, "disponible": i % 10 != 0,
+        }
+        for i in range(faltan)
+    ])
+    db.commit()
+    catalogo_cache.invalidar()
+
+# ----------------------
+# CATÁLOGO
+# ----------------------
+
+def _app_catalogo_anterior():
+    # El endpoint como era antes del caché: objetos Producto completos y
+    # validación de List[ProductoOut] en cada petición
+    app = FastAPI()
+
+    @app.get("/catalogo/productos", response_model=List[schemas.ProductoOut])
+    def get_catalog_products(db: Session = Depends(database.get_db)):
+        productos = db.query(models.Producto).order_by(models.Producto.id).all()
+        for p in productos:
+            p.macros = {"kcal": p.kcal, "p": p.proteina, "f": p.grasas, "c": p.carbs}
+        return productos
+
+    return app
+
+@pytest.mark.parametrize("cantidad", [15, 1000, 50000])
+def test_catalogo_peticiones_por_segundo(client, db, cantidad):
+    _completar_catalogo(db, cantidad)
+    anterior = TestClient(_app_catalogo_anterior())
+    assert client.get("/catalogo/productos").json() == anterior.get("/catalogo/productos").json()
+
+    resultados = {
+        "anterior": _por_segundo(lambda: anterior.get("/catalogo/productos")),
+        "bytes": _por_segundo(lambda: client.get("/catalogo/productos")),
+        "bytes gzip": _por_segundo(lambda: client.get("/catalogo/productos", headers={"Accept-Encoding": "gzip"})),
+    }
+    print(f"\ncatálogo {cantidad} productos: " + ", ".join(f"{k} {v:,.1f} req/s" for k, v in resultados.items()))
+    assert resultados["bytes"] > resultados["anterior"]
+
+# ----------------------
+# CHECKOUT
+# ----------------------
+
+def _app_checkout_anterior():
+    # El checkout como era antes: commit del pedido, un add y un acceso perezoso
+    # a item.producto por línea, y un segundo commit
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def contar_consultas_sql(request: Request, call_next):
+        with database.contar_consultas() as contador:
+            response = await call_next(request)
+        response.headers["X-Query-Count"] = str(contador[0])
+        return response
+
+    @app.post("/pedidos/crear")
+    def crear_pedido(datos: schemas.PedidoCreate, user: models.Usuario = Depends(get_user_from_token), db: Session = Depends(database.get_db)):
+        carrito = db.query(models.Carrito).filter(models.Carrito.usuario_id == user.id).first()
+        subtotal = 0
+        for item in carrito.items:
+            precio_real = item.precio_guardado if item.precio_guardado is not None else item.producto.precio_base
+            subtotal += precio_real * item.cantidad
+        costo_envio = 2000 if datos.tipo_entrega == "delivery" else 0
+        nuevo_pedido = models.Pedido(
+            usuario_id=user.id, total=subtotal + costo_envio, direccion_envio=datos.direccion_envio,
+            metodo_pago=datos.metodo_pago, estado="Recibido"
+        )
+        db.add(nuevo_pedido)
+        db.commit()
+        db.refresh(nuevo_pedido)
+        for item in carrito.items:
+            precio_real = item.precio_guardado if item.precio_guardado is not None else item.producto.precio_base
+            nombre_final = item.personalizacion if item.personalizacion else item.producto.nombre
+            db.add(models.ItemPedido(
+                pedido_id=nuevo_pedido.id, producto_id=item.producto_id, nombre_producto=nombre_final,
+                precio_unitario=precio_real, cantidad=item.cantidad, personalizacion=item.personalizacion
+            ))
+        db.query(models.CarritoItem).filter(models.CarritoItem.carrito_id == carrito.id).delete()
+        db.commit()
+        return {"mensaje": "Pedido creado exitosamente", "pedido_id": nuevo_pedido.id}
+
+    return app
+
+def _medir_checkout(client, checkout, cliente, cantidad, repeticiones=15):
+    # (mediana en ms, consultas SQL) de un checkout con 'cantidad' líneas
+    duraciones = []
+    for _ in range(repeticiones):
+        _llenar_carrito(client, cliente, cantidad)
+        inicio = time.perf_counter()
+        respuesta = checkout.post("/pedidos/crear", json=DATOS_CHECKOUT, headers=cliente)
+        duraciones.append(time.perf_counter() - inicio)
+        assert respuesta.status_code == 200
+    return statistics.median(duraciones) * 1000, int(respuesta.headers["X-Query-Count"])
+
+def test_checkout_latencia_y_consultas(client, cliente):
+    client.get("/carrito/", headers=cliente)  # calienta la caché de usuarios
+    anterior = TestClient(_app_checkout_anterior())
+    print("\ncheckout (mediana, consultas SQL):")
+    for cantidad in (1, 10, 100):
+        antes = _medir_checkout(client, anterior, cliente, cantidad)
+        ahora = _medir_checkout(client, client, cliente, cantidad)
+        print(f"  {cantidad:3} líneas: anterior {antes[0]:.2f} ms / {antes[1]} consultas, actual {ahora[0]:.2f} ms / {ahora[1]} consultas")
+        assert ahora[1] <= antes[1]
+
+# ----------------------
+# BÚSQUEDA
+# ----------------------
+
+Fila = namedtuple("Fila", "id nombre descripcion precio_base imagen_url tipo disponible kcal proteina grasas carbs")
+
+PALABRAS = [
+    "Bowl", "Quinoa", "Proteico", "Energía", "Verde", "Vegano", "Mediterráneo", "Carne", "Coreana",
+    "Barra", "Almendras", "Chocolate", "Combo", "Desayuno", "Pareja", "Saludable", "Atún", "Pollo",
+    "Teriyaki", "Garbanzos", "Aguacate", "Espinacas", "Kale", "Falafel", "Lentejas", "Granada",
+    "Aceitunas", "Feta", "Kimchi", "Huevo", "Avena", "Granola", "Smoothie", "Muffin", "Café", "Té",
+    "Salmón", "Tofu", "Hummus", "Cúrcuma", "Jengibre", "Maní", "Coco", "Piña", "Mango", "Arándanos",
+]
+
+CONSULTAS = ["energia", "mediterraneo", "bowl quin", "pollo teri", "cafe", "salmon tofu", "lote12345", "xyz", "b"]
+
+def _filas_busqueda(cantidad):
+    azar = random.Random(7)
+    return [
+        Fila(
+            i, " ".join(azar.sample(PALABRAS, 3)), f"{' '.join(azar.sample(PALABRAS, 5))} lote{i}",
+            1000, "", "bowl", True, None, None, None, None,
+        )
+        for i in range(1, cantidad + 1)
+    ]
+
+def test_buscar_latencia_con_100k_productos():
+    filas = _filas_busqueda(100_000)
+    cache = CatalogoCache()
+    inicio = time.perf_counter()
+    cache.buscar(lambda: filas, "bowl")
+    carga = time.perf_counter() - inicio
+
+    print(f"\nbuscar en 100k productos (índice armado en {carga:.2f} s):")
+    todas = []
+    for consulta in CONSULTAS:
+        duraciones = []
+        for _ in range(200):
+            inicio = time.perf_counter()
+            cache.buscar(lambda: filas, consulta)
+            duraciones.append(time.perf_counter() - inicio)
+        todas += duraciones
+        p50, p99 = _percentiles(duraciones)
+        print(f"  {consulta!r:15} p50 {p50:.3f} ms  p99 {p99:.3f} ms")
+    p50, p99 = _percentiles(todas)
+    print(f"  {'todas':15} p50 {p50:.3f} ms  p99 {p99:.3f} ms")
+    assert p50 < 1
+
+# ----------------------
+# LOGIN BAJO ATAQUE
+# ----------------------
+
+# La app corre en un uvicorn aparte: el ataque y el catálogo compiten por la CPU
+# del servidor, no por el GIL del proceso que mide.
+# Con "sin-limite" todo intento llega a bcrypt, como antes del limitador.
+SERVIDOR = """
+import sys, uvicorn
+from backend import limitador
+from backend.main import app
+
+class SinLimite(limitador.BackendLimitador):
+    def consumir(self, clave, capacidad, recarga):
+        return True, 0
+
+if sys.argv[2] == "sin-limite":
+    limitador.backend = SinLimite()
+uvicorn.run(app, host="127.0.0.1", port=int(sys.argv[1]), log_level="warning")
+"""
+
+@contextmanager
+def _servidor(modo):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        puerto = sock.getsockname()[1]
+    proceso = subprocess.Popen(
+        [sys.executable, "-c", SERVIDOR, str(puerto), modo],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    try:
+        limite = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(f"{url}/catalogo/productos")
+                break
+            except httpx.TransportError:
+                assert time.monotonic() < limite, "el servidor no arrancó"
+                time.sleep(0.1)
+        yield url, proceso.pid
+    finally:
+        proceso.terminate()
+        proceso.wait()
+
+@pytest.fixture
+def victima():
+    init_db()
+    db = database.SessionLocal()
+    try:
+        # Costo de producción para la cuenta atacada (la suite usa BCRYPT_ROUNDS=4)
+        db.query(models.Usuario).filter(models.Usuario.email == CLIENTE_EMAIL).update({
+            "hashed_password": bcrypt.hashpw(b"secreta", bcrypt.gensalt(12)).decode("utf-8"),
+        })
+        db.commit()
+    finally:
+        db.close()
+
+def _latencias_catalogo(url, segundos):
+    duraciones = []
+    with httpx.Client(base_url=url) as http:
+        fin = time.perf_counter() + segundos
+        while time.perf_counter() < fin:
+            inicio = time.perf_counter()
+            assert http.get("/catalogo/productos").status_code == 200
+            duraciones.append(time.perf_counter() - inicio)
+    return duraciones
+
+# Intentos de login contra la misma cuenta a ritmo fijo, como un atacante que no
+# espera a que el servidor se desocupe. Corre en otro proceso para no competir
+# por el GIL con la medición; al terminar imprime {estado_http: cantidad}.
+ATACANTE = """
+import json, sys, threading, time
+from collections import Counter
+import httpx
+
+url, email, segundos, por_segundo, hilos = sys.argv[1], sys.argv[2], float(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5])
+respuestas, fin = Counter(), time.perf_counter() + segundos
+
+def atacar(desfase):
+    proximo = time.perf_counter() + desfase
+    with httpx.Client(base_url=url, timeout=60) as http:
+        while proximo < fin:
+            time.sleep(max(0, proximo - time.perf_counter()))
+            proximo += hilos / por_segundo
+            r = http.post("/auth/token", data={"username": email, "password": "incorrecta"})
+            respuestas[r.status_code] += 1
+
+todos = [threading.Thread(target=atacar, args=(i / por_segundo,)) for i in range(hilos)]
+for hilo in todos:
+    hilo.start()
+for hilo in todos:
+    hilo.join()
+print(json.dumps(respuestas))
+"""
+
+def _bajo_ataque(url, segundos, calentamiento=3, por_segundo=20, hilos=16):
+    # Se mide con el ataque ya en régimen: pasado el arranque del atacante y los
+    # primeros intentos que el limitador sí deja llegar a bcrypt
+    atacante = subprocess.Popen(
+        [sys.executable, "-c", ATACANTE, url, CLIENTE_EMAIL, str(calentamiento + segundos), str(por_segundo), str(hilos)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    time.sleep(calentamiento)
+    duraciones = _latencias_catalogo(url, segundos)
+    salida, _ = atacante.communicate()
+    return duraciones, Counter({int(k): v for k, v in json.loads(salida).items()})
+
+def test_catalogo_con_login_bajo_ataque(victima):
+    with _servidor("memoria") as (url, _):
+        resultados = {"sin ataque": (_latencias_catalogo(url, 5), Counter())}
+        resultados["ataque con limitador"] = _bajo_ataque(url, 5)
+    with _servidor("sin-limite") as (url, _):
+        resultados["ataque sin limitador"] = _bajo_ataque(url, 5)
+
+    print("\n/catalogo/productos mientras se ataca /auth/token:")
+    for nombre, (duraciones, respuestas) in resultados.items():
+        p50, p99 = _percentiles(duraciones)
+        login = ", ".join(f"{n}x{codigo}" for codigo, n in sorted(respuestas.items()))
+        print(f"  {nombre:22} p50 {p50:.2f} ms  p99 {p99:.2f} ms  ({len(duraciones)} peticiones)  login: {login or '-'}")
+
+    base = _percentiles(resultados["sin ataque"][0])[0]
+    assert _percentiles(resultados["ataque con limitador"][0])[0] < 2 * base
+
+# ----------------------
+# EXPORTACIÓN
+# ----------------------
+
+MB = 1024 * 1024
+INICIO_EXPORTACION = datetime(2024, 1, 1)
+
+def _sembrar_pedidos(db, cantidad, lote=50_000):
+    # Un pedido por minuto, con 2 líneas salvo el último de cada 10; por lotes
+    # para no armar millones de diccionarios de una vez
+    for desde in range(1, cantidad + 1, lote):
+        ids = range(desde, min(desde + lote, cantidad + 1))
+        db.execute(insert(models.Pedido), [
+            {"id": i, "usuario_id": 2, "fecha_creacion": INICIO_EXPORTACION + timedelta(minutes=i), "total": 1000 * i,
+             "estado": "Entregado", "metodo_pago": "webpay", "direccion_envio": f"Calle {i}, Santiago"}
+            for i in ids
+        ])
+        db.execute(insert(models.ItemPedido), [
+            {"pedido_id": i, "producto_id": 1, "nombre_producto": "Bowl Quinoa Power", "cantidad": n,
+             "precio_unitario": 7990, "personalizacion": None}
+            for i in ids if i % 10 for n in (1, 2)
+        ])
+        db.commit()
+
+def _pico_rss(pid):
+    # Máximo de memoria residente que alcanzó el proceso (Linux)
+    with open(f"/proc/{pid}/status") as estado:
+        for linea in estado:
+            if linea.startswith("VmHWM:"):
+                return int(linea.split()[1]) * 1024
+
+def _descargar(url, params):
+    with httpx.stream("GET", f"{url}/admin/export/pedidos", params=params, headers=encabezados(ADMIN_EMAIL), timeout=600) as r:
+        assert r.status_code == 200
+        return sum(len(bloque) for bloque in r.iter_raw())
+
+def test_exportacion_de_un_millon_de_pedidos_con_memoria_acotada(client, db):
+    _sembrar_pedidos(db, 1_000_000)
+    with _servidor("memoria") as (url, pid):
+        # Un día (1.440 pedidos) fija la línea base del proceso ya caliente
+        dia = (INICIO_EXPORTACION + timedelta(days=10)).date().isoformat()
+        _descargar(url, {"desde": dia, "hasta": dia, "formato": "csv"})
+        base = _pico_rss(pid)
+        medidas = {}
+        for formato in ("csv", "ndjson"):
+            inicio = time.perf_counter()
+            enviados = _descargar(url, {"formato": formato})
+            medidas[formato] = (enviados, time.perf_counter() - inicio, _pico_rss(pid))
+
+    print(f"\nexportación de 1.000.000 pedidos (1.900.000 filas), RSS base {base / MB:.0f} MB:")
+    for formato, (enviados, segundos, pico) in medidas.items():
+        print(f"  {formato:6} {enviados / MB:,.0f} MB en {segundos:.0f} s, pico RSS {pico / MB:.0f} MB")
+    assert all(pico < base + 50 * MB for _, _, pico in medidas.values())
@@ -0,0 +1,44 @@
+from fastapi.testclient import TestClient
+from backend import models
+from backend.main import app
+
+DATOS = {"direccion_envio": "Av. Siempre Viva 123", "metodo_pago": "webpay", "tipo_entrega": "delivery"}
+
+def _crear_pedidos(client, cliente, cantidad=4):
+    ids = []
+    for _ in range(cantidad):
+        client.post("/carrito/items", json={"producto_id": 1, "cantidad": 2}, headers=cliente)
+        ids.append(client.post("/pedidos/crear", json=DATOS, headers=cliente).json()["pedido_id"])
+    client.put(f"/pedidos/{ids[0]}/cancelar", headers=cliente)
+    client.put(f"/pedidos/{ids[1]}/pagar", headers=cliente)
+    return ids
+
+def _reporte(client, admin):
+    reporte = client.get("/admin/reportes/ventas", headers=admin).json()
+    return reporte["total_ventas"], reporte["cantidad_pedidos"], reporte["ticket_promedio"]
+
+def test_reporte_con_pedidos_anteriores_al_agregado(client, cliente, admin, db):
+    _crear_pedidos(client, cliente)
+    # Lo que respondía el reporte original, sumando sobre 'pedidos'
+    validos = db.query(models.Pedido).filter(models.Pedido.estado != "Cancelado").all()
+    esperado = (sum(p.total for p in validos), len(validos), sum(p.total for p in validos) // len(validos))
+    assert _reporte(client, admin) == esperado
+
+    # Una base existente: los pedidos ya estaban, el agregado recién se creó vacío
+    db.query(models.VentaPorHora).delete()
+    db.commit()
+    with TestClient(app) as reiniciado:
+        assert _reporte(reiniciado, admin) == esperado
+
+def test_resumen_de_clientes_con_pedidos_anteriores(client, cliente, admin, db):
+    ids = _crear_pedidos(client, cliente)
+    pedidos = db.query(models.Pedido).filter(models.Pedido.id.in_(ids)).all()
+    gasto = sum(p.total for p in pedidos if p.estado != "Cancelado")
+
+    db.query(models.ResumenCliente).delete()
+    db.commit()
+    with TestClient(app) as reiniciado:
+        resumen = reiniciado.get("/admin/usuarios/2/resumen", headers=admin).json()
+        assert (resumen["pedidos"], resumen["cancelados"], resumen["gasto_total"]) == (len(ids), 1, gasto)
+        fila = next(u for u in reiniciado.get("/admin/usuarios", headers=admin).json() if u["id"] == 2)
+        assert (fila["cantidad_pedidos"], fila["valor_total"]) == (len(ids), gasto)
@@ -1,7 +1,12 @@
 # En: gestores/gestor_admin.py
+from datetime import date, datetime, time, timedelta
 from fastapi import APIRouter, Depends
-from modelos import schemas
+from sqlalchemy import func
+from sqlmodel import Session, select
+from modelos import schemas, models
 from typing import List
+from database import get_session
+from .gestor_carrito import reconciliar_totales
 
 # Simulación de un "super admin"
 async def get_admin_user():
@@ -26,22 +31,60 @@ async def asignar_rol(asignacion: schemas.AsignarRol):
     print(f"Asignando rol {asignacion.rol} a {asignacion.email_usuario}")
     return {"mensaje": "Rol asignado"}
 
+# --- Conciliación de totales de carritos ---
+@router.post("/carritos/reconciliar")
+async def reconciliar_carritos(corregir: bool = True, db: Session = Depends(get_session)):
+    """
+    Compara el total guardado de cada carrito con la suma de sus ítems
+    (una consulta agregada) y corrige las diferencias encontradas.
+    """
+    return reconciliar_totales(db, corregir=corregir)
+
 # --- Endpoint para E04: Reporte de Ventas ---
 @router.get("/reportes/ventas")
-async def reporte_ventas(fecha_desde: str, fecha_hasta: str):
+async def reporte_ventas(fecha_desde: date, fecha_hasta: date, db: Session = Depends(get_session)):
     """
     Lógica de E04:
-    1. 'ReportService.salesSummary()'.
+    1. 'ReportService.salesSummary()': SUM/COUNT y ticket promedio (total / pedidos)
+       agrupados por día y medio de pago directamente en la BD (fecha_hasta inclusiva,
+       sin pedidos cancelados).
     2. Devolver KPIs y tabla.
     """
-    print(f"Generando reporte de ventas de {fecha_desde} a {fecha_hasta}")
+    desde = datetime.combine(fecha_desde, time.min)
+    hasta = datetime.combine(fecha_hasta + timedelta(days=1), time.min)
+    dia = func.date(models.Pedido.creado_en)
+    suma_total = func.sum(models.Pedido.total)
+    cantidad_pedidos = func.count(models.Pedido.id)
+    statement = (
+        select(dia, models.Pago.tipo, suma_total, cantidad_pedidos, suma_total / cantidad_pedidos)
+        .join(models.Pago, models.Pago.id == models.Pedido.pago_id)
+        .join(models.EstadoPedido, models.EstadoPedido.id == models.Pedido.estado_id)
+        .where(
+            models.EstadoPedido.nombre != schemas.EstadoPedido.CANCELADO.value,
+            models.Pedido.creado_en >= desde,
+            models.Pedido.creado_en < hasta,
+        )
+        .group_by(dia, models.Pago.tipo)
+        .order_by(dia, models.Pago.tipo)
+    )
+    tabla_datos = [
+        {
+            "fecha": str(fecha),
+            "canal": canal,
+            "monto": int(monto or 0),
+            "pedidos": pedidos,
+            "ticket_promedio": int(ticket or 0),
+        }
+        for fecha, canal, monto, pedidos, ticket in db.exec(statement).all()
+    ]
+
+    ingresos = sum(fila["monto"] for fila in tabla_datos)
+    pedidos = sum(fila["pedidos"] for fila in tabla_datos)
     return {
-        "ingresos": 5420000,
-        "pedidos": 684,
-        "ticket_promedio": 7927,
-        "tabla_datos": [
-            {"fecha": "2025-09-24", "canal": "Web", "monto": 358000}
-        ]
+        "ingresos": ingresos,
+        "pedidos": pedidos,
+        "ticket_promedio": ingresos // pedidos if pedidos else 0,
+        "tabla_datos": tabla_datos
     }
 
 # --- Endpoint para E03: Asignación de Despacho ---
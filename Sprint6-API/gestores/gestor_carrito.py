@@ -1,4 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import delete, func, update
+from sqlalchemy.orm import selectinload
 from sqlmodel import Session, select
 from uuid import UUID
 from modelos import schemas, models 
@@ -11,13 +13,22 @@ router = APIRouter(
     dependencies=[Depends(get_usuario_actual)]
 )
 
+# Carga anticipada de todo lo que serializa CarritoView: una consulta por nivel
+# de relación, sin importar cuántas líneas tenga el carrito.
+_ITEMS = selectinload(models.Carrito.items)
+CARGA_CARRITO = [
+    _ITEMS.selectinload(models.ItemCarrito.producto).selectinload(models.Producto.macros),
+    _ITEMS.selectinload(models.ItemCarrito.bowl_personalizado).selectinload(models.BowlPersonalizado.tipo_bowl),
+    _ITEMS.selectinload(models.ItemCarrito.bowl_personalizado).selectinload(models.BowlPersonalizado.extras),
+]
+
 # --- 1. Obtener el Carrito ---
 @router.get("/", response_model=schemas.CarritoView)
 async def obtener_carrito(
-    usuario: schemas.Usuario = Depends(get_usuario_actual),
+    usuario: schemas.UsuarioToken = Depends(get_usuario_actual),
     db: Session = Depends(get_session)
 ):
-    statement = select(models.Carrito).where(models.Carrito.usuario_id == usuario.id)
+    statement = select(models.Carrito).where(models.Carrito.usuario_id == usuario.id).options(*CARGA_CARRITO)
     carrito = db.exec(statement).first()
 
     if not carrito:
@@ -29,10 +40,24 @@ async def obtener_carrito(
     return carrito
 
 # --- 2. Agregar Item al Carrito ---
+# El total se mantiene aplicando el delta de la línea, en la misma transacción
+# que el cambio del ítem: un solo commit por clic.
+def _sumar_al_total(db: Session, carrito_id, delta: int):
+    # UPDATE atómico en la BD: no depende de lo que tenga cargado esta sesión
+    db.exec(
+        update(models.Carrito)
+        .where(models.Carrito.id == carrito_id)
+        .values(total=models.Carrito.total + delta)
+    )
+
+def _carrito_para_respuesta(db: Session, carrito_id):
+    statement = select(models.Carrito).where(models.Carrito.id == carrito_id).options(*CARGA_CARRITO)
+    return db.exec(statement.execution_options(populate_existing=True)).one()
+
 @router.post("/items", response_model=schemas.CarritoView)
 async def agregar_item(
     item_in: schemas.ItemCarritoCreate, 
-    usuario: schemas.Usuario = Depends(get_usuario_actual),
+    usuario: schemas.UsuarioToken = Depends(get_usuario_actual),
     db: Session = Depends(get_session)
 ):
     # A. Obtener carrito
@@ -41,8 +66,7 @@ async def agregar_item(
     if not carrito:
         carrito = models.Carrito(usuario_id=usuario.id, total=0)
         db.add(carrito)
-        db.commit()
-        db.refresh(carrito)
+        db.flush()
 
     # B. Buscar producto
     try:
@@ -58,11 +82,17 @@ async def agregar_item(
         raise HTTPException(status_code=400, detail="El producto no está disponible")
 
     # C. Verificar si existe (Sumar cantidad)
-    item_existente = next((item for item in carrito.items if item.producto_id == producto.id), None)
+    item_existente = db.exec(
+        select(models.ItemCarrito).where(
+            models.ItemCarrito.carrito_id == carrito.id,
+            models.ItemCarrito.producto_id == producto.id
+        )
+    ).first()
 
     if item_existente:
         item_existente.cantidad += item_in.cantidad
         db.add(item_existente)
+        delta = item_existente.precio_unitario * item_in.cantidad
     else:
         nuevo_item = models.ItemCarrito(
             carrito_id=carrito.id,
@@ -71,25 +101,20 @@ async def agregar_item(
             precio_unitario=producto.precio 
         )
         db.add(nuevo_item)
-    
-    db.commit()
-    db.refresh(carrito)
+        delta = producto.precio * item_in.cantidad
 
-    # D. Recalcular total
-    nuevo_total = sum([item.precio_unitario * item.cantidad for item in carrito.items])
-    carrito.total = nuevo_total
-    
-    db.add(carrito)
+    # D. Actualizar total con el delta
+    db.flush()
+    _sumar_al_total(db, carrito.id, delta)
     db.commit()
-    db.refresh(carrito)
-    
-    return carrito
+
+    return _carrito_para_respuesta(db, carrito.id)
 
 # --- 3. Eliminar Item ---
 @router.delete("/items/{item_id}", response_model=schemas.CarritoView)
 async def eliminar_item(
     item_id: str,
-    usuario: schemas.Usuario = Depends(get_usuario_actual),
+    usuario: schemas.UsuarioToken = Depends(get_usuario_actual),
     db: Session = Depends(get_session)
 ):
     try:
@@ -105,32 +130,61 @@ async def eliminar_item(
     if carrito.usuario_id != usuario.id:
         raise HTTPException(status_code=403, detail="No tienes permiso")
 
+    delta = -(item.precio_unitario * item.cantidad)
     db.delete(item)
+    db.flush()
+    _sumar_al_total(db, carrito.id, delta)
     db.commit()
-    
-    db.refresh(carrito)
-    carrito.total = sum([i.precio_unitario * i.cantidad for i in carrito.items])
-    db.add(carrito)
-    db.commit()
-    db.refresh(carrito)
 
-    return carrito
+    return _carrito_para_respuesta(db, carrito.id)
 
 # --- 4. Vaciar Carrito ---
 @router.delete("/", status_code=204)
 async def vaciar_carrito(
-    usuario: schemas.Usuario = Depends(get_usuario_actual),
+    usuario: schemas.UsuarioToken = Depends(get_usuario_actual),
     db: Session = Depends(get_session)
 ):
     statement = select(models.Carrito).where(models.Carrito.usuario_id == usuario.id)
     carrito = db.exec(statement).first()
     
     if carrito:
-        for item in carrito.items:
-            db.delete(item)
-        
+        db.exec(delete(models.ItemCarrito).where(models.ItemCarrito.carrito_id == carrito.id))
         carrito.total = 0
         db.add(carrito)
         db.commit()
     
-    return None
\ No newline at end of file
+    return None
+
+# --- 5. Conciliación de totales ---
+def reconciliar_totales(db: Session, corregir: bool = True):
+    """
+    Recalcula el total de TODOS los carritos con una sola consulta agregada,
+    informa los que no coinciden con el total guardado y (opcional) los corrige
+    con un UPDATE masivo por clave primaria.
+    """
+    suma_items = func.coalesce(func.sum(models.ItemCarrito.precio_unitario * models.ItemCarrito.cantidad), 0)
+    filas = db.exec(
+        select(models.Carrito.id, models.Carrito.total, suma_items)
+        .join(models.ItemCarrito, models.ItemCarrito.carrito_id == models.Carrito.id, isouter=True)
+        .group_by(models.Carrito.id, models.Carrito.total)
+    ).all()
+
+    diferencias = [
+        {"carrito_id": str(cid), "total_guardado": guardado, "total_real": real, "diferencia": real - guardado}
+        for cid, guardado, real in filas
+        if guardado != real
+    ]
+
+    if corregir and diferencias:
+        db.exec(update(models.Carrito), params=[
+            {"id": UUID(d["carrito_id"]), "total": d["total_real"]} for d in diferencias
+        ])
+        db.commit()
+
+    return {
+        "carritos_revisados": len(filas),
+        "carritos_con_diferencia": len(diferencias),
+        "diferencia_acumulada": sum(d["diferencia"] for d in diferencias),
+        "corregido": corregir,
+        "detalle": diferencias[:100],
+    }
@@ -1,7 +1,7 @@
 # En: gestores/gestor_facturacion.py
 from fastapi import APIRouter, Depends
-from modelos import schemas
-from .gestor_usuarios import get_usuario_actual
+from modelos import schemas, models
+from .gestor_usuarios import get_usuario_actual, get_usuario_verificado
 
 router = APIRouter(
     prefix="/facturacion",
@@ -13,7 +13,7 @@ router = APIRouter(
 @router.post("/boleta", response_model=schemas.ResultadoBoleta)
 async def emitir_boleta(
     datos: schemas.DatosBoleta,
-    usuario: schemas.Usuario = Depends(get_usuario_actual)
+    usuario: models.Usuario = Depends(get_usuario_verificado) # Ruta sensible: se revalida en BD
 ):
     """
     Lógica de B15:
@@ -36,7 +36,7 @@ async def emitir_boleta(
 @router.post("/factura", response_model=schemas.ResultadoFactura)
 async def emitir_factura(
     datos: schemas.DatosFactura,
-    usuario: schemas.Usuario = Depends(get_usuario_actual)
+    usuario: models.Usuario = Depends(get_usuario_verificado) # Ruta sensible: se revalida en BD
 ):
     """
     Lógica de B16:
@@ -12,7 +12,7 @@ router = APIRouter(
 @router.post("/cotizar-envio", response_model=schemas.CotizacionEnvio)
 async def cotizar_envio(
     direccion: schemas.Direccion, # Usa el schema de entrada
-    usuario: schemas.Usuario = Depends(get_usuario_actual)
+    usuario: schemas.UsuarioToken = Depends(get_usuario_actual)
 ):
     print(f"Cotizando envío para comuna: {direccion.comuna}")
     
@@ -37,7 +37,7 @@ async def cotizar_envio(
 @router.post("/{pedido_id}/cancelar", response_model=schemas.ResultadoCancelacion)
 async def cancelar_pedido(
     pedido_id: str,
-    usuario: schemas.Usuario = Depends(get_usuario_actual)
+    usuario: schemas.UsuarioToken = Depends(get_usuario_actual)
 ):
     # Simulación de pedido
     pedido_mock = schemas.Pedido(
@@ -1,12 +1,35 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from jose import JWTError, jwt
 from sqlmodel import Session, select
 from passlib.context import CryptContext
 from modelos import schemas, models
 from database import get_session
 
 # Configuración de hashing de contraseñas
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# El costo, los procesos del pool y el máximo de hashes en espera se configuran por entorno
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_MAX_PENDIENTES = int(os.getenv("HASH_MAX_PENDIENTES", "32"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Configuración de tokens firmados (JWT)
+# Nota: En producción, la clave debería cargarse desde variables de entorno
+SECRET_KEY = "FITEXPRESS_SPRINT6_SECRETO"
+ALGORITHM = "HS256"
+TOKEN_EXPIRA_MINUTOS = 60
+
+# El modelo Usuario aún no tiene columna de rol; todos los tokens salen como cliente
+ROL_POR_DEFECTO = "cliente"
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 router = APIRouter(
     prefix="/auth",
@@ -19,23 +42,111 @@ def get_password_hash(password):
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+def necesita_rehash(hashed_password):
+    # Formato bcrypt: $2b$<costo>$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+# bcrypt bloquea la CPU: dentro de un 'async def' congelaría el event loop.
+# Se ejecuta en un pool de procesos acotado y, si hay demasiados en espera, se responde 503.
+# Los hijos se crean con 'spawn' para no heredar hilos ni conexiones del servidor.
+_pool_hashing = None
+_hashes_pendientes = 0
+
+async def _en_pool_hashing(fn, *args):
+    global _pool_hashing, _hashes_pendientes
+    if _hashes_pendientes >= HASH_MAX_PENDIENTES:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servicio ocupado, intenta nuevamente en unos segundos.",
+            headers={"Retry-After": "1"},
+        )
+    if _pool_hashing is None:
+        _pool_hashing = ProcessPoolExecutor(
+            max_workers=HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    _hashes_pendientes += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_pool_hashing, fn, *args)
+    finally:
+        _hashes_pendientes -= 1
+
+def cerrar_pool_hashing():
+    # Al apagar la app: espera lo pendiente y termina los procesos hijos
+    global _pool_hashing
+    pool, _pool_hashing = _pool_hashing, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+async def hashear_en_pool(password):
+    return await _en_pool_hashing(get_password_hash, password)
+
+async def verificar_en_pool(plain_password, hashed_password):
+    return await _en_pool_hashing(verify_password, plain_password, hashed_password)
+
+def _valor(enum_o_texto):
+    return getattr(enum_o_texto, "value", enum_o_texto)
+
+def crear_token(user: models.Usuario):
+    # Los claims llevan todo lo necesario para autorizar sin volver a la BD
+    claims = {
+        "sub": str(user.id),
+        "estado": _valor(user.estado),
+        "rol": ROL_POR_DEFECTO,
+        "exp": datetime.now(timezone.utc) + timedelta(minutes=TOKEN_EXPIRA_MINUTOS),
+    }
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+def _usuario_publico(user: models.Usuario):
+    # El modelo guarda 'correo' y el schema expone 'email'
+    return schemas.Usuario(
+        id=user.id,
+        nombre=user.nombre,
+        rut=user.rut,
+        email=user.correo,
+        telefono=user.telefono,
+        estado=_valor(user.estado),
+    )
+
 # Dependencia para obtener usuario actual (usada por otros gestores)
-async def get_usuario_actual(token: str = Depends(schemas.Token), db: Session = Depends(get_session)):
-    # NOTA: Aquí simplificamos. En producción, decodificarías el JWT.
-    # Para este sprint, buscaremos un usuario "por defecto" o simularemos validación.
-    # Si usas login real, el token debería ser el ID o email encriptado.
-    
-    # MODO SIMPLE: Si el token es un email válido en la BD, lo dejamos pasar
-    # (Esto es solo para desarrollo, NO PRODUCCIÓN)
-    user = db.exec(select(models.Usuario).where(models.Usuario.correo == token)).first()
-    if not user:
-        # Fallback para pruebas con usuario test
-        user = db.exec(select(models.Usuario).where(models.Usuario.correo == "test@test.com")).first()
-        if not user:
-             raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Credenciales inválidas",
-            )
+# Decide solo con los claims del token firmado: no consulta la BD.
+async def get_usuario_actual(token: str = Depends(oauth2_scheme)):
+    credenciales_invalidas = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Credenciales inválidas",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        usuario = schemas.UsuarioToken(
+            id=UUID(payload["sub"]),
+            estado=payload["estado"],
+            rol=payload.get("rol", ROL_POR_DEFECTO),
+        )
+    except (JWTError, KeyError, ValueError):
+        raise credenciales_invalidas
+
+    if usuario.estado != schemas.EstadoUsuario.ACTIVO:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Usuario no activo")
+    return usuario
+
+# Dependencia para rutas sensibles: además de los claims, confirma en la BD
+# que el usuario sigue existiendo y activo (una lectura por clave primaria).
+async def get_usuario_verificado(
+    usuario: schemas.UsuarioToken = Depends(get_usuario_actual),
+    db: Session = Depends(get_session)
+):
+    user = db.get(models.Usuario, usuario.id)
+    if not user or _valor(user.estado) != schemas.EstadoUsuario.ACTIVO.value:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Credenciales inválidas",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 # --- Endpoint para B01: Registro de Usuario ---
@@ -55,7 +166,7 @@ async def registrar_usuario(
         rut=usuario_data.rut,
         correo=usuario_data.email,
         telefono=usuario_data.telefono,
-        contrasena_hash=get_password_hash(usuario_data.password),
+        contrasena_hash=await hashear_en_pool(usuario_data.password),
         estado=models.EstadoUsuarioEnum.ACTIVO # Lo activamos directo por simplicidad
     )
     
@@ -69,7 +180,7 @@ async def registrar_usuario(
     db.add(nuevo_carrito)
     db.commit()
 
-    return nuevo_usuario
+    return _usuario_publico(nuevo_usuario)
 
 # --- Endpoint para B02: Inicio de Sesión ---
 @router.post("/token", response_model=schemas.Token)
@@ -83,29 +194,29 @@ async def login_para_token(
     # Buscar usuario
     user = db.exec(select(models.Usuario).where(models.Usuario.correo == email)).first()
 
-    if not user or not verify_password(password, user.contrasena_hash):
+    if not user or not await verificar_en_pool(password, user.contrasena_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Credenciales inválidas",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # En un sistema real, aquí creas un JWT.
-    # Para mantenerlo simple ahora, usaremos el email como token
-    access_token = user.correo 
+    # Si cambió el costo de bcrypt, se actualiza el hash aprovechando la clave en claro
+    if necesita_rehash(user.contrasena_hash):
+        user.contrasena_hash = await hashear_en_pool(password)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+
+    # Token firmado con vencimiento; lleva id, estado y rol como claims
+    access_token = crear_token(user)
 
     return {
         "access_token": access_token, 
         "token_type": "bearer",
-        "usuario": user
+        "usuario": _usuario_publico(user)
     }
 
 @router.get("/me", response_model=schemas.Usuario)
-async def read_users_me(
-    token: str = Depends(schemas.Token), # Esto fuerza autenticación
-    db: Session = Depends(get_session)
-):
-    # Lógica simplificada: buscar usuario por el token (que es el email)
-    # Ojo: En producción usarías Depends(get_usuario_actual) directamente
-    user = db.exec(select(models.Usuario).where(models.Usuario.correo == token.access_token)).first()
-    return user
\ No newline at end of file
+async def read_users_me(user: models.Usuario = Depends(get_usuario_verificado)):
+    return _usuario_publico(user)
\ No newline at end of file
@@ -40,6 +40,9 @@ app.include_router(gestor_pedidos.router)
 app.include_router(gestor_facturacion.router)
 app.include_router(gestor_admin.router)
 
+# Sin esto los procesos de hashing quedan vivos tras apagar el servidor
+app.add_event_handler("shutdown", gestor_usuarios.cerrar_pool_hashing)
+
 
 # --- Endpoint Raíz ---
 @app.get("/")
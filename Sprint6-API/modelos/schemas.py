@@ -45,6 +45,12 @@ class CambioPassword(BaseModel):
     nueva_contrasena: str
     confirmar_nueva: str
 
+# Datos del usuario tal como vienen en los claims del token
+class UsuarioToken(BaseModel):
+    id: UUID4
+    estado: EstadoUsuario
+    rol: str = "cliente"
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from uuid import uuid4
+import pytest
+from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+from sqlmodel import Session, SQLModel, create_engine
+from gestores import gestor_usuarios
+from modelos import models
+
+# Medición opt-in, no corre con la suite normal. Los resultados se imprimen (-s).
+# Se corre desde Sprint6-API:
+#   RENDIMIENTO=1 python -m pytest -q -s tests/test_rendimiento.py
+
+pytestmark = pytest.mark.skipif(not os.getenv("RENDIMIENTO"), reason="medición opt-in: RENDIMIENTO=1")
+
+def _por_segundo(fn, segundos=2.0):
+    fn()
+    veces, inicio = 0, time.perf_counter()
+    while time.perf_counter() - inicio < segundos:
+        fn()
+        veces += 1
+    return veces / (time.perf_counter() - inicio)
+
+def test_peticiones_autenticadas_por_segundo():
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/rendimiento.db")
+    SQLModel.metadata.create_all(engine)
+    usuarios = models.Usuario.__table__
+    filas = [
+        {
+            "id": uuid4(), "nombre": f"Usuario {i}", "rut": f"{i}-K", "correo": f"u{i}@prueba.com",
+            "contrasena_hash": "x", "telefono": "", "estado": models.EstadoUsuarioEnum.ACTIVO,
+        }
+        for i in range(1000)
+    ]
+    filas.append(dict(filas[0], id=uuid4(), rut="0-0", correo="test@test.com"))
+    with engine.begin() as conexion:
+        conexion.execute(insert(usuarios), filas)
+
+    # El esquema anterior: el email era el token y cada petición lo buscaba en la
+    # BD, con una segunda lectura al usuario de pruebas si no aparecía.
+    # Se consulta la tabla sin el ORM (los mappers de este árbol no configuran).
+    def get_usuario_anterior(token: str = Depends(gestor_usuarios.oauth2_scheme)):
+        with Session(engine) as db:
+            user = db.exec(select(usuarios).where(usuarios.c.correo == token)).first()
+            if not user:
+                user = db.exec(select(usuarios).where(usuarios.c.correo == "test@test.com")).first()
+                if not user:
+                    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciales inválidas")
+            return user
+
+    app = FastAPI()
+
+    @app.get("/anterior")
+    def anterior(usuario=Depends(get_usuario_anterior)):
+        return {"id": str(usuario.id)}
+
+    @app.get("/claims")
+    def claims(usuario=Depends(gestor_usuarios.get_usuario_actual)):
+        return {"id": str(usuario.id)}
+
+    client = TestClient(app)
+    token = gestor_usuarios.crear_token(SimpleNamespace(id=filas[500]["id"], estado=filas[500]["estado"]))
+    pedir = lambda ruta, credencial: client.get(ruta, headers={"Authorization": f"Bearer {credencial}"})
+    assert pedir("/anterior", "u500@prueba.com").json() == pedir("/claims", token).json()
+
+    resultados = {
+        "anterior (1 lectura)": _por_segundo(lambda: pedir("/anterior", "u500@prueba.com")),
+        "anterior (2 lecturas)": _por_segundo(lambda: pedir("/anterior", "nadie@prueba.com")),
+        "claims del token": _por_segundo(lambda: pedir("/claims", token)),
+    }
+    print("\npeticiones autenticadas: " + ", ".join(f"{k} {v:,.1f} req/s" for k, v in resultados.items()))
+    assert resultados["claims del token"] > resultados["anterior (1 lectura)"]
@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from uuid import uuid4
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+from gestores import gestor_usuarios
+from modelos import models
+
+# Se corre desde Sprint6-API:  python -m pytest tests
+
+def _usuario(estado=models.EstadoUsuarioEnum.ACTIVO):
+    # crear_token solo lee id y estado: no hace falta mapear el modelo completo
+    return SimpleNamespace(id=uuid4(), estado=estado)
+
+def _actual(token):
+    return asyncio.run(gestor_usuarios.get_usuario_actual(token))
+
+def test_claims_del_token_autorizan_sin_bd():
+    user = _usuario()
+    usuario = _actual(gestor_usuarios.crear_token(user))
+    assert usuario.id == user.id
+    assert usuario.estado.value == "Activo"
+    assert usuario.rol == gestor_usuarios.ROL_POR_DEFECTO
+
+def test_usuario_no_activo_responde_403():
+    with pytest.raises(HTTPException) as error:
+        _actual(gestor_usuarios.crear_token(_usuario(models.EstadoUsuarioEnum.PENDIENTE)))
+    assert error.value.status_code == 403
+
+@pytest.mark.parametrize("token", [
+    # El esquema antiguo: el email como token
+    "juan@prueba.com",
+    # Firmado con otra clave
+    jwt.encode({"sub": str(uuid4()), "estado": "Activo"}, "otra-clave", algorithm="HS256"),
+    # Vencido
+    jwt.encode(
+        {"sub": str(uuid4()), "estado": "Activo", "exp": datetime.now(timezone.utc) - timedelta(minutes=1)},
+        gestor_usuarios.SECRET_KEY, algorithm=gestor_usuarios.ALGORITHM,
+    ),
+    # Sin claims obligatorios
+    jwt.encode({"sub": str(uuid4())}, gestor_usuarios.SECRET_KEY, algorithm=gestor_usuarios.ALGORITHM),
+])
+def test_token_invalido_responde_401(token):
+    with pytest.raises(HTTPException) as error:
+        _actual(token)
+    assert error.value.status_code == 401